@@ -1,17 +1,18 @@
+import time
+run_start = time.perf_counter()
+
 import streamlit as st
-import praw
-import nltk
-import string
-from nltk.corpus import stopwords
-from nltk.stem.porter import PorterStemmer
-from sentence_transformers import SentenceTransformer, util
-import pickle
 import random
 import requests
 from PIL import Image
 from io import BytesIO
-import torch
-from torch import nn
+import resources
+import bdi
+import cohort
+import metrics
+import reddit_client
+import scan
+from text_processing import transform_text
 
 st.set_page_config(
     page_title="Using Social Media Profile Analysis to Forecast Mental Health",
@@ -20,8 +21,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-nltk.download('stopwords')
-nltk.download('punkt_tab')
+resources.ensure_nltk_data()
 
 def display_post_and_result(post_data):
     st.markdown(f"<div class='post-title'>📝 {post_data['title']}</div>", unsafe_allow_html=True)
@@ -44,40 +44,82 @@ def display_post_and_result(post_data):
         </div>
         """, unsafe_allow_html=True)
 
-device = "cpu"
-client_id = st.secrets["client_id"]
-client_secret = st.secrets["client_secret"]
-user_agent = st.secrets["user_agent"]
+def display_scan(scan_data):
+    summary = scan_data['summary']
+    st.markdown(f"**r/{scan_data['subreddit']}**: {summary['flagged']} of {summary['posts']} posts flagged "
+                f"({summary['flagged_fraction']:.0%})")
+    st.dataframe(scan_data['rows'], use_container_width=True, hide_index=True,
+                 column_config={'url': st.column_config.LinkColumn('url')})
 
-tfidf = pickle.load(open('vectorizer.pkl', 'rb'))
-model = pickle.load(open('model.pkl', 'rb'))
+device = "cpu"
 
-ps = PorterStemmer()
-def transform_text(text):
-    text = text.lower()
-    text = nltk.word_tokenize(text)
-    y = [i for i in text if i.isalnum()]
-    y = [ps.stem(i) for i in y if i not in stopwords.words('english') and i not in string.punctuation]
-    return " ".join(y)
+if resources.SCORING_SERVICE_URL:
+    # models live in scoring_service.py, which batches across sessions and keeps its own memo
+    scoring_client = resources.get_scoring_client()
+    tfidf = model = prediction_memo = None
+else:
+    scoring_client = None
+    tfidf, model = resources.get_classifier()
+    prediction_memo = resources.get_prediction_memo()
 
-reddit = praw.Reddit(client_id=client_id, client_secret=client_secret, user_agent=user_agent)
+if resources.REDDIT_FIXTURE:
+    reddit = resources.get_reddit_backend()
+else:
+    reddit = resources.get_reddit_backend(st.secrets["client_id"], st.secrets["client_secret"], st.secrets["user_agent"])
 
-@st.cache_resource
 def load_sentence_transformer(model_name):
     try:
-        model = SentenceTransformer(model_name)
-        return model
+        return resources.get_embedder(model_name, device=device)
     except Exception as e:
         st.error(f"Error loading model: {str(e)}")
         return None
 
-embedder = load_sentence_transformer('all-MiniLM-L6-v2')
+embedder = scoring_client or load_sentence_transformer(resources.EMBEDDER_NAME)
 if embedder is None:
     st.error("Failed to initialize the sentence transformer model. Some functionality may be limited.")
 
+post_cache = resources.get_post_cache()
+# key option banks, cached embeddings and the index by the embedder that really encodes
+# (the service's when there is one), so vectors from different models never mix
+try:
+    embedding_id = resources.active_embedder_id()
+except Exception as e:
+    st.error(f"Error connecting to the scoring service at {resources.SCORING_SERVICE_URL}: {str(e)}")
+    st.stop()
+post_index = resources.get_post_index(embedding_id)
+
+if scoring_client is None:
+    resources.warm_up(tfidf, model, embedder, normalizer=transform_text)
+resources.record_run(time.perf_counter() - run_start)
+
+startup = resources.startup_report()
+with st.sidebar:
+    st.caption(f"Cold start: {startup['cold_start_seconds']:.2f} s")
+    if startup['last_rerun_seconds'] is not None:
+        st.caption(f"This rerun: {startup['last_rerun_seconds'] * 1000:.1f} ms ({startup['reruns']} reruns)")
+    cache_report = post_cache.report()
+    st.caption(f"Post cache: {cache_report['post_hits']} hits / {cache_report['post_misses']} misses, "
+               f"embeddings: {cache_report['embedding_hits']} hits / {cache_report['embedding_misses']} misses")
+    if prediction_memo is not None:
+        memo_report = prediction_memo.report()
+        st.caption(f"Prediction memo: {memo_report['hits'] + memo_report['disk_hits']} hits / "
+                   f"{memo_report['misses']} misses ({memo_report['entries']} entries)")
+    else:
+        st.caption(f"Scoring service: {resources.SCORING_SERVICE_URL}")
+    if hasattr(model, 'gate'):
+        cascade_report = model.report()
+        if cascade_report['rows']:
+            st.caption(f"Cascade: {cascade_report['skipped_svc_fraction']:.0%} of "
+                       f"{cascade_report['rows']} posts skipped the SVC")
+    if hasattr(reddit, 'limiter'):
+        reddit_report = reddit.report()
+        st.caption(f"Reddit budget: {reddit_report['limiter']['tokens']:.0f} tokens, "
+                   f"icon cache {reddit_report['metadata']['hits']} hits, "
+                   f"images {reddit_report['images']['hits']} hits")
+
 popular_subreddits = [
     # Mental Health & Psychology-Related Subreddits
-    "depression", "Anxiety", "socialanxiety", "SuicideWatch", "depression_help", "OCD", "bipolar", "BPD", "mentalhealth", "psychotherapy", "KindVoice", "lonely", "offmychest", "Vent", "ptsd", "CPTSD", "GriefSupport", "grief",
+    *scan.MENTAL_HEALTH_SUBREDDITS,
 
     # Emotional Expression Subreddits
     "TrueOffMyChest", "confession", "decidingtobebetter", "self", "MMFB",
@@ -89,135 +131,6 @@ popular_subreddits = [
     "GetMotivated", "productivity", "casualconversation", "simpleliving", "ZenHabits"
 ]
 
-bdi_questions = [
-    ("Sadness", [
-        "I do not feel sad",
-        "I feel sad",
-        "I am sad all the time",
-        "I am so sad or unhappy that I can't stand it"
-    ]),
-    ("Pessimism", [
-        "I am not discouraged about my future",
-        "I feel more discouraged about my future than I used to",
-        "I do not expect things to work out for me",
-        "I feel my future is hopeless"
-    ]),
-    ("Past failure", [
-        "I do not feel like a failure",
-        "I have failed more than I should have",
-        "As I look back, I see a lot of failures",
-        "I feel I am a complete failure"
-    ]),
-    ("Loss of pleasure", [
-        "I get as much pleasure as I ever did from the things I enjoy",
-        "I don't enjoy things as much as I used to",
-        "I get very little pleasure from the things I used to enjoy",
-        "I can't get any pleasure from the things I used to enjoy"
-    ]),
-    ("Guilty feelings", [
-        "I don't feel particularly guilty",
-        "I feel guilty over many things I have done or should have done",
-        "I feel quite guilty most of the time",
-        "I feel guilty all of the time"
-    ]),
-    ("Punishment feelings", [
-        "I don't feel I am being punished",
-        "I feel I may be punished",
-        "I expect to be punished",
-        "I feel I am being punished"
-    ]),
-    ("Self-dislike", [
-        "I feel the same about myself as ever",
-        "I have lost confidence in myself",
-        "I am disappointed in myself",
-        "I dislike myself"
-    ]),
-    ("Self-criticalness", [
-        "I don't criticize or blame myself more than usual",
-        "I am more critical of myself than I used to be",
-        "I criticize myself for all of my faults",
-        "I blame myself for everything bad that happens"
-    ]),
-    ("Suicidal thoughts", [
-        "I don't have any thoughts of killing myself",
-        "I have thoughts of killing myself, but I would not carry them out",
-        "I would like to kill myself",
-        "I would kill myself if I had the chance"
-    ]),
-    ("Crying", [
-        "I don't cry anymore than I used to",
-        "I cry more than I used to",
-        "I cry over every little thing",
-        "I feel like crying but I can't"
-    ]),
-    ("Agitation", [
-        "I am no more restless or wound up than usual",
-        "I feel more restless or wound up than usual",
-        "I am so restless or agitated that it's hard to stay still",
-        "I am so restless or agitated that I have to keep moving or doing something"
-    ]),
-    ("Loss of interest", [
-        "I have not lost interest in other people or activities",
-        "I am less interested in other people or things than before",
-        "I have lost most of my interest in other people or things",
-        "It's hard to get interested in anything"
-    ]),
-    ("Indecisiveness", [
-        "I make decisions about as well as ever",
-        "I find it more difficult to make decisions than usual",
-        "I have much greater difficulty in making decisions",
-        "I can't make decisions at all anymore"
-    ]),
-    ("Worthlessness", [
-        "I do not feel I am worthless",
-        "I don't consider myself as worthwhile and useful as I used to",
-        "I feel more worthless as compared to others",
-        "I feel utterly worthless"
-    ]),
-    ("Loss of energy", [
-        "I have as much energy as ever",
-        "I have less energy than I used to have",
-        "I don't have enough energy to do very much",
-        "I don't have enough energy to do anything"
-    ]),
-    ("Changes in sleeping pattern", [
-        "I have not experienced any change in my sleeping pattern",
-        "I sleep a little more or less than usual",
-        "I sleep a lot more or less than usual",
-        "I sleep most of the day or wake up early and can't get back to sleep"
-    ]),
-    ("Irritability", [
-        "I am no more irritable than usual",
-        "I am more irritable than usual",
-        "I am much more irritable than usual",
-        "I am irritable all the time"
-    ]),
-    ("Changes in appetite", [
-        "I have not experienced any change in my appetite",
-        "My appetite is somewhat less or greater than usual",
-        "My appetite is much less or greater than before",
-        "I have no appetite at all or I crave food all the time"
-    ]),
-    ("Concentration difficulty", [
-        "I can concentrate as well as ever",
-        "I can't concentrate as well as usual",
-        "It's hard to keep my mind on anything for long",
-        "I find I can't concentrate on anything"
-    ]),
-    ("Tiredness or fatigue", [
-        "I am no more tired or fatigued than usual",
-        "I get tired or fatigued more easily than usual",
-        "I am too tired or fatigued to do a lot of the things I used to do",
-        "I am too tired or fatigued to do most of the things I used to do"
-    ]),
-    ("Loss of interest in sex", [
-        "I have not noticed any recent change in my interest in sex",
-        "I am less interested in sex than I used to be",
-        "I am much less interested in sex now",
-        "I have lost interest in sex completely"
-    ])
-]
-
 st.markdown("""
     <style>
         .main {
@@ -381,215 +294,221 @@ with left_col:
 with middle_col:
     st.markdown('<div class="section-title">🔍 Subreddit Post Analysis</div>', unsafe_allow_html=True)
     subreddit_name = st.text_input("Enter subreddit name (or type 'random')", value='random', key='subreddit_input').strip().replace(" ", "")
+    scan_all = st.checkbox("Scan every fetched post", value=False,
+                           help="Score all hot/new/top posts instead of one random pick")
     analyze_button = st.button('Fetch and predict')
 
     if analyze_button:
-        try:
-            if subreddit_name == 'random':
-                subreddit_name = random.choice(popular_subreddits)
-                
-            subreddit = reddit.subreddit(subreddit_name)                
-            _ = subreddit.id
-            
-            random_post = None
+        with metrics.request('fetch_and_predict'):
             try:
-                all_posts = []
-                
-                try:
-                    hot_posts = list(subreddit.hot(limit=20))
-                    all_posts.extend(hot_posts)
-                except:
-                    st.warning("Could not fetch hot posts")
-                
-                try:
-                    new_posts = list(subreddit.new(limit=20))
-                    all_posts.extend(new_posts)
-                except:
-                    st.warning("Could not fetch new posts")
-                
-                try:
-                    top_posts = list(subreddit.top(time_filter='all', limit=20))
-                    all_posts.extend(top_posts)
-                except:
-                    st.warning("Could not fetch top posts")
-                
-                if all_posts:
-                    random_post = random.choice(all_posts)
-                else:
+                if subreddit_name == 'random':
+                    subreddit_name = random.choice(popular_subreddits)
+
+                all_posts, fetch_errors = scan.fetch_subreddit_posts(reddit, subreddit_name)
+                for message in fetch_errors:
+                    st.warning(message)
+
+                if not all_posts:
                     st.error(f"No posts found in r/{subreddit_name}")
                     st.stop()
-            except Exception as e:
-                st.error(f"Error: {e}")
-
-            if random_post is None:
-                st.error(f"No posts found in r/{subreddit_name}")
-                st.stop()
 
-            post_content = random_post.title + " " + random_post.selftext
-            
-            if 'posts_data' not in st.session_state:
-                st.session_state.posts_data = {}
-            
-            st.session_state.posts_data.pop('current_user', None)
-            
-            transformed_post = transform_text(post_content)
-            vector_input = tfidf.transform([transformed_post])
-            result = model.predict(vector_input.toarray())[0]
-            
-            st.session_state.posts_data['current_post'] = {
-                'subreddit': str(random_post.subreddit),
-                'author': str(random_post.author),
-                'content': random_post.selftext,
-                'title': random_post.title,
-                'url': f"https://www.reddit.com{random_post.permalink}",
-                'risk_result': result
-            }
+                if 'posts_data' not in st.session_state:
+                    st.session_state.posts_data = {}
+
+                st.session_state.posts_data.pop('current_user', None)
+                st.session_state.posts_data.pop('current_scan', None)
+
+                if scan_all:
+                    scored = scan.score_posts(all_posts, tfidf, model, memo=prediction_memo,
+                                              client=scoring_client)
+                    st.session_state.posts_data['current_scan'] = {
+                        'subreddit': subreddit_name,
+                        'summary': scan.summarize(scored),
+                        'rows': [s.as_row() for s in scored],
+                    }
+                    st.session_state.posts_data['current_post'] = scored[0].as_post_data()
+                    display_scan(st.session_state.posts_data['current_scan'])
+                else:
+                    scored = scan.score_posts([random.choice(all_posts)], tfidf, model, memo=prediction_memo,
+                                              client=scoring_client)
+                    st.session_state.posts_data['current_post'] = scored[0].as_post_data()
 
-            display_post_and_result(st.session_state.posts_data['current_post'])
+                display_post_and_result(st.session_state.posts_data['current_post'])
 
-        except Exception as e:
-            st.error(f"Error: {e}")
+            except Exception as e:
+                st.error(f"Error: {e}")
 
     elif 'posts_data' in st.session_state and 'current_post' in st.session_state.posts_data:
+        if 'current_scan' in st.session_state.posts_data:
+            display_scan(st.session_state.posts_data['current_scan'])
         display_post_and_result(st.session_state.posts_data['current_post'])
 
     # BDI-II Analysis Section
     st.subheader("📊 User BDI-II Analysis")
     reddit_user = st.text_input("Enter Reddit username")
+    full_history = st.checkbox("Full history", value=False,
+                               help=f"Page through up to {reddit_client.HISTORY_LIMIT} items instead of the latest {reddit_client.USER_POST_LIMIT} posts")
+    include_comments = st.checkbox("Include comments", value=False, disabled=not full_history)
     
     if st.button("Generate BDI-II Assessment"):
-        try:
-            redditor = reddit.redditor(reddit_user)
-            posts = [submission.title + " " + submission.selftext for submission in redditor.submissions.new(limit=25)]
-            
-            if not posts:
-                st.error("No posts found for this user.")
-                st.stop()
-
-            if 'posts_data' not in st.session_state:
-                st.session_state.posts_data = {}
-            st.session_state.posts_data['current_user'] = reddit_user
-
-            post_embeddings = embedder.encode(posts, convert_to_tensor=True)
-            bdi_score = 0
-            bdi_breakdown = []
-            SIMILARITY_THRESHOLD = 0.1  # Minimum similarity to consider a valid match
-            unmatched_questions = []
-            top_contributing_posts = []  # To hold (question, score, top posts)
-
-            for question, options in bdi_questions:
-                option_embeddings = embedder.encode(options, convert_to_tensor=True)
-                sims = util.cos_sim(post_embeddings, option_embeddings)  # shape: [num_posts, 4]
-            
-                avg_similarities = torch.mean(sims, dim=0)  # average over posts for each option
-                max_sim = torch.max(avg_similarities).item()
-            
-                if max_sim < SIMILARITY_THRESHOLD:
-                    score = 0
-                    unmatched_questions.append(question)
-                    contributing_posts = []
+        with metrics.request('bdi_assessment'):
+            try:
+                if full_history:
+                    # paged lazily and scored batch by batch, so memory stays flat
+                    history = reddit_client.as_backend(reddit).user_history(reddit_user, include_comments=include_comments)
+                    posts = (post.text for post in reddit_client.prefetch(history))
                 else:
-                    score = torch.argmax(avg_similarities).item()
-            
-                    option_idx = score
-                    post_sims = sims[:, option_idx]
-            
-                    top_post_indices = torch.topk(post_sims, k=min(3, len(posts))).indices.tolist()
-            
-                    contributing_posts = [posts[i] for i in top_post_indices]
-            
-                bdi_score += score
-                bdi_breakdown.append((question, score))
-                top_contributing_posts.append((question, score, contributing_posts))
-
-            if bdi_score <= 13:
-                severity = "Minimal Depression Indicators"
-                color = "#28a745"
-            elif bdi_score <= 19:
-                severity = "Mild Depression Indicators"
-                color = "#ffc107"
-            elif bdi_score <= 28:
-                severity = "Moderate Depression Indicators"
-                color = "#fd7e14"
-            else:
-                severity = "Severe Depression Indicators"
-                color = "#dc3545"
-
-            score_percent = int((bdi_score / 63) * 100)
+                    user_posts, fetch_errors = post_cache.fetch_user_posts(reddit, reddit_user)
+                    for message in fetch_errors:
+                        st.warning(message)
+                    posts = [post.text for post in user_posts]
+
+                option_bank = resources.get_bdi_option_bank(embedder, embedding_id)
+                scorer = bdi.BDIScorer(option_bank)
+                encode = lambda texts: post_cache.encode(embedder, embedding_id, texts)
+                for post_embeddings, batch in bdi.encode_batches(posts, encode):
+                    with metrics.timer('bdi_score'):
+                        scorer.add(post_embeddings, batch)
+                    with metrics.timer('index_add'):
+                        post_index.add(post_embeddings, batch, username=reddit_user)
+
+                if not scorer.count:
+                    st.error("No posts found for this user.")
+                    st.stop()
+
+                if 'posts_data' not in st.session_state:
+                    st.session_state.posts_data = {}
+                st.session_state.posts_data['current_user'] = reddit_user
+
+                assessment = scorer.result()
+                bdi_score = assessment.total
+                bdi_breakdown = assessment.breakdown
+                unmatched_questions = assessment.unmatched
+                top_contributing_posts = assessment.top_items
+                severity, color = bdi.severity(bdi_score)
+
+                score_percent = int((bdi_score / bdi.MAX_SCORE) * 100)
             
-            st.markdown(f"""
-            <div class="metric-box">
-                <h4>BDI-II Score Assessment</h4>
-                <div style="background-color: #e9ecef; border-radius: 8px; padding: 3px; margin: 10px 0;">
-                    <div style="width: {score_percent}%; background-color: {color}; height: 24px; border-radius: 5px; transition: width 0.5s ease-in-out;"></div>
+                st.markdown(f"""
+                <div class="metric-box">
+                    <h4>BDI-II Score Assessment</h4>
+                    <div style="background-color: #e9ecef; border-radius: 8px; padding: 3px; margin: 10px 0;">
+                        <div style="width: {score_percent}%; background-color: {color}; height: 24px; border-radius: 5px; transition: width 0.5s ease-in-out;"></div>
+                    </div>
+                    <h5>{severity}</h5>
+                    <p>Score: {bdi_score} / {bdi.MAX_SCORE} ({assessment.posts} posts)</p>
                 </div>
-                <h5>{severity}</h5>
-                <p>Score: {bdi_score} / 63</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-            with st.expander("View Detailed Breakdown"):
-                for question, score in bdi_breakdown:
-                    if score == 0: c = "#28a745"
-                    elif score == 1: c = "#ffc107"
-                    elif score == 2: c = "#fd7e14"
-                    else: c = "#dc3545"
+                """, unsafe_allow_html=True)
+
+                with st.expander("View Detailed Breakdown"):
+                    for question, score in bdi_breakdown:
+                        if score == 0: c = "#28a745"
+                        elif score == 1: c = "#ffc107"
+                        elif score == 2: c = "#fd7e14"
+                        else: c = "#dc3545"
                     
-                    st.markdown(f"""
-                    <div style="margin-bottom: 10px;">
-                        <p><strong>{question}</strong></p>
-                        <div style="background-color: #e9ecef; border-radius: 5px; padding: 2px;">
-                            <div style="width: {(score+1)*25}%; background-color: {c}; padding: 5px; border-radius: 3px; text-align: center; color: white;">
-                                Score: {score}/3
+                        st.markdown(f"""
+                        <div style="margin-bottom: 10px;">
+                            <p><strong>{question}</strong></p>
+                            <div style="background-color: #e9ecef; border-radius: 5px; padding: 2px;">
+                                <div style="width: {(score+1)*25}%; background-color: {c}; padding: 5px; border-radius: 3px; text-align: center; color: white;">
+                                    Score: {score}/3
+                                </div>
                             </div>
                         </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-            with st.expander("View Top Contributing Posts per Question"):
-                for question, score, posts_list in top_contributing_posts:
-                    st.markdown(f"### {question} — Score: {score}/3")
-                    if posts_list:
-                        for i, post in enumerate(posts_list, start=1):
-                            st.markdown(f"**Post {i}:** {post[:300]}{'...' if len(post) > 300 else ''}")
-                    else:
-                        st.write("_No strongly related posts found for this question._")
-                    st.markdown("---")
+                        """, unsafe_allow_html=True)
+
+                with st.expander("View Top Contributing Posts per Question"):
+                    for question, score, posts_list in top_contributing_posts:
+                        st.markdown(f"### {question} — Score: {score}/3")
+                        if posts_list:
+                            for i, post in enumerate(posts_list, start=1):
+                                st.markdown(f"**Post {i}:** {post[:300]}{'...' if len(post) > 300 else ''}")
+                        else:
+                            st.write("_No strongly related posts found for this question._")
+                        st.markdown("---")
+
+                with st.expander("Similar Posts from Past Assessments"):
+                    question_numbers = {question: q for q, (question, _) in enumerate(bdi.bdi_questions)}
+                    queries = [option_bank[question_numbers[question] * bdi.NUM_OPTIONS + score]
+                               for question, score, _ in top_contributing_posts]
+                    with metrics.timer('index_search'):
+                        similar = post_index.search(queries, k=5) if queries else []
+                    for (question, score, _), hits in zip(top_contributing_posts, similar):
+                        hits = [hit for hit in hits if hit['username'] != reddit_user]
+                        if hits:
+                            st.markdown(f"**{question}** — Score: {score}/3")
+                            for hit in hits:
+                                st.markdown(f"- u/{hit['username']} ({hit['score']:.2f}): "
+                                            f"{hit['text'][:200]}{'...' if len(hit['text']) > 200 else ''}")
+
+                if unmatched_questions:
+                    with st.expander("Skipped BDI-II Questions (no relevant content found)"):
+                        st.write(", ".join(unmatched_questions))
 
-            if unmatched_questions:
-                with st.expander("Skipped BDI-II Questions (no relevant content found)"):
-                    st.write(", ".join(unmatched_questions))
-
-        except Exception as e:
-            st.error(f"Error analyzing user: {e}")
+            except Exception as e:
+                st.error(f"Error analyzing user: {e}")
+
+    with st.expander("👥 Cohort BDI-II Assessment"):
+        usernames_file = st.file_uploader("Usernames file (one per line)", type=['txt', 'csv'])
+        cohort_timeout = st.number_input("Fetch timeout (s)", min_value=1.0, max_value=cohort.COHORT_TIMEOUT,
+                                         value=cohort.APP_COHORT_TIMEOUT, step=5.0,
+                                         help="Users not fetched in time are scored from cached posts, if any")
+        if usernames_file is not None and st.button("Assess cohort"):
+            with metrics.request('cohort_assessment'):
+                try:
+                    usernames = cohort.read_usernames(usernames_file.getvalue().decode('utf-8').splitlines())
+                    posts_by_user, cohort_errors = cohort.fetch_cohort(reddit, usernames, post_cache,
+                                                                       timeout=cohort_timeout)
+                    for name, messages in cohort_errors.items():
+                        st.warning(f"u/{name}: {'; '.join(messages)}")
+                    cohort_rows = cohort.assess_cohort(posts_by_user, embedder,
+                                                       resources.get_bdi_option_bank(embedder, embedding_id),
+                                                       post_cache, embedding_id)
+                    st.dataframe(cohort_rows, use_container_width=True, hide_index=True)
+                except Exception as e:
+                    st.error(f"Error assessing cohort: {e}")
 
 #Images and Additional Info
 with right_col:
     if 'posts_data' in st.session_state and ('current_post' in st.session_state.posts_data or 'current_user' in st.session_state.posts_data):
         
-        if 'current_post' in st.session_state.posts_data:
-            post = st.session_state.posts_data['current_post']
-            try:
-                subreddit = reddit.subreddit(post['subreddit'])
-                if hasattr(subreddit, 'icon_img') and subreddit.icon_img:
-                    st.image(subreddit.icon_img, width=150, caption=f"r/{post['subreddit']}")
-                st.markdown(f"""
-                **Subreddit**: r/{post['subreddit']}  
-                **Author**: u/{post['author']}  
-                [View Post]({post['url']})
-                """)
-            except:
-                st.markdown("Unable to fetch subreddit image")
-
-        if 'current_user' in st.session_state.posts_data:
-            try:
-                username = st.session_state.posts_data['current_user']
-                user = reddit.redditor(username)
-                if hasattr(user, 'icon_img') and user.icon_img:
-                    st.image(user.icon_img, width=150, caption=f"u/{username}")
-                st.markdown(f"""
-                **Username**: u/{username}  
-                [View Reddit Profile](https://www.reddit.com/user/{username})
-                """)
-            except:
-                st.markdown("Unable to fetch user image")
+        posts_data = st.session_state.posts_data
+        post = posts_data.get('current_post')
+        username = posts_data.get('current_user')
+        icons, icon_errors = reddit_client.fetch_icons(reddit, subreddit=post['subreddit'] if post else None,
+                                                       username=username, images=True)
+
+        if post:
+            if icons['subreddit']:
+                st.image(icons['subreddit'], width=150, caption=f"r/{post['subreddit']}")
+            st.markdown(f"""
+            **Subreddit**: r/{post['subreddit']}  
+            **Author**: u/{post['author']}  
+            [View Post]({post['url']})
+            """)
+
+        if username:
+            if icons['user']:
+                st.image(icons['user'], width=150, caption=f"u/{username}")
+            st.markdown(f"""
+            **Username**: u/{username}  
+            [View Reddit Profile](https://www.reddit.com/user/{username})
+            """)
+
+        for message in icon_errors:
+            st.caption(f"Unable to fetch image: {message}")
+
+with st.sidebar:
+    # display only, per session: collection itself is process-wide and set by the
+    # METRICS_* environment variables
+    if st.toggle("Latency metrics", key='show_latency_metrics', help="Show per-stage timings"):
+        stage_metrics = metrics.snapshot()
+        if not metrics.is_enabled():
+            st.caption("Timing is off; start the app with METRICS_ENABLED=1 to collect it.")
+        elif stage_metrics:
+            st.dataframe([{'stage': stage, **values} for stage, values in stage_metrics.items()],
+                         hide_index=True, use_container_width=True)
+            st.download_button("Prometheus metrics", metrics.prometheus_text(), file_name="metrics.prom")
+        else:
+            st.caption("No requests timed yet.")
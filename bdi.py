@@ -0,0 +1,324 @@
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from fileio import atomic_write
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BANK_DIR = os.path.join(BASE_DIR, '.cache', 'bdi_bank')
+
+SIMILARITY_THRESHOLD = 0.1  # Minimum similarity to consider a valid match
+TOP_K = 3
+STREAM_BATCH_SIZE = 64
+MAX_SCORE = 63
+
+bdi_questions = [
+    ("Sadness", [
+        "I do not feel sad",
+        "I feel sad",
+        "I am sad all the time",
+        "I am so sad or unhappy that I can't stand it"
+    ]),
+    ("Pessimism", [
+        "I am not discouraged about my future",
+        "I feel more discouraged about my future than I used to",
+        "I do not expect things to work out for me",
+        "I feel my future is hopeless"
+    ]),
+    ("Past failure", [
+        "I do not feel like a failure",
+        "I have failed more than I should have",
+        "As I look back, I see a lot of failures",
+        "I feel I am a complete failure"
+    ]),
+    ("Loss of pleasure", [
+        "I get as much pleasure as I ever did from the things I enjoy",
+        "I don't enjoy things as much as I used to",
+        "I get very little pleasure from the things I used to enjoy",
+        "I can't get any pleasure from the things I used to enjoy"
+    ]),
+    ("Guilty feelings", [
+        "I don't feel particularly guilty",
+        "I feel guilty over many things I have done or should have done",
+        "I feel quite guilty most of the time",
+        "I feel guilty all of the time"
+    ]),
+    ("Punishment feelings", [
+        "I don't feel I am being punished",
+        "I feel I may be punished",
+        "I expect to be punished",
+        "I feel I am being punished"
+    ]),
+    ("Self-dislike", [
+        "I feel the same about myself as ever",
+        "I have lost confidence in myself",
+        "I am disappointed in myself",
+        "I dislike myself"
+    ]),
+    ("Self-criticalness", [
+        "I don't criticize or blame myself more than usual",
+        "I am more critical of myself than I used to be",
+        "I criticize myself for all of my faults",
+        "I blame myself for everything bad that happens"
+    ]),
+    ("Suicidal thoughts", [
+        "I don't have any thoughts of killing myself",
+        "I have thoughts of killing myself, but I would not carry them out",
+        "I would like to kill myself",
+        "I would kill myself if I had the chance"
+    ]),
+    ("Crying", [
+        "I don't cry anymore than I used to",
+        "I cry more than I used to",
+        "I cry over every little thing",
+        "I feel like crying but I can't"
+    ]),
+    ("Agitation", [
+        "I am no more restless or wound up than usual",
+        "I feel more restless or wound up than usual",
+        "I am so restless or agitated that it's hard to stay still",
+        "I am so restless or agitated that I have to keep moving or doing something"
+    ]),
+    ("Loss of interest", [
+        "I have not lost interest in other people or activities",
+        "I am less interested in other people or things than before",
+        "I have lost most of my interest in other people or things",
+        "It's hard to get interested in anything"
+    ]),
+    ("Indecisiveness", [
+        "I make decisions about as well as ever",
+        "I find it more difficult to make decisions than usual",
+        "I have much greater difficulty in making decisions",
+        "I can't make decisions at all anymore"
+    ]),
+    ("Worthlessness", [
+        "I do not feel I am worthless",
+        "I don't consider myself as worthwhile and useful as I used to",
+        "I feel more worthless as compared to others",
+        "I feel utterly worthless"
+    ]),
+    ("Loss of energy", [
+        "I have as much energy as ever",
+        "I have less energy than I used to have",
+        "I don't have enough energy to do very much",
+        "I don't have enough energy to do anything"
+    ]),
+    ("Changes in sleeping pattern", [
+        "I have not experienced any change in my sleeping pattern",
+        "I sleep a little more or less than usual",
+        "I sleep a lot more or less than usual",
+        "I sleep most of the day or wake up early and can't get back to sleep"
+    ]),
+    ("Irritability", [
+        "I am no more irritable than usual",
+        "I am more irritable than usual",
+        "I am much more irritable than usual",
+        "I am irritable all the time"
+    ]),
+    ("Changes in appetite", [
+        "I have not experienced any change in my appetite",
+        "My appetite is somewhat less or greater than usual",
+        "My appetite is much less or greater than before",
+        "I have no appetite at all or I crave food all the time"
+    ]),
+    ("Concentration difficulty", [
+        "I can concentrate as well as ever",
+        "I can't concentrate as well as usual",
+        "It's hard to keep my mind on anything for long",
+        "I find I can't concentrate on anything"
+    ]),
+    ("Tiredness or fatigue", [
+        "I am no more tired or fatigued than usual",
+        "I get tired or fatigued more easily than usual",
+        "I am too tired or fatigued to do a lot of the things I used to do",
+        "I am too tired or fatigued to do most of the things I used to do"
+    ]),
+    ("Loss of interest in sex", [
+        "I have not noticed any recent change in my interest in sex",
+        "I am less interested in sex than I used to be",
+        "I am much less interested in sex now",
+        "I have lost interest in sex completely"
+    ])
+]
+
+
+NUM_QUESTIONS = len(bdi_questions)
+NUM_OPTIONS = len(bdi_questions[0][1])
+
+
+def option_texts(questions=bdi_questions):
+    return [option for _, options in questions for option in options]
+
+
+def questions_hash(questions=bdi_questions):
+    payload = json.dumps(questions, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def bank_path(embedder_name, questions=bdi_questions, cache_dir=BANK_DIR):
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', embedder_name)
+    return os.path.join(cache_dir, f"{safe_name}-{questions_hash(questions)}.npy")
+
+
+def l2_normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-8)
+
+
+def build_option_bank(embedder, embedder_name, questions=bdi_questions, cache_dir=BANK_DIR):
+    # The 84 option sentences never change, so they are encoded once per embedder and
+    # kept on disk; every later process just memory-maps the (84, dim) float32 matrix.
+    path = bank_path(embedder_name, questions, cache_dir)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        embeddings = l2_normalize(embedder.encode(option_texts(questions), convert_to_numpy=True))
+        with atomic_write(path) as f:
+            np.save(f, embeddings)
+    return np.load(path, mmap_mode='r')
+
+
+@dataclass
+class BDIAssessment:
+    total: int
+    breakdown: list  # (question, score)
+    unmatched: list  # questions with no option above the threshold
+    top_posts: list  # (question, score, [post indices])
+    option_means: np.ndarray = field(repr=False)  # (questions, options)
+    posts: int = 0
+    top_items: list = field(default=None, repr=False)  # (question, score, [items]) when items were passed
+
+
+class BDIScorer:
+    # Running form of the assessment: posts are added in batches and only the
+    # per-option similarity sums plus, for every option, its top_k posts so far are
+    # kept, so memory does not grow with history length. The question's top posts
+    # are read from the chosen option's list once the means are known. With a single
+    # batch this reproduces the one-shot computation exactly.
+    def __init__(self, option_bank, questions=bdi_questions, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K):
+        self.option_bank = np.asarray(option_bank, dtype=np.float32)
+        self.questions = questions
+        self.threshold = threshold
+        self.top_k = top_k
+        num_options = len(self.option_bank)
+        self.count = 0
+        self.sums = None
+        self.top_sims = np.empty((num_options, 0), dtype=np.float32)
+        self.top_indices = np.empty((num_options, 0), dtype=np.int64)
+        self.top_items = np.empty((num_options, 0), dtype=object)
+
+    def add(self, post_embeddings, items=None):
+        posts = l2_normalize(post_embeddings)
+        if not len(posts):
+            return
+        sims = posts @ self.option_bank.T  # (posts, options) cosine similarity in one matmul
+        batch_sums = sims.sum(axis=0)
+        # float32 like np.mean for one batch; float64 once batches are combined
+        self.sums = batch_sums if self.sums is None else self.sums.astype(np.float64) + batch_sums
+
+        # earlier posts come first, so the stable sort keeps the lowest index on ties
+        indices = np.arange(self.count, self.count + len(posts))
+        candidate_sims = np.concatenate([self.top_sims, sims.T], axis=1)
+        candidate_indices = np.concatenate([self.top_indices, np.broadcast_to(indices, sims.T.shape)], axis=1)
+        keep = np.argsort(-candidate_sims, axis=1, kind='stable')[:, :self.top_k]
+        self.top_sims = np.take_along_axis(candidate_sims, keep, axis=1)
+        self.top_indices = np.take_along_axis(candidate_indices, keep, axis=1)
+        if items is not None:
+            batch_items = np.empty(len(items), dtype=object)
+            batch_items[:] = list(items)
+            candidate_items = np.concatenate([self.top_items, np.broadcast_to(batch_items, sims.T.shape)], axis=1)
+            self.top_items = np.take_along_axis(candidate_items, keep, axis=1)
+        self.count += len(posts)
+
+    def result(self):
+        if not self.count:
+            raise ValueError("no posts were scored")
+        num_questions, num_options = len(self.questions), len(self.questions[0][1])
+        option_means = (self.sums / self.count).reshape(num_questions, num_options)  # average over posts
+        best = option_means.argmax(axis=1)
+        matched = option_means.max(axis=1) >= self.threshold
+        scores = np.where(matched, best, 0)
+        chosen = np.arange(num_questions) * num_options + scores
+        has_items = self.top_items.shape[1] == self.top_indices.shape[1]
+
+        breakdown, unmatched, top_posts, top_items = [], [], [], []
+        for q, (question, _) in enumerate(self.questions):
+            score = int(scores[q])
+            breakdown.append((question, score))
+            if matched[q]:
+                top_posts.append((question, score, self.top_indices[chosen[q]].tolist()))
+                top_items.append((question, score, self.top_items[chosen[q]].tolist() if has_items else []))
+            else:
+                unmatched.append(question)
+                top_posts.append((question, score, []))
+                top_items.append((question, score, []))
+
+        return BDIAssessment(
+            total=int(scores.sum()),
+            breakdown=breakdown,
+            unmatched=unmatched,
+            top_posts=top_posts,
+            option_means=option_means,
+            posts=self.count,
+            top_items=top_items if has_items else None,
+        )
+
+
+def score_embeddings(post_embeddings, option_bank, questions=bdi_questions,
+                     threshold=SIMILARITY_THRESHOLD, top_k=TOP_K):
+    scorer = BDIScorer(option_bank, questions, threshold, top_k)
+    scorer.add(post_embeddings)
+    return scorer.result()
+
+
+def score_groups(post_embeddings, group_sizes, option_bank, questions=bdi_questions,
+                 threshold=SIMILARITY_THRESHOLD):
+    # Many users at once: posts are stacked user after user (group_sizes[i] posts for
+    # user i, all > 0), one posts x options matmul covers everyone, and per-user option
+    # means come from a single segmented sum. Returns (scores (users, questions),
+    # option_means (users, questions, options)); no top posts are tracked.
+    posts = l2_normalize(post_embeddings)
+    group_sizes = np.asarray(group_sizes, dtype=np.int64)
+    num_questions, num_options = len(questions), len(questions[0][1])
+
+    sims = posts @ np.asarray(option_bank, dtype=np.float32).T
+    starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+    sums = np.add.reduceat(sims.astype(np.float64), starts, axis=0)
+    option_means = (sums / group_sizes[:, None]).reshape(len(group_sizes), num_questions, num_options)
+    matched = option_means.max(axis=2) >= threshold
+    scores = np.where(matched, option_means.argmax(axis=2), 0)
+    return scores, option_means
+
+
+def encode_batches(texts, encode, batch_size=STREAM_BATCH_SIZE):
+    # Consumes any iterable of texts lazily, yielding (embeddings, texts) per batch.
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield encode(batch), batch
+            batch = []
+    if batch:
+        yield encode(batch), batch
+
+
+def score_stream(batches, option_bank, questions=bdi_questions, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K):
+    # batches: iterable of (embeddings, items) such as encode_batches() produces
+    scorer = BDIScorer(option_bank, questions, threshold, top_k)
+    for embeddings, items in batches:
+        scorer.add(embeddings, items)
+    return scorer.result()
+
+
+def severity(bdi_score):
+    if bdi_score <= 13:
+        return "Minimal Depression Indicators", "#28a745"
+    elif bdi_score <= 19:
+        return "Mild Depression Indicators", "#ffc107"
+    elif bdi_score <= 28:
+        return "Moderate Depression Indicators", "#fd7e14"
+    return "Severe Depression Indicators", "#dc3545"
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+import bdi
+import classifier
+from text_processing import transform_text, transform_texts
+
+POSTS = 512
+WORDS = 120
+REPEAT = 5
+WARMUP = 1
+ENCODE_BATCH_SIZES = (1, 8, 32, 128)
+TOLERANCE = 0.10  # a stage more than 10% slower (p50) than the baseline is a regression
+SEED = 0
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_corpus(posts=POSTS, words=WORDS, vocabulary=None, seed=SEED):
+    # Zipf-ranked draws from real English plus the model's own vocabulary, post lengths
+    # Poisson around `words`, so normalisation and TF-IDF see realistic token mixes.
+    rng = np.random.default_rng(seed)
+    vocab = sorted({w.strip(".,'").lower() for text in bdi.option_texts() for w in text.split()} |
+                   set(vocabulary or ()))
+    ranks = rng.permutation(len(vocab))
+    weights = 1.0 / (ranks + 1.0)
+    weights /= weights.sum()
+    lengths = np.maximum(rng.poisson(words, size=posts), 1)
+    return [" ".join(rng.choice(vocab, size=n, p=weights)) for n in lengths]
+
+
+def fixture_corpus(path, posts=POSTS, text_column='text'):
+    # a reddit_client.py fixture or a CSV with a text column, cycled/truncated to `posts`
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            fixture = json.load(f)
+        entries = [post for sub in fixture.get('subreddits', {}).values()
+                   for listing in sub.get('listings', {}).values() for post in listing]
+        entries += [post for user in fixture.get('users', {}).values() for post in user.get('submissions', [])]
+        texts = [post['title'] + " " + post['content'] for post in entries]
+    else:
+        import pandas as pd
+        texts = pd.read_csv(path, usecols=[text_column], nrows=posts)[text_column].fillna('').astype(str).tolist()
+    if not texts:
+        raise ValueError(f"no posts in {path}")
+    return [texts[i % len(texts)] for i in range(posts)]
+
+
+def time_stage(fn, items, repeat=REPEAT, warmup=WARMUP):
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    seconds = np.array(seconds)
+    p50 = float(np.percentile(seconds, 50))
+    return {
+        'items': items,
+        'repeat': repeat,
+        'p50_ms': p50 * 1000,
+        'p95_ms': float(np.percentile(seconds, 95)) * 1000,
+        'mean_ms': float(seconds.mean()) * 1000,
+        'items_per_second': items / p50 if p50 else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def per_item_stage(fn, inputs, warmup=WARMUP):
+    # latency distribution of single calls, e.g. transform_text on one post
+    for item in inputs[:warmup]:
+        fn(item)
+    seconds = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        seconds.append(time.perf_counter() - start)
+    seconds = np.array(seconds)
+    return {
+        'items': len(inputs),
+        'repeat': 1,
+        'p50_ms': float(np.percentile(seconds, 50)) * 1000,
+        'p95_ms': float(np.percentile(seconds, 95)) * 1000,
+        'mean_ms': float(seconds.mean()) * 1000,
+        'items_per_second': len(inputs) / float(seconds.sum()) if seconds.sum() else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_suite(texts, vectorizer, model, embedder=None, embedder_name=None, repeat=REPEAT,
+              encode_batch_sizes=ENCODE_BATCH_SIZES, n_jobs=1):
+    stages = {}
+    stages['transform_text'] = per_item_stage(transform_text, texts)
+    stages['transform_texts'] = time_stage(lambda: transform_texts(texts, n_jobs=n_jobs), len(texts), repeat)
+
+    normalized = transform_texts(texts, n_jobs=n_jobs)
+    stages['tfidf_transform'] = time_stage(lambda: vectorizer.transform(normalized), len(texts), repeat)
+
+    X = vectorizer.transform(normalized)
+    X_dense = X.toarray()
+    stages['predict_sparse'] = time_stage(lambda: classifier.predict(model, X), len(texts), repeat)
+    stages['predict_dense'] = time_stage(lambda: model.predict(X_dense), len(texts), repeat)
+    del X_dense
+
+    if embedder is not None:
+        for batch_size in encode_batch_sizes:
+            batch = texts[:batch_size]
+            stages[f'encode_batch_{batch_size}'] = time_stage(
+                lambda: embedder.encode(batch, batch_size=batch_size, convert_to_numpy=True), len(batch), repeat)
+
+        import resources
+        option_bank = resources.get_bdi_option_bank(embedder, embedder_name)
+        user_posts = texts[:25]
+        embeddings = embedder.encode(user_posts, convert_to_numpy=True)
+        stages['bdi_score'] = time_stage(lambda: bdi.score_embeddings(embeddings, option_bank), len(user_posts), repeat)
+        stages['bdi_end_to_end'] = time_stage(
+            lambda: bdi.score_embeddings(embedder.encode(user_posts, convert_to_numpy=True), option_bank),
+            len(user_posts), repeat)
+    return stages
+
+
+def environment():
+    import scipy
+    import sklearn
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    # Returns one row per stage present in both runs; 'regression' marks p50 slowdowns
+    # beyond the tolerance.
+    rows = []
+    for stage, result in current['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        before, after = baseline['stages'][stage]['p50_ms'], result['p50_ms']
+        ratio = after / before if before else float('inf')
+        rows.append({'stage': stage, 'baseline_p50_ms': before, 'current_p50_ms': after, 'ratio': ratio,
+                     'regression': ratio > 1.0 + tolerance})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every inference stage and compare against a baseline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--out', default='benchmark.json')
+    run_parser.add_argument('--posts', type=int, default=POSTS)
+    run_parser.add_argument('--words', type=int, default=WORDS, help="mean words per synthetic post")
+    run_parser.add_argument('--fixture', help="reddit_client.py fixture (.json) or CSV corpus instead of synthetic")
+    run_parser.add_argument('--repeat', type=int, default=REPEAT)
+    run_parser.add_argument('--jobs', type=int, default=1)
+    run_parser.add_argument('--seed', type=int, default=SEED)
+    run_parser.add_argument('--no-embedder', action='store_true', help="skip the sentence-transformer stages")
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        rows = compare(baseline, current, args.tolerance)
+        for row in rows:
+            print(json.dumps(row))
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
+        return
+
+    import resources
+
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_vectorizer(), resources.get_model()
+    embedder = None if args.no_embedder else resources.get_embedder()
+
+    if args.fixture:
+        texts = fixture_corpus(args.fixture, args.posts)
+    else:
+        texts = synthetic_corpus(args.posts, args.words, vectorizer.get_feature_names_out(), args.seed)
+
+    stages = run_suite(texts, vectorizer, model, embedder, resources.embedder_id(), repeat=args.repeat,
+                       n_jobs=args.jobs)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'corpus': {'source': args.fixture or 'synthetic', 'posts': len(texts), 'words': args.words,
+                   'seed': args.seed},
+        'models': {'vectorizer': resources.VECTORIZER_PATH, 'model': resources.MODEL_PATH,
+                   'embedder': None if embedder is None else resources.embedder_id()},
+        'stages': stages,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for stage, result in stages.items():
+        print(f"{stage:<20} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+              f"{result['items_per_second'] or 0:10.1f} items/s")
+
+
+if __name__ == '__main__':
+    main()
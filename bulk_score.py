@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import classifier
+from fileio import atomic_write
+from text_processing import normalizer_pool, transform_texts
+
+CHUNK_ROWS = 50_000
+CHECKPOINT_FILE = '_checkpoint.json'
+
+
+def read_chunks(path, columns, chunk_rows=CHUNK_ROWS):
+    # Yields pandas DataFrames of at most chunk_rows rows holding only `columns`.
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+
+
+def part_path(out_dir, index):
+    return os.path.join(out_dir, f"part-{index:05d}.parquet")
+
+
+def load_checkpoint(out_dir, config):
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {'config': config, 'chunks_done': 0, 'rows_done': 0}
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint['config'].get('model_version') != config['model_version']:
+        raise ValueError(f"{out_dir} was scored by model {checkpoint['config'].get('model_version')}, not "
+                         f"{config['model_version']}; resuming would mix the two, use a fresh --out directory")
+    if checkpoint['config'] != config:
+        raise ValueError(f"{out_dir} holds a run with different settings {checkpoint['config']}; "
+                         f"use a fresh --out directory")
+    return checkpoint
+
+
+def save_checkpoint(out_dir, checkpoint):
+    with atomic_write(os.path.join(out_dir, CHECKPOINT_FILE), 'w') as f:
+        json.dump(checkpoint, f)
+
+
+def score_chunk(df, vectorizer, model, text_column, id_column=None, pool=None, first_row=0):
+    texts = df[text_column].fillna('').astype(str).tolist()
+    X = vectorizer.transform(transform_texts(texts, pool=pool))
+    columns = {'row': np.arange(first_row, first_row + len(texts), dtype=np.int64)}
+    if id_column:
+        columns[id_column] = df[id_column].to_numpy()
+    results, probabilities = classifier.predict_with_proba(model, X)
+    columns['risk_result'] = results.astype(np.int8)
+    if probabilities is not None:
+        columns['risk_probability'] = probabilities[:, 1].astype(np.float32)
+    return pa.table(columns)
+
+
+def score_file(path, out_dir, vectorizer, model, text_column='text', id_column=None, chunk_rows=CHUNK_ROWS,
+               n_jobs=1, log=None, model_version=None):
+    # One chunk in memory at a time: each is normalised across the worker pool,
+    # vectorised to CSR, scored, and written as its own Parquet part. The checkpoint
+    # is only advanced after a part is safely on disk, so a killed run resumes at the
+    # first unfinished chunk. model_version (resources.classifier_version()) is part of
+    # the checkpoint, so a retrained model never resumes another model's run.
+    os.makedirs(out_dir, exist_ok=True)
+    config = {'input': os.path.abspath(path), 'text_column': text_column, 'id_column': id_column,
+              'chunk_rows': chunk_rows, 'model_version': model_version}
+    checkpoint = load_checkpoint(out_dir, config)
+    columns = [text_column] + ([id_column] if id_column else [])
+
+    pool = normalizer_pool(n_jobs) if n_jobs > 1 else None
+    start = time.perf_counter()
+    rows_scored = 0
+    try:
+        for index, df in enumerate(read_chunks(path, columns, chunk_rows)):
+            if index < checkpoint['chunks_done']:
+                continue
+            chunk_start = time.perf_counter()
+            table = score_chunk(df, vectorizer, model, text_column, id_column, pool, checkpoint['rows_done'])
+            with atomic_write(part_path(out_dir, index)) as f:
+                pq.write_table(table, f)
+
+            checkpoint['chunks_done'] = index + 1
+            checkpoint['rows_done'] += len(df)
+            save_checkpoint(out_dir, checkpoint)
+            rows_scored += len(df)
+            if log:
+                log({'chunk': index, 'rows': len(df), 'rows_done': checkpoint['rows_done'],
+                     'chunk_rows_per_second': len(df) / (time.perf_counter() - chunk_start),
+                     'rows_per_second': rows_scored / (time.perf_counter() - start)})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - start
+    return {'rows_total': checkpoint['rows_done'], 'rows_scored': rows_scored, 'chunks': checkpoint['chunks_done'],
+            'seconds': elapsed, 'rows_per_second': rows_scored / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet corpus chunk by chunk into a Parquet dataset.")
+    parser.add_argument('input')
+    parser.add_argument('--out', required=True, help="output directory of part-*.parquet files (resumable)")
+    parser.add_argument('--text-column', default='text')
+    parser.add_argument('--id-column', help="carry this input column through to the output")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    import resources
+
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_classifier()
+    summary = score_file(args.input, args.out, vectorizer, model, text_column=args.text_column,
+                         id_column=args.id_column, chunk_rows=args.chunk_rows, n_jobs=args.jobs,
+                         log=lambda m: print(json.dumps(m), file=sys.stderr, flush=True),
+                         model_version=resources.classifier_version())
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
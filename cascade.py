@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import classifier
+import metrics
+import model_export
+from fileio import atomic_write
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GATE_PATH = os.path.join(BASE_DIR, 'cascade_gate.json')
+FORMAT_VERSION = 1
+MAX_DISAGREEMENT = 0.001  # share of calibration posts the cheap stage may label differently from the full stack
+THRESHOLD = 0.5
+MIN_MARGIN = 0.05  # posts this close to THRESHOLD always get the full stack, however clean calibration was
+
+
+class StackMembers:
+    # The three base members and the meta-model of a binary stack as separate calls,
+    # so LR/NB can run on every post and the SVC only on some. Works for sklearn's
+    # StackingClassifier and model_export.CompactStackingModel alike (and keeps the
+    # per-member model_lr/model_nb/model_svc timers metrics.instrument_model uses).
+    def __init__(self, model):
+        model = metrics.unwrap(model)
+        if isinstance(model, model_export.CompactStackingModel):
+            self.lr, self.nb, self.svc = model.lr_proba, model.nb_proba, model.svc_proba
+            self.meta_coef = np.asarray(model.meta_coef[0], dtype=np.float64)
+            self.meta_intercept = float(model.meta_intercept[0])
+        else:
+            members = model_export._members(model)
+            lr, nb, svc = members['lr'], members['nb'], members['svc']
+            self.lr = lambda X: lr.predict_proba(X)[:, 1]
+            self.nb = lambda X: nb.predict_proba(X)[:, 1]
+            # a dense-fitted SVC (the shipped model.pkl) still gets its rows densified in batches
+            self.svc = lambda X: classifier.predict_proba(svc, X)[:, 1]
+            self.meta_coef = np.asarray(model.final_estimator_.coef_[0], dtype=np.float64)
+            self.meta_intercept = float(model.final_estimator_.intercept_[0])
+        self.lr = metrics.timed('model_lr')(self.lr)
+        self.nb = metrics.timed('model_nb')(self.nb)
+        self.svc = metrics.timed('model_svc')(self.svc)
+        self.classes_ = np.asarray(model.classes_)
+
+    def meta(self, lr, nb, svc):
+        decision = np.column_stack([lr, nb, svc]) @ self.meta_coef + self.meta_intercept
+        return 1.0 / (1.0 + np.exp(-decision))
+
+
+def cheap_proba(members, gate, lr, nb):
+    # the meta-model with the SVC's probability replaced by its linear estimate from LR/NB
+    w = gate['svc_estimate']
+    svc = np.clip(w[0] + w[1] * lr + w[2] * nb, 0.0, 1.0)
+    return members.meta(lr, nb, svc)
+
+
+class CascadeModel:
+    # LR and MNB score every post; only posts whose cheap probability falls inside
+    # the calibrated [low, high] band also run the sigmoid SVC and the real
+    # meta-model. Everything else keeps the cheap probability, which lies on the
+    # same scale as the full stack's. Thresholds come from `python cascade.py calibrate`.
+    def __init__(self, model, gate):
+        if gate.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"unsupported cascade gate version {gate.get('format_version')}")
+        self.model = model
+        self.members = StackMembers(model)
+        self.gate = gate
+        self.low, self.high = float(gate['low']), float(gate['high'])
+        self.classes_ = self.members.classes_
+        self.n_features_in_ = getattr(model, 'n_features_in_', None)
+        self.stats = dict.fromkeys(('rows', 'full'), 0)
+        self._lock = threading.Lock()
+
+    def positive_proba(self, X):
+        if X.shape[0] == 0:
+            return np.zeros(0)
+        lr, nb = self.members.lr(X), self.members.nb(X)
+        p = cheap_proba(self.members, self.gate, lr, nb)
+        uncertain = np.flatnonzero((p >= self.low) & (p <= self.high))
+        if len(uncertain):
+            svc = self.members.svc(X[uncertain])
+            p[uncertain] = self.members.meta(lr[uncertain], nb[uncertain], svc)
+        with self._lock:
+            self.stats['rows'] += X.shape[0]
+            self.stats['full'] += len(uncertain)
+        return p
+
+    def predict_proba(self, X):
+        p1 = self.positive_proba(X)
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, X):
+        return self.classes_[(self.positive_proba(X) > THRESHOLD).astype(int)]
+
+    def report(self):
+        with self._lock:
+            rows, full = self.stats['rows'], self.stats['full']
+        return {'rows': rows, 'full_stack': full, 'skipped_svc_fraction': 1 - full / rows if rows else None,
+                'low': self.low, 'high': self.high}
+
+
+def fit_gate(model, X, max_disagreement=MAX_DISAGREEMENT, min_margin=MIN_MARGIN, version=None):
+    # Calibrates against the full stack's own output on X, not the labels: the SVC
+    # estimate is a least-squares fit on LR/NB, and low/high are the widest cut-offs
+    # below/above which at most max_disagreement/2 of the posts each would be
+    # labelled differently from the full model.
+    members = StackMembers(model)
+    lr, nb, svc = members.lr(X), members.nb(X), members.svc(X)
+    full = members.meta(lr, nb, svc)
+    design = np.column_stack([np.ones_like(lr), lr, nb])
+    w = np.linalg.lstsq(design, svc, rcond=None)[0]
+    gate = {'format_version': FORMAT_VERSION, 'classifier_version': version,
+            'svc_estimate': [float(v) for v in w], 'max_disagreement': max_disagreement, 'min_margin': min_margin}
+    p = cheap_proba(members, gate, lr, nb)
+
+    k = int(max_disagreement * len(p) / 2)
+    positives = np.sort(p[full > THRESHOLD])
+    negatives = np.sort(p[full <= THRESHOLD])[::-1]
+    low = positives[k] if k < len(positives) else THRESHOLD
+    high = negatives[k] if k < len(negatives) else THRESHOLD
+    # skipped posts are labelled by the cheap probability, so the band must contain THRESHOLD
+    gate['low'] = float(min(low, THRESHOLD - min_margin))
+    gate['high'] = float(max(high, THRESHOLD + min_margin))
+    return gate
+
+
+def agreement_report(model, gate, X, labels=None):
+    # full stack vs cascade on the same rows: flagged-set agreement, SVC traffic and time per post
+    from sklearn.metrics import f1_score
+
+    start = time.perf_counter()
+    full = classifier.predict_proba(model, X)[:, 1]
+    full_seconds = time.perf_counter() - start
+
+    cascade = CascadeModel(model, gate)
+    start = time.perf_counter()
+    fast = cascade.positive_proba(X)
+    cascade_seconds = time.perf_counter() - start
+
+    full_flagged, fast_flagged = full > THRESHOLD, fast > THRESHOLD
+    rows = len(full)
+    report = {
+        'rows': rows,
+        'agreement': float(np.mean(full_flagged == fast_flagged)),
+        'newly_flagged': int(np.sum(fast_flagged & ~full_flagged)),
+        'missed_flags': int(np.sum(full_flagged & ~fast_flagged)),
+        'skipped_svc_fraction': cascade.report()['skipped_svc_fraction'],
+        'max_probability_change': float(np.max(np.abs(full - fast))) if rows else 0.0,
+        'full_ms_per_post': full_seconds / rows * 1000 if rows else None,
+        'cascade_ms_per_post': cascade_seconds / rows * 1000 if rows else None,
+        'speedup': full_seconds / cascade_seconds if cascade_seconds else None,
+    }
+    if labels is not None:
+        report['full_f1'] = f1_score(labels, full_flagged.astype(int))
+        report['cascade_f1'] = f1_score(labels, fast_flagged.astype(int))
+    return report
+
+
+def save_gate(gate, path=GATE_PATH):
+    with atomic_write(path, 'w') as f:
+        json.dump(gate, f, indent=2)
+
+
+def load_gate(path=GATE_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def held_out(data, limit=None, jobs=1):
+    # the classifier's held-out split, halved: calibration rows and validation rows
+    from sklearn.model_selection import train_test_split
+    from text_processing import transform_texts
+
+    texts, y = classifier.load_dataset(data)
+    _, test_texts, _, y_test = train_test_split(
+        texts, y, test_size=classifier.TEST_SIZE, random_state=classifier.RANDOM_STATE)
+    if limit:
+        test_texts, y_test = test_texts[:limit], y_test[:limit]
+    half = len(test_texts) // 2
+    normalized = transform_texts(test_texts, n_jobs=jobs)
+    return (normalized[:half], y_test[:half]), (normalized[half:], y_test[half:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate and check the LR/NB -> full-stack cascade for the "
+                                                 "classifier that resources.get_classifier() serves.")
+    parser.add_argument('--gate', default=GATE_PATH)
+    parser.add_argument('--data', default='Suicide_Detection.csv')
+    parser.add_argument('--limit', type=int, help="use only the first N held-out rows")
+    parser.add_argument('--jobs', type=int, default=1)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="fit thresholds on half the held-out split and "
+                                                               "report on the other half")
+    calibrate_parser.add_argument('--max-disagreement', type=float, default=MAX_DISAGREEMENT)
+    calibrate_parser.add_argument('--min-margin', type=float, default=MIN_MARGIN)
+    subparsers.add_parser('report', help="re-check an existing gate on the validation half")
+    args = parser.parse_args()
+
+    import resources
+
+    if resources.ONLINE_MODEL_PATH:
+        parser.error("the cascade needs the stacking classifier, not the online model")
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_classifier()
+    model = getattr(model, 'model', model)
+    (calibration_texts, _), (validation_texts, validation_labels) = held_out(args.data, args.limit, args.jobs)
+
+    if args.command == 'calibrate':
+        gate = fit_gate(model, vectorizer.transform(calibration_texts), args.max_disagreement, args.min_margin,
+                        version=resources.classifier_version(cascade=False))
+        gate['calibration_rows'] = len(calibration_texts)
+    else:
+        gate = load_gate(args.gate)
+    report = agreement_report(model, gate, vectorizer.transform(validation_texts), validation_labels)
+    if args.command == 'calibrate':
+        gate['validation'] = report
+        save_gate(gate, args.gate)
+    print(json.dumps({'low': gate['low'], 'high': gate['high'], **report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
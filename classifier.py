@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.ensemble import StackingClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score, precision_score
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.preprocessing import LabelEncoder
+from sklearn.svm import SVC
+
+import metrics
+
+MAX_FEATURES = 5000
+DENSE_BATCH_SIZE = 256
+TEST_SIZE = 0.2
+RANDOM_STATE = 2
+
+
+def build_vectorizer(max_features=MAX_FEATURES, dtype=np.float32):
+    return TfidfVectorizer(max_features=max_features, dtype=dtype)
+
+
+def build_stacking_model(n_jobs=None):
+    # Same stack as the notebook: tfidf -> (L1 LR, MNB, sigmoid SVC) -> L1 LR
+    base_models = [
+        ('lrc', LogisticRegression(solver='liblinear', penalty='l1')),
+        ('nb', MultinomialNB()),
+        ('svc', SVC(kernel='sigmoid', gamma=1.0, probability=True)),
+    ]
+    meta_model = LogisticRegression(solver='liblinear', penalty='l1')
+    return StackingClassifier(estimators=base_models, final_estimator=meta_model, n_jobs=n_jobs)
+
+
+def _fitted_estimators(model):
+    model = metrics.unwrap(model)
+    if isinstance(model, StackingClassifier):
+        return list(model.estimators_) + [model.final_estimator_]
+    return [model]
+
+
+def accepts_sparse(model):
+    # libsvm refuses CSR input when the SVC was fitted on a dense matrix (the shipped
+    # model.pkl); every other member of the stack handles sparse input natively.
+    for estimator in _fitted_estimators(model):
+        if isinstance(estimator, SVC) and not estimator._sparse:
+            return False
+    return True
+
+
+def _call(model, method, X, batch_size):
+    predict_fn = getattr(model, method)
+    if sp.issparse(X) and accepts_sparse(model):
+        return predict_fn(X.tocsr())
+
+    # Dense fallback: only batch_size rows are densified at a time.
+    if sp.issparse(X):
+        X = X.tocsr()
+    outputs = []
+    for start in range(0, X.shape[0], batch_size):
+        batch = X[start:start + batch_size]
+        outputs.append(predict_fn(batch.toarray() if sp.issparse(batch) else batch))
+    return np.concatenate(outputs)
+
+
+def predict(model, X, batch_size=DENSE_BATCH_SIZE):
+    return _call(model, 'predict', X, batch_size)
+
+
+def predict_proba(model, X, batch_size=DENSE_BATCH_SIZE):
+    return _call(model, 'predict_proba', X, batch_size)
+
+
+def predict_with_proba(model, X, batch_size=DENSE_BATCH_SIZE):
+    # (labels, probabilities) from one pass through the model: labels are the argmax
+    # of predict_proba, so the stack (and its SVC) does not run a second time for
+    # predict(). Models without predict_proba give (labels, None).
+    if not hasattr(model, 'predict_proba'):
+        return predict(model, X, batch_size), None
+    probabilities = predict_proba(model, X, batch_size)
+    return np.asarray(model.classes_)[probabilities.argmax(axis=1)], probabilities
+
+
+def load_dataset(path, text_column='text', label_column='class'):
+    # Mirrors the notebook's cleaning: label-encode the class column and drop posts
+    # whose character count is more than 3 standard deviations from the mean.
+    df = pd.read_csv(path)
+    df = df.drop(columns=['Unnamed: 0'], errors='ignore')
+    df = df.dropna(subset=[text_column, label_column])
+    df[label_column] = LabelEncoder().fit_transform(df[label_column])
+    num_characters = df[text_column].str.len()
+    upper_limit = num_characters.mean() + 3 * num_characters.std()
+    lower_limit = num_characters.mean() - 3 * num_characters.std()
+    df = df.loc[(num_characters < upper_limit) & (num_characters > lower_limit)]
+    return df[text_column].tolist(), df[label_column].to_numpy()
+
+
+def fit_sparse_model(transformed_texts, labels, max_features=MAX_FEATURES, n_jobs=None):
+    vectorizer = build_vectorizer(max_features)
+    X = vectorizer.fit_transform(transformed_texts)
+    model = build_stacking_model(n_jobs=n_jobs)
+    model.fit(X, labels)
+    return vectorizer, model
+
+
+def evaluate(model, X, y):
+    y_pred = predict(model, X)
+    return {
+        'accuracy': accuracy_score(y, y_pred),
+        'precision': precision_score(y, y_pred),
+        'f1': f1_score(y, y_pred),
+    }
+
+
+def dense_agreement(model, X):
+    # share of rows where sparse input and batch-densified input give the same label
+    sparse_pred = predict(model, X)
+    dense_pred = np.concatenate([model.predict(X[i:i + DENSE_BATCH_SIZE].toarray())
+                                 for i in range(0, X.shape[0], DENSE_BATCH_SIZE)])
+    return float(np.mean(sparse_pred == dense_pred))
+
+
+def main():
+    # training lives in train.py (cached features, parallel fits); kept as an alias
+    import train
+    train.main()
+
+
+if __name__ == '__main__':
+    main()
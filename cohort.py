@@ -0,0 +1,127 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+import bdi
+import metrics
+from reddit_client import USER_POST_LIMIT, as_backend, fetch_all
+from reddit_scheduler import BULK, priority
+
+ENCODE_BATCH_SIZE = 256
+COHORT_TIMEOUT = 60.0  # one deadline for fetching the whole cohort (CLI default)
+APP_COHORT_TIMEOUT = 20.0  # default in the app, where the fetch blocks the Streamlit script
+
+
+def read_usernames(lines):
+    # one username per line, optional u/ prefix, blank lines and # comments skipped
+    names = []
+    for line in lines:
+        name = line.split('#', 1)[0].strip()
+        if name.startswith(('u/', '/u/')):
+            name = name.split('u/', 1)[1]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def fetch_cohort(backend, usernames, cache=None, limit=USER_POST_LIMIT, timeout=COHORT_TIMEOUT):
+    # All users are fetched concurrently as one fetch_all group. With a PostCache, users
+    # seen recently only download newer submissions and a failed fetch serves the
+    # cached history. Users not fetched within `timeout` keep their cached posts (or
+    # none) and get an error, so a slow cohort yields partial results, not a stall.
+    # Returns ({username: [Post]}, {username: [error]}).
+    backend = as_backend(backend)
+    befores = {name: cache.fetch_before(name) if cache else None for name in usernames}
+    calls = {f"u/{name}": (backend.user_submissions, name, limit, befores[name]) for name in usernames}
+    with priority(BULK):  # interactive sessions go first when the rate limit is tight
+        results, fetch_errors = fetch_all(calls, timeout)
+
+    posts, errors = {}, {}
+    for name in usernames:
+        fetched = results.get(f"u/{name}")
+        user_errors = [fetch_errors[f"u/{name}"]] if f"u/{name}" in fetch_errors else []
+        if cache is not None:
+            posts[name], user_errors = cache.merge_fetched(name, fetched or [], user_errors, befores[name], limit)
+        else:
+            posts[name] = fetched or []
+        if user_errors:
+            errors[name] = user_errors
+    return posts, errors
+
+
+def assess_cohort(posts_by_user, embedder, option_bank, cache=None, model_name=None,
+                  batch_size=ENCODE_BATCH_SIZE):
+    # Every post of every user goes through the embedder in shared batches, then one
+    # grouped similarity/aggregation scores all users together.
+    users = [name for name, posts in posts_by_user.items() if posts]
+    texts = [post.text for name in users for post in posts_by_user[name]]
+    sizes = [len(posts_by_user[name]) for name in users]
+
+    rows = []
+    if users:
+        if cache is not None:
+            # PostCache.encode times its own embedder calls, so only the uncached path is timed here
+            embeddings = cache.encode(embedder, model_name, texts, batch_size=batch_size)
+        else:
+            with metrics.timer('embed'):
+                embeddings = embedder.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        with metrics.timer('bdi_score'):
+            scores, _ = bdi.score_groups(embeddings, sizes, option_bank)
+        for name, size, user_scores in zip(users, sizes, scores):
+            total = int(user_scores.sum())
+            row = {'username': name, 'posts': size, 'bdi_score': total, 'severity': bdi.severity(total)[0]}
+            row.update((question, int(score)) for (question, _), score in zip(bdi.bdi_questions, user_scores))
+            rows.append(row)
+
+    for name, posts in posts_by_user.items():
+        if not posts:
+            rows.append({'username': name, 'posts': 0, 'bdi_score': None, 'severity': None})
+    return rows
+
+
+def write_table(rows, path):
+    fields = ['username', 'posts', 'bdi_score', 'severity'] + [question for question, _ in bdi.bdi_questions]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BDI-II assessment for every username in a file.")
+    parser.add_argument('usernames', help="text file, one username per line")
+    parser.add_argument('--out', default='cohort.csv')
+    parser.add_argument('--limit', type=int, default=USER_POST_LIMIT)
+    parser.add_argument('--timeout', type=float, default=COHORT_TIMEOUT)
+    parser.add_argument('--no-cache', action='store_true', help="skip the local post/embedding cache")
+    args = parser.parse_args()
+
+    import resources
+
+    with open(args.usernames, encoding='utf-8') as f:
+        usernames = read_usernames(f)
+    if resources.REDDIT_FIXTURE:
+        backend = resources.get_reddit_backend()
+    else:
+        backend = resources.get_reddit_backend(os.environ['REDDIT_CLIENT_ID'], os.environ['REDDIT_CLIENT_SECRET'],
+                                               os.environ['REDDIT_USER_AGENT'])
+    embedder = resources.get_embedder()
+    cache = None if args.no_cache else resources.get_post_cache()
+
+    posts_by_user, errors = fetch_cohort(backend, usernames, cache, args.limit, args.timeout)
+    for name, messages in errors.items():
+        print(json.dumps({'username': name, 'errors': messages}), file=sys.stderr)
+    rows = assess_cohort(posts_by_user, embedder, resources.get_bdi_option_bank(embedder), cache,
+                         resources.embedder_id())
+    write_table(rows, args.out)
+    scored = [row['bdi_score'] for row in rows if row['bdi_score'] is not None]
+    print(json.dumps({'users': len(rows), 'scored': len(scored), 'out': args.out,
+                      'mean_bdi_score': float(np.mean(scored)) if scored else None}))
+
+
+if __name__ == '__main__':
+    main()
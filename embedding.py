@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ONNX_DIR = os.path.join(BASE_DIR, '.cache', 'onnx')
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's max_seq_length
+BATCH_SIZE = 32
+OPSET = 14
+
+
+def onnx_dir(model_name, root=ONNX_DIR):
+    return os.path.join(root, model_name.replace('/', '_'))
+
+
+class OnnxEmbedder:
+    # Drop-in for SentenceTransformer.encode on all-MiniLM-L6-v2 (transformer -> mean
+    # pooling -> L2 normalise) running an exported, dynamically int8-quantised graph in
+    # ONNX Runtime. Texts are sorted by token count before batching so each batch is
+    # only padded to its own longest member.
+    def __init__(self, model_dir, threads=None, quantized=True, max_seq_length=MAX_SEQ_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        graph = 'model_int8.onnx' if quantized else 'model.onnx'
+        self.session = ort.InferenceSession(os.path.join(model_dir, graph), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+        self.max_seq_length = max_seq_length
+        self.backend = 'onnx-int8' if quantized else 'onnx'
+
+    def _run(self, encoded):
+        lengths = max(len(ids) for ids in encoded)
+        input_ids = np.zeros((len(encoded), lengths), dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for row, ids in enumerate(encoded):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, sentences, batch_size=BATCH_SIZE, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)['input_ids']
+        order = np.argsort([len(ids) for ids in encoded], kind='stable')
+
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            vectors = self._run([encoded[i] for i in batch])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name, out_dir, quantize=True, opset=OPSET):
+    # Exports the transformer of a locally cached SentenceTransformer (no network) and
+    # writes model.onnx, model_int8.onnx and the tokenizer files into out_dir.
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    try:
+        import onnx  # noqa: F401 -- torch.onnx.export and quantize_dynamic both need it
+    except ImportError:
+        raise RuntimeError("exporting the embedder needs the 'onnx' package (pip install onnx)") from None
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0]
+    auto_model = transformer.auto_model.eval()
+    os.makedirs(out_dir, exist_ok=True)
+    transformer.tokenizer.save_pretrained(out_dir)
+
+    dummy = transformer.tokenizer(['warm up'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+    fp32_path = os.path.join(out_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(auto_model, tuple(dummy[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=['last_hidden_state'],
+                          dynamic_axes={name: {0: 'batch', 1: 'sequence'}
+                                        for name in input_names + ['last_hidden_state']},
+                          opset_version=opset)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(out_dir, 'model_int8.onnx'), weight_type=QuantType.QInt8)
+    with open(os.path.join(out_dir, 'export.json'), 'w', encoding='utf-8') as f:
+        json.dump({'model': model_name, 'max_seq_length': st_model.max_seq_length, 'opset': opset}, f)
+    return out_dir
+
+
+def accuracy_report(reference, candidate, texts, user_size=25, batch_size=BATCH_SIZE):
+    # Encodes `texts` with both embedders, then treats every user_size consecutive
+    # posts as one user and checks the per-question BDI-II argmax agrees.
+    import bdi
+
+    start = time.perf_counter()
+    ref = np.asarray(reference.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    cand = np.asarray(candidate.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    candidate_seconds = time.perf_counter() - start
+
+    ref_bank = bdi.l2_normalize(reference.encode(bdi.option_texts(), convert_to_numpy=True))
+    cand_bank = bdi.l2_normalize(candidate.encode(bdi.option_texts(), convert_to_numpy=True))
+    cosine = np.sum(bdi.l2_normalize(ref) * bdi.l2_normalize(cand), axis=1)
+
+    users = questions = matching_questions = matching_totals = 0
+    for start in range(0, len(texts), user_size):
+        a = bdi.score_embeddings(ref[start:start + user_size], ref_bank)
+        b = bdi.score_embeddings(cand[start:start + user_size], cand_bank)
+        users += 1
+        questions += len(a.breakdown)
+        matching_questions += sum(x == y for x, y in zip(a.breakdown, b.breakdown))
+        matching_totals += a.total == b.total
+
+    return {
+        'posts': len(texts),
+        'users': users,
+        'question_agreement': matching_questions / questions if questions else None,
+        'total_agreement': matching_totals / users if users else None,
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds,
+        'speedup': reference_seconds / candidate_seconds if candidate_seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and check the quantised ONNX sentence embedder.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    export_parser.add_argument('--out')
+    export_parser.add_argument('--no-quantize', action='store_true')
+
+    check_parser = subparsers.add_parser('check', help="compare against the PyTorch backend")
+    check_parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    check_parser.add_argument('--dir')
+    check_parser.add_argument('--fixture', help="reddit_client.py fixture or CSV corpus (default synthetic)")
+    check_parser.add_argument('--posts', type=int, default=500)
+    check_parser.add_argument('--threads', type=int)
+    check_parser.add_argument('--fp32', action='store_true', help="check the unquantised graph")
+    args = parser.parse_args()
+
+    model_dir = args.out if args.command == 'export' else args.dir
+    model_dir = model_dir or onnx_dir(args.model)
+
+    if args.command == 'export':
+        export_onnx(args.model, model_dir, quantize=not args.no_quantize)
+        for name in ('model.onnx', 'model_int8.onnx'):
+            path = os.path.join(model_dir, name)
+            if os.path.exists(path):
+                print(f"wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+        return
+
+    import benchmark
+    from sentence_transformers import SentenceTransformer
+
+    texts = (benchmark.fixture_corpus(args.fixture, args.posts) if args.fixture
+             else benchmark.synthetic_corpus(args.posts))
+    reference = SentenceTransformer(args.model, device='cpu')
+    candidate = OnnxEmbedder(model_dir, threads=args.threads, quantized=not args.fp32)
+    print(json.dumps(accuracy_report(reference, candidate, texts), indent=2))
+
+
+if __name__ == '__main__':
+    main()
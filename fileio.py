@@ -0,0 +1,34 @@
+import contextlib
+import os
+import tempfile
+
+# os.umask can only be read by setting it, which is not thread-safe, so read it once
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', encoding=None, fsync=True):
+    # Yields a fresh tmp file next to `path` (unique per call, so concurrent writers in
+    # any thread or process never share one); on a clean exit it is flushed, fsynced and
+    # renamed over `path`, so readers see the old file or the whole new one, also after
+    # a crash. On an exception the partial file is removed and `path` is left untouched.
+    # fsync=False skips the disk flush for files that are cheap to regenerate and
+    # rewritten often.
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix='.tmp')
+    if encoding is None and 'b' not in mode:
+        encoding = 'utf-8'
+    try:
+        with open(fd, mode, encoding=encoding) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates the file 0600; give it the permissions a plain open() would
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,246 @@
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from fileio import atomic_write
+
+# Upper bounds in seconds, Prometheus-style (an implicit +Inf bucket follows).
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_NAME = 'mhf_stage_seconds'
+
+# METRICS_TEXTFILE: rewrite this .prom file after every request (node_exporter textfile collector).
+# METRICS_JSON_LOG=1: log one JSON line per request with its per-stage timings.
+TEXTFILE_PATH = os.environ.get('METRICS_TEXTFILE')
+JSON_LOG = os.environ.get('METRICS_JSON_LOG') == '1'
+
+logger = logging.getLogger(__name__)
+if JSON_LOG and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_enabled = os.environ.get('METRICS_ENABLED') == '1' or bool(TEXTFILE_PATH) or JSON_LOG
+_lock = threading.Lock()
+_histograms = {}
+_local = threading.local()
+_textfile_lock = threading.Lock()  # one textfile rewrite at a time across request threads
+_null = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timer(stage):
+    # `with metrics.timer('vectorize'):` -- a shared no-op context when disabled
+    return _Timer(stage) if _enabled else _null
+
+
+def timed(stage):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def request(name):
+    # Times a whole user action (stage name `request_<name>`) and, with JSON logging
+    # on, logs the stages timed on this thread while it ran.
+    if not _enabled:
+        yield
+        return
+    outer = getattr(_local, 'stages', None)
+    _local.stages = {}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stages, _local.stages = _local.stages, outer
+        observe(f'request_{name}', seconds)
+        if JSON_LOG:
+            logger.info(json.dumps({'event': 'request', 'name': name, 'seconds': seconds, 'stages': stages,
+                                    'error': error, 'ts': time.time()}))
+        if TEXTFILE_PATH:
+            # instrumentation must never fail the request it measured
+            try:
+                write_textfile(TEXTFILE_PATH)
+            except OSError:
+                logger.warning("could not write %s", TEXTFILE_PATH, exc_info=True)
+
+
+class InstrumentedModel:
+    # Thin proxy that times predict()/predict_proba() and, for a binary stack, each
+    # member's share as its own stage (model_svc etc.) by running the members itself.
+    # The fitted estimators are left alone, so the model still pickles. Works for
+    # sklearn's StackingClassifier and model_export.CompactStackingModel; anything
+    # else is timed as a whole under `model`.
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        # only reached for attributes the proxy lacks; 'model' is missing while unpickling
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _stages(self):
+        # -> ([(stage, X -> positive-class column)], features -> proba, features -> labels) or None
+        model = self.model
+        if hasattr(model, 'svc_proba'):
+            members = [(f'model_{m}', getattr(model, f'{m}_proba')) for m in ('lr', 'nb', 'svc')]
+
+            def meta_proba(features):
+                p1 = 1.0 / (1.0 + np.exp(-model.meta_decision(features)))
+                return np.column_stack([1.0 - p1, p1])
+            return members, meta_proba, lambda features: model.classes_[(model.meta_decision(features) > 0).astype(int)]
+        if (hasattr(model, 'named_estimators_') and len(model.classes_) == 2 and not model.passthrough
+                and all(method == 'predict_proba' for method in model.stack_method_)):
+            names = [name for name, estimator in model.estimators if estimator != 'drop']
+            members = [(f'model_{name}', lambda X, e=estimator: e.predict_proba(X)[:, 1])
+                       for name, estimator in zip(names, model.estimators_)]
+            final = model.final_estimator_
+            return members, final.predict_proba, lambda features: model.classes_[final.predict(features)]
+        return None
+
+    def _run(self, X, method):
+        stages = self._stages()
+        if stages is None:
+            with _Timer('model'):
+                return getattr(self.model, method)(X)
+        members, meta_proba, meta_predict = stages
+        columns = []
+        for stage, fn in members:
+            with _Timer(stage):
+                columns.append(fn(X))
+        with _Timer('model_meta'):
+            features = np.column_stack(columns)
+            return meta_proba(features) if method == 'predict_proba' else meta_predict(features)
+
+    def predict_proba(self, X):
+        return self._run(X, 'predict_proba') if _enabled else self.model.predict_proba(X)
+
+    def predict(self, X):
+        return self._run(X, 'predict') if _enabled else self.model.predict(X)
+
+
+def instrument_model(model):
+    return InstrumentedModel(model)
+
+
+def unwrap(model):
+    # the model behind an InstrumentedModel, for code that needs the real estimator
+    return model.model if isinstance(model, InstrumentedModel) else model
+
+
+def snapshot():
+    with _lock:
+        items = sorted(_histograms.items())
+        return {stage: {
+            'count': h.count,
+            'sum_seconds': h.sum,
+            'mean_ms': h.sum / h.count * 1000 if h.count else None,
+            'p50_ms': h.quantile(0.5) * 1000 if h.count else None,
+            'p95_ms': h.quantile(0.95) * 1000 if h.count else None,
+        } for stage, h in items}
+
+
+def prometheus_text():
+    lines = [f'# HELP {METRIC_NAME} Time spent per pipeline stage.', f'# TYPE {METRIC_NAME} histogram']
+    with _lock:
+        for stage, h in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, n in zip(h.buckets + (float('inf'),), h.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    # rewritten after every request and only ever scraped, so not worth an fsync
+    with _textfile_lock, atomic_write(path, 'w', fsync=False) as f:
+        f.write(prometheus_text())
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble import StackingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.svm import SVC
+
+from fileio import atomic_write
+
+FORMAT_VERSION = 1
+MIN_PROB = 1e-7  # libsvm clips Platt probabilities to [MIN_PROB, 1 - MIN_PROB]
+
+
+def _rows_dot(X, M):
+    # X @ M.T for dense or sparse X and dense or CSR M, always returned dense
+    if sp.issparse(M):
+        result = (M @ X.T).T
+    else:
+        result = X @ M.T
+    return result.toarray() if sp.issparse(result) else np.asarray(result)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _libsvm_pairwise_coupling(r01):
+    # libsvm's multiclass_probability for k=2, vectorised across rows. sklearn's
+    # libsvm runs this iterative solver even for binary problems, so the SVC's
+    # predict_proba is not exactly the Platt sigmoid; replicating it keeps the
+    # compact model bit-for-bit close to the original.
+    r10 = 1.0 - r01
+    q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+    p0 = np.full_like(r01, 0.5)
+    p1 = np.full_like(r01, 0.5)
+    active = np.ones(r01.shape, dtype=bool)
+    eps = 0.005 / 2
+    for _ in range(100):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        active &= np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= eps
+        if not active.any():
+            break
+        diff = np.where(active, (pqp - qp0) / q00, 0.0)
+        p0 = p0 + diff
+        pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp1 = (qp1 + diff * q01) / (1 + diff)
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+
+        diff = np.where(active, (pqp - qp1) / q11, 0.0)
+        p1 = p1 + diff
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+    return p1
+
+
+def _members(model):
+    if not isinstance(model, StackingClassifier):
+        raise TypeError(f"expected a StackingClassifier, got {type(model).__name__}")
+    if len(model.classes_) != 2:
+        raise ValueError("only binary stacking models can be exported")
+    if model.passthrough:
+        raise ValueError("stacking models with passthrough=True are not supported")
+    members = {}
+    for estimator, method in zip(model.estimators_, model.stack_method_):
+        if method != 'predict_proba':
+            raise ValueError(f"unsupported stack method {method!r}")
+        if isinstance(estimator, LogisticRegression):
+            members['lr'] = estimator
+        elif isinstance(estimator, MultinomialNB):
+            members['nb'] = estimator
+        elif isinstance(estimator, SVC) and estimator.kernel == 'sigmoid':
+            members['svc'] = estimator
+        else:
+            raise ValueError(f"unsupported base estimator {type(estimator).__name__}")
+    order = [type(e).__name__ for e in model.estimators_]
+    if order != ['LogisticRegression', 'MultinomialNB', 'SVC']:
+        raise ValueError(f"unexpected estimator order {order}")
+    return members
+
+
+def export_arrays(model, max_support_vectors=None, dtype=np.float64):
+    members = _members(model)
+    lr, nb, svc = members['lr'], members['nb'], members['svc']
+
+    dual_coef = svc.dual_coef_.toarray() if sp.issparse(svc.dual_coef_) else svc.dual_coef_
+    dual_coef = np.asarray(dual_coef).ravel()
+    keep = np.arange(len(dual_coef))
+    if max_support_vectors is not None and max_support_vectors < len(dual_coef):
+        # prune the support vectors that contribute least to the decision function
+        keep = np.sort(np.argsort(-np.abs(dual_coef), kind='stable')[:max_support_vectors])
+    support_vectors = sp.csr_matrix(svc.support_vectors_[keep], dtype=dtype)
+
+    return {
+        'format_version': np.array(FORMAT_VERSION),
+        'classes': np.asarray(model.classes_),
+        'lr_coef': lr.coef_.astype(dtype),
+        'lr_intercept': lr.intercept_.astype(dtype),
+        'nb_feature_log_prob': nb.feature_log_prob_.astype(dtype),
+        'nb_class_log_prior': nb.class_log_prior_.astype(dtype),
+        'svc_sv_data': support_vectors.data,
+        'svc_sv_indices': support_vectors.indices,
+        'svc_sv_indptr': support_vectors.indptr,
+        'svc_sv_shape': np.array(support_vectors.shape),
+        'svc_dual_coef': dual_coef[keep].astype(dtype),
+        'svc_intercept': svc.intercept_.astype(dtype),
+        'svc_gamma': np.array(svc._gamma, dtype=np.float64),
+        'svc_coef0': np.array(svc.coef0, dtype=np.float64),
+        'svc_prob_a': svc.probA_.astype(np.float64),
+        'svc_prob_b': svc.probB_.astype(np.float64),
+        'svc_total_support_vectors': np.array(len(dual_coef)),
+        'meta_coef': model.final_estimator_.coef_.astype(np.float64),
+        'meta_intercept': model.final_estimator_.intercept_.astype(np.float64),
+    }
+
+
+def export_model(model, path, max_support_vectors=None, dtype=np.float64):
+    arrays = export_arrays(model, max_support_vectors=max_support_vectors, dtype=dtype)
+    with atomic_write(path) as f:
+        np.savez(f, **arrays)
+    return arrays
+
+
+class CompactStackingModel:
+    # Predict-time equivalent of the notebook's StackingClassifier built from plain
+    # arrays: LR and MNB become a matmul each, the sigmoid SVC a kernel against the
+    # (possibly pruned) support vectors followed by libsvm's Platt scaling.
+    def __init__(self, arrays):
+        version = int(arrays['format_version'])
+        if version != FORMAT_VERSION:
+            raise ValueError(f"unsupported model bundle version {version} (expected {FORMAT_VERSION})")
+        self.classes_ = np.asarray(arrays['classes'])
+        self.lr_coef = arrays['lr_coef']
+        self.lr_intercept = arrays['lr_intercept']
+        self.nb_feature_log_prob = arrays['nb_feature_log_prob']
+        self.nb_class_log_prior = arrays['nb_class_log_prior']
+        self.support_vectors = sp.csr_matrix(
+            (arrays['svc_sv_data'], arrays['svc_sv_indices'], arrays['svc_sv_indptr']),
+            shape=tuple(int(n) for n in arrays['svc_sv_shape']))
+        self.dual_coef = arrays['svc_dual_coef']
+        self.svc_intercept = arrays['svc_intercept']
+        self.gamma = float(arrays['svc_gamma'])
+        self.coef0 = float(arrays['svc_coef0'])
+        self.prob_a = float(arrays['svc_prob_a'][0])
+        self.prob_b = float(arrays['svc_prob_b'][0])
+        self.meta_coef = arrays['meta_coef']
+        self.meta_intercept = arrays['meta_intercept']
+        self.n_features_in_ = self.lr_coef.shape[1]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as bundle:
+            return cls({name: bundle[name] for name in bundle.files})
+
+    def lr_proba(self, X):
+        return _sigmoid(_rows_dot(X, self.lr_coef)[:, 0] + self.lr_intercept[0])
+
+    def nb_proba(self, X):
+        jll = _rows_dot(X, self.nb_feature_log_prob) + self.nb_class_log_prior
+        return _sigmoid(jll[:, 1] - jll[:, 0])
+
+    def svc_decision(self, X):
+        kernel = np.tanh(self.gamma * _rows_dot(X, self.support_vectors) + self.coef0)
+        return kernel @ self.dual_coef + self.svc_intercept[0]
+
+    def svc_proba(self, X):
+        # sklearn negates libsvm's binary decision values, so undo that before Platt
+        r01 = 1.0 / (1.0 + np.exp(-self.svc_decision(X) * self.prob_a + self.prob_b))
+        return _libsvm_pairwise_coupling(np.clip(r01, MIN_PROB, 1.0 - MIN_PROB))
+
+    def meta_features(self, X):
+        return np.column_stack([self.lr_proba(X), self.nb_proba(X), self.svc_proba(X)])
+
+    def meta_decision(self, features):
+        return features @ self.meta_coef[0] + self.meta_intercept[0]
+
+    def decision_function(self, X):
+        return self.meta_decision(self.meta_features(X))
+
+    def predict_proba(self, X):
+        p1 = _sigmoid(self.decision_function(X))
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+def load_model(path):
+    if path.endswith('.npz'):
+        return CompactStackingModel.load(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def agreement_report(model, compact, vectorizer, texts, labels):
+    import classifier
+    from sklearn.metrics import accuracy_score, f1_score
+
+    X = vectorizer.transform(texts)
+
+    start = time.perf_counter()
+    reference = classifier.predict(model, X)
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidate = compact.predict(X)
+    candidate_seconds = time.perf_counter() - start
+
+    return {
+        'rows': len(labels),
+        'agreement': float(np.mean(reference == candidate)),
+        'disagreements': int(np.sum(reference != candidate)),
+        'original': {'accuracy': accuracy_score(labels, reference), 'f1': f1_score(labels, reference),
+                     'predict_seconds': reference_seconds},
+        'compact': {'accuracy': accuracy_score(labels, candidate), 'f1': f1_score(labels, candidate),
+                    'predict_seconds': candidate_seconds,
+                    'support_vectors': int(compact.support_vectors.shape[0])},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model.pkl to a compact .npz bundle and check agreement.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--model', default='model.pkl')
+    export_parser.add_argument('--out', default='model_compact.npz')
+    export_parser.add_argument('--max-support-vectors', type=int)
+    export_parser.add_argument('--float32', action='store_true')
+
+    report_parser = subparsers.add_parser('report')
+    report_parser.add_argument('--model', default='model.pkl')
+    report_parser.add_argument('--bundle', default='model_compact.npz')
+    report_parser.add_argument('--vectorizer', default='vectorizer.pkl')
+    report_parser.add_argument('--data', default='Suicide_Detection.csv')
+    report_parser.add_argument('--limit', type=int, help="score only the first N held-out rows")
+    report_parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model = load_model(args.model)
+    pickle_seconds = time.perf_counter() - start
+
+    if args.command == 'export':
+        export_model(model, args.out, max_support_vectors=args.max_support_vectors,
+                     dtype=np.float32 if args.float32 else np.float64)
+        print(f"wrote {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB, "
+              f"original {os.path.getsize(args.model) / 1e6:.1f} MB)")
+        return
+
+    import classifier
+    from sklearn.model_selection import train_test_split
+    from text_processing import transform_texts
+
+    start = time.perf_counter()
+    compact = CompactStackingModel.load(args.bundle)
+    bundle_seconds = time.perf_counter() - start
+
+    with open(args.vectorizer, 'rb') as f:
+        vectorizer = pickle.load(f)
+    texts, y = classifier.load_dataset(args.data)
+    _, test_texts, _, y_test = train_test_split(
+        texts, y, test_size=classifier.TEST_SIZE, random_state=classifier.RANDOM_STATE)
+    if args.limit:
+        test_texts, y_test = test_texts[:args.limit], y_test[:args.limit]
+
+    report = agreement_report(model, compact, vectorizer, transform_texts(test_texts, n_jobs=args.jobs), y_test)
+    report['original']['load_seconds'] = pickle_seconds
+    report['compact']['load_seconds'] = bundle_seconds
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
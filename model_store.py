@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import metrics
+from model_export import CompactStackingModel, export_arrays
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.path.join(BASE_DIR, '.cache', 'model_store')
+FORMAT_VERSION = 1
+KEEP_VERSIONS = 3
+MMAP_MIN_BYTES = 4096
+
+
+def _save_array(path, array):
+    # plain .npy (no pickle) so np.load(mmap_mode='r') can map it
+    np.save(path, np.asarray(array), allow_pickle=False)
+
+
+def _load_array(path):
+    # scalars and other tiny arrays are read normally (memmaps cannot be 0-d)
+    mmap_mode = 'r' if os.path.getsize(path) > MMAP_MIN_BYTES else None
+    return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+
+def _load_arrays(directory):
+    return {name[:-4]: _load_array(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith('.npy')}
+
+
+def vectorizer_config(vectorizer):
+    params = vectorizer.get_params()
+    for key in ('tokenizer', 'preprocessor', 'analyzer'):
+        if callable(params[key]):
+            raise ValueError(f"vectorizers with a custom {key} cannot be stored")
+    params.pop('vocabulary')
+    params['dtype'] = np.dtype(params['dtype']).name
+    params['ngram_range'] = list(params['ngram_range'])
+    vocabulary = {term: int(index) for term, index in vectorizer.vocabulary_.items()}
+    return {'params': params, 'vocabulary': vocabulary}
+
+
+def build_vectorizer(config, idf):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    params = dict(config['params'])
+    params['dtype'] = np.dtype(params['dtype']).type
+    params['ngram_range'] = tuple(params['ngram_range'])
+    vectorizer = TfidfVectorizer(vocabulary=config['vocabulary'], **params)
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+def save_embedder(embedder, directory):
+    # the SentenceTransformer's own files plus every parameter and buffer (including
+    # non-persistent ones such as position ids) in one torch file that load_embedder maps
+    import torch
+    embedder.save(directory)
+    tensors = {**embedder.state_dict(), **dict(embedder.named_buffers())}
+    torch.save(tensors, os.path.join(directory, 'tensors.pt'))
+
+
+def load_embedder(directory, device='cpu'):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    tensors = torch.load(os.path.join(directory, 'tensors.pt'), mmap=True, weights_only=True, map_location=device)
+    # The module is built normally, then every parameter and buffer is swapped for its
+    # mapped tensor (assign=True), so the private copy it loaded is freed and only the
+    # mapping shared with other processes stays. (Building it on the meta device
+    # instead is refused by recent transformers' from_pretrained.)
+    model = SentenceTransformer(directory, device=device)
+    persistent = model.state_dict().keys()
+    missing = [name for name in persistent if name not in tensors]
+    if missing:
+        raise RuntimeError(f"{directory} lacks tensors the embedder needs ({missing[0]}, ...); publish it again")
+    model.load_state_dict({name: tensors[name] for name in persistent}, assign=True)
+    for name, _ in list(model.named_buffers()):
+        if name not in persistent and name in tensors:  # non-persistent, e.g. position ids
+            owner, _, leaf = name.rpartition('.')
+            model.get_submodule(owner)._buffers[leaf] = tensors[name]
+    return model.eval()
+
+
+class ModelStore:
+    # Versioned, pickle-free artifact directories:
+    #   versions/<version>/manifest.json
+    #   versions/<version>/model/*.npy        CompactStackingModel arrays
+    #   versions/<version>/vectorizer.json    TF-IDF params + vocabulary
+    #   versions/<version>/idf.npy
+    #   versions/<version>/embedder/          optional SentenceTransformer + tensors.pt
+    #   current -> versions/<version>
+    # Every array is opened with mmap_mode='r', so processes loading the same version
+    # share one copy in the page cache. publish() builds a version aside and swaps the
+    # `current` symlink with a rename, so readers see either the old or the new one.
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+
+    def path(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def versions(self):
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir)
+                      if not name.startswith('.')  # publish()'s directories under construction
+                      and os.path.exists(os.path.join(self.versions_dir, name, 'manifest.json')))
+
+    def current_version(self):
+        try:
+            return os.path.basename(os.readlink(os.path.join(self.root, 'current')))
+        except FileNotFoundError:
+            return None
+
+    def manifest(self, version=None):
+        version = version or self.current_version()
+        with open(os.path.join(self.path(version), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def publish(self, vectorizer, model, embedder=None, embedder_name=None, activate=True, source=None,
+                dtype=np.float64):
+        arrays = export_arrays(model, dtype=dtype)
+        config = vectorizer_config(vectorizer)
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8'))
+        for name in sorted(arrays):
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{digest.hexdigest()[:8]}"
+
+        os.makedirs(self.versions_dir, exist_ok=True)
+        # per-process like fileio.atomic_write's tmp files, so two publishers of the same
+        # version never build into (or remove) each other's directory
+        tmp_dir = self.path(f".{version}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(os.path.join(tmp_dir, 'model'))
+        for name, array in arrays.items():
+            _save_array(os.path.join(tmp_dir, 'model', f'{name}.npy'), array)
+        with open(os.path.join(tmp_dir, 'vectorizer.json'), 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        _save_array(os.path.join(tmp_dir, 'idf.npy'), np.asarray(vectorizer.idf_))
+        if embedder is not None:
+            save_embedder(embedder, os.path.join(tmp_dir, 'embedder'))
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump({'format_version': FORMAT_VERSION, 'version': version,
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'source': source,
+                       'embedder': embedder_name if embedder is not None else None}, f, indent=2)
+        try:
+            os.replace(tmp_dir, self.path(version))
+        except OSError:
+            # the same version (same second, same content) was published concurrently
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if version not in self.versions():
+                raise
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        if version not in self.versions():
+            raise ValueError(f"no such model version {version!r}")
+        link = os.path.join(self.root, 'current')
+        tmp_link = f"{link}.{os.getpid()}.tmp"
+        os.symlink(os.path.join('versions', version), tmp_link)
+        os.replace(tmp_link, link)
+
+    def prune(self, keep=KEEP_VERSIONS):
+        # drops the oldest versions, never the active one; processes still mapping a
+        # removed version keep their pages until they reload
+        current = self.current_version()
+        removed = [v for v in self.versions()[:-keep] if v != current] if keep else []
+        for version in removed:
+            shutil.rmtree(self.path(version))
+        return removed
+
+    def load(self, version=None):
+        # -> (vectorizer, CompactStackingModel) for `version` (default: current)
+        version = version or self.current_version()
+        if version is None:
+            raise FileNotFoundError(f"no model published in {self.root}")
+        directory = self.path(version)
+        manifest = self.manifest(version)
+        if manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"model store format {manifest['format_version']} is not supported")
+        with open(os.path.join(directory, 'vectorizer.json'), encoding='utf-8') as f:
+            config = json.load(f)
+        idf = _load_array(os.path.join(directory, 'idf.npy'))
+        vectorizer = build_vectorizer(config, idf)
+        model = CompactStackingModel(_load_arrays(os.path.join(directory, 'model')))
+        return vectorizer, metrics.instrument_model(model)
+
+    def embedder_path(self, version=None):
+        version = version or self.current_version()
+        path = os.path.join(self.path(version), 'embedder') if version else None
+        return path if path and os.path.isdir(path) else None
+
+    def report(self):
+        current = self.current_version()
+        sizes = {}
+        for version in self.versions():
+            sizes[version] = sum(os.path.getsize(os.path.join(d, name))
+                                 for d, _, names in os.walk(self.path(version)) for name in names)
+        return {'root': self.root, 'current': current, 'versions': {v: round(s / 1e6, 1) for v, s in sizes.items()}}
+
+
+def private_mb():
+    # anonymous (per-process, unshareable) memory on Linux; mapped model pages are
+    # file-backed and not counted. Falls back to peak RSS elsewhere.
+    try:
+        with open('/proc/self/smaps_rollup', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('Anonymous:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish, list and switch memory-mapped model versions.")
+    parser.add_argument('--root', default=STORE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    publish_parser = subparsers.add_parser('publish', help="convert vectorizer.pkl/model.pkl into a new version")
+    publish_parser.add_argument('--vectorizer', default='vectorizer.pkl')
+    publish_parser.add_argument('--model', default='model.pkl')
+    publish_parser.add_argument('--embedder', help="also store this SentenceTransformer (e.g. all-MiniLM-L6-v2)")
+    publish_parser.add_argument('--no-activate', action='store_true')
+
+    subparsers.add_parser('list')
+    activate_parser = subparsers.add_parser('activate', help="switch (or roll back) the current version")
+    activate_parser.add_argument('version')
+    prune_parser = subparsers.add_parser('prune')
+    prune_parser.add_argument('--keep', type=int, default=KEEP_VERSIONS)
+    footprint_parser = subparsers.add_parser('footprint', help="private memory added by loading and using a model")
+    footprint_parser.add_argument('--pickle', action='store_true',
+                                  help="load vectorizer.pkl/model.pkl instead, for comparison")
+    args = parser.parse_args()
+
+    store = ModelStore(args.root)
+    if args.command == 'publish':
+        import pickle
+        with open(args.vectorizer, 'rb') as f:
+            vectorizer = pickle.load(f)
+        with open(args.model, 'rb') as f:
+            model = pickle.load(f)
+        embedder = None
+        if args.embedder:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer(args.embedder, device='cpu')
+        version = store.publish(vectorizer, model, embedder, args.embedder, activate=not args.no_activate,
+                                source={'vectorizer': args.vectorizer, 'model': args.model})
+        print(json.dumps({'published': version, 'current': store.current_version()}))
+    elif args.command == 'activate':
+        store.activate(args.version)
+        print(json.dumps({'current': store.current_version()}))
+    elif args.command == 'prune':
+        print(json.dumps({'removed': store.prune(args.keep)}))
+    elif args.command == 'footprint':
+        import classifier
+        before = private_mb()
+        if args.pickle:
+            import pickle
+            with open('vectorizer.pkl', 'rb') as f:
+                vectorizer = pickle.load(f)
+            with open('model.pkl', 'rb') as f:
+                model = pickle.load(f)
+        else:
+            vectorizer, model = store.load()
+        classifier.predict_proba(model, vectorizer.transform(['feel alone and tired']))
+        after = private_mb()
+        print(json.dumps({'private_before_mb': round(before, 1), 'private_after_mb': round(after, 1),
+                          'extra_mb': round(after - before, 1)}))
+    else:
+        print(json.dumps(store.report(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import scan
+from reddit_scheduler import BULK, priority
+
+BATCH_SIZE = 64
+MAX_WAIT = 2.0  # seconds the first post of a batch may wait for the batch to fill
+QUEUE_SIZE = 1024
+METRICS_INTERVAL = 10.0
+LATENCY_WINDOW = 200  # batches kept for the latency percentiles
+
+_DONE = object()
+
+
+class JsonlSink:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def write(self, scored, subreddit):
+        row = scored.as_row()
+        row['subreddit'] = subreddit
+        row['scored_at'] = time.time()
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+@dataclass
+class MonitorMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    posts: int = 0
+    flagged: int = 0
+    batches: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    producer_blocked_seconds: float = 0.0
+    batch_seconds: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW), repr=False)
+
+    def record_batch(self, size, flagged, seconds, queue_depth):
+        self.posts += size
+        self.flagged += flagged
+        self.batches += 1
+        self.batch_seconds.append(seconds)
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = np.array(self.batch_seconds) * 1000 if self.batch_seconds else None
+        return {
+            'elapsed_seconds': elapsed,
+            'posts': self.posts,
+            'flagged': self.flagged,
+            'batches': self.batches,
+            'posts_per_second': self.posts / elapsed if elapsed else 0.0,
+            'mean_batch_size': self.posts / self.batches if self.batches else 0.0,
+            'batch_latency_ms_p50': float(np.percentile(latencies, 50)) if latencies is not None else None,
+            'batch_latency_ms_p95': float(np.percentile(latencies, 95)) if latencies is not None else None,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'producer_blocked_seconds': self.producer_blocked_seconds,
+        }
+
+
+class SubredditMonitor:
+    # A producer thread pushes streamed submissions into a bounded queue (blocking when
+    # it is full, which throttles the stream instead of growing memory); the caller's
+    # thread drains it into micro-batches of up to batch_size posts or max_wait seconds
+    # and scores each batch with one scan.score_posts call.
+    def __init__(self, backend, subreddits, vectorizer, model, sink, batch_size=BATCH_SIZE, max_wait=MAX_WAIT,
+                 queue_size=QUEUE_SIZE, metrics_interval=METRICS_INTERVAL, on_metrics=None):
+        self.backend = backend
+        self.subreddits = list(subreddits)
+        self.vectorizer = vectorizer
+        self.model = model
+        self.sink = sink
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.metrics_interval = metrics_interval
+        self.on_metrics = on_metrics
+        self.metrics = MonitorMetrics()
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.metrics.producer_blocked_seconds += time.perf_counter() - start
+
+    def _produce(self):
+        try:
+            with priority(BULK):  # yields Reddit quota to interactive sessions
+                for post in self.backend.stream_submissions(self.subreddits):
+                    if self._stop.is_set():
+                        break
+                    if post is not None:
+                        self._put(post)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(_DONE)
+
+    def _next_batch(self):
+        # Returns (posts, done). Waits at most metrics_interval for the first post so
+        # metrics keep flowing while the stream is idle.
+        try:
+            first = self._queue.get(timeout=self.metrics_interval)
+        except queue.Empty:
+            return [], False
+        if first is _DONE:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _score(self, batch):
+        start = time.perf_counter()
+        scored = scan.score_posts(batch, self.vectorizer, self.model)
+        flagged = [s for s in scored if s.risk_result == 1]
+        for s in flagged:
+            self.sink.write(s, s.post.subreddit)
+        self.metrics.record_batch(len(batch), len(flagged), time.perf_counter() - start, self._queue.qsize())
+
+    def run(self):
+        producer = threading.Thread(target=self._produce, name='monitor-stream', daemon=True)
+        producer.start()
+        last_report = time.perf_counter()
+        done = False
+        try:
+            while not done and not self._stop.is_set():
+                batch, done = self._next_batch()
+                if batch:
+                    self._score(batch)
+                if self.on_metrics and time.perf_counter() - last_report >= self.metrics_interval:
+                    self.on_metrics(self.metrics.snapshot())
+                    last_report = time.perf_counter()
+        finally:
+            self.stop()
+        if self.on_metrics:
+            self.on_metrics(self.metrics.snapshot())
+        if self.error is not None:
+            raise self.error
+        return self.metrics.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuously score new submissions and log flagged posts.")
+    parser.add_argument('subreddits', nargs='*', default=list(scan.MENTAL_HEALTH_SUBREDDITS))
+    parser.add_argument('--out', default='flagged.jsonl')
+    parser.add_argument('--fixture', help="replay a reddit_client.py fixture instead of streaming live")
+    parser.add_argument('--rate', type=float, default=0.0, help="replayed posts per second (0 = unthrottled)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-wait', type=float, default=MAX_WAIT)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL)
+    args = parser.parse_args()
+
+    import reddit_client
+    import resources
+
+    if args.fixture:
+        backend = reddit_client.ReplayBackend(args.fixture, stream_rate=args.rate)
+    else:
+        backend = resources.get_reddit_backend(os.environ['REDDIT_CLIENT_ID'], os.environ['REDDIT_CLIENT_SECRET'],
+                                               os.environ['REDDIT_USER_AGENT'])
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_classifier()
+    resources.warm_up(vectorizer, model)
+
+    sink = JsonlSink(args.out)
+    monitor = SubredditMonitor(backend, args.subreddits, vectorizer, model, sink, batch_size=args.batch_size,
+                               max_wait=args.max_wait, queue_size=args.queue_size,
+                               metrics_interval=args.metrics_interval,
+                               on_metrics=lambda m: print(json.dumps(m), file=sys.stderr, flush=True))
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
+    finally:
+        sink.close()
+
+
+if __name__ == '__main__':
+    main()
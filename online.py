@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from bulk_score import read_chunks
+from fileio import atomic_write
+from text_processing import normalizer_pool, transform_texts
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ONLINE_MODEL_PATH = os.path.join(BASE_DIR, 'online_model.pkl')
+N_FEATURES = 2 ** 18
+CLASSES = np.array([0, 1])
+# same encoding LabelEncoder gives the training CSV's class column
+LABELS = {'non-suicide': 0, 'suicide': 1, '0': 0, '1': 1, 0: 0, 1: 1}
+CHUNK_ROWS = 10_000
+FORMAT_VERSION = 1
+
+
+class OnlineModel:
+    # Vocabulary-free counterpart of vectorizer.pkl + model.pkl: a HashingVectorizer
+    # (so new words never need a refit) feeding MultinomialNB and a logistic
+    # SGDClassifier, both updated with partial_fit and averaged at predict time.
+    # The object is its own vectorizer, so it drops into scan.score_posts as both
+    # arguments. Its size is fixed by n_features, not by how much it has seen.
+    def __init__(self, n_features=N_FEATURES, alpha=1e-5, nb_weight=0.5):
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm='l2',
+                                            dtype=np.float32)
+        self.nb = MultinomialNB(alpha=0.01)
+        self.sgd = SGDClassifier(loss='log_loss', alpha=alpha, random_state=2)
+        self.nb_weight = nb_weight
+        self.classes_ = CLASSES
+        self.n_seen = 0
+        self.batches = 0
+        self.updated_at = None
+
+    def transform(self, normalized_texts):
+        return self.vectorizer.transform(normalized_texts)
+
+    def partial_fit(self, normalized_texts, labels):
+        X = self.transform(normalized_texts)
+        y = np.asarray(labels)
+        self.nb.partial_fit(X, y, classes=self.classes_)
+        self.sgd.partial_fit(X, y, classes=self.classes_)
+        self.n_seen += len(y)
+        self.batches += 1
+        self.updated_at = time.time()
+        return self
+
+    def predict_proba(self, X):
+        if not self.n_seen:
+            raise ValueError("online model has not been trained on any batch yet")
+        return self.nb_weight * self.nb.predict_proba(X) + (1 - self.nb_weight) * self.sgd.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def state(self):
+        # plain dict of the fitted sklearn members and counters. Pickling the
+        # OnlineModel itself would record it as __main__.OnlineModel when saved by
+        # `python online.py update`, which nothing else could load.
+        return {'format_version': FORMAT_VERSION, 'n_features': self.vectorizer.n_features,
+                'nb_weight': self.nb_weight, 'nb': self.nb, 'sgd': self.sgd, 'n_seen': self.n_seen,
+                'batches': self.batches, 'updated_at': self.updated_at}
+
+    @classmethod
+    def from_state(cls, state):
+        if state.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"unsupported online model checkpoint version {state.get('format_version')}")
+        model = cls(state['n_features'], nb_weight=state['nb_weight'])
+        model.nb, model.sgd = state['nb'], state['sgd']
+        model.n_seen, model.batches, model.updated_at = state['n_seen'], state['batches'], state['updated_at']
+        return model
+
+    def save(self, path=ONLINE_MODEL_PATH):
+        # written aside and renamed, so a reader never sees a half-written checkpoint
+        with atomic_write(path) as f:
+            pickle.dump(self.state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def report(self):
+        return {'n_features': self.vectorizer.n_features, 'n_seen': self.n_seen, 'batches': self.batches,
+                'updated_at': self.updated_at}
+
+
+def load(path=ONLINE_MODEL_PATH):
+    with open(path, 'rb') as f:
+        return OnlineModel.from_state(pickle.load(f))
+
+
+def encode_labels(values):
+    try:
+        return np.array([LABELS[v.strip().lower() if isinstance(v, str) else int(v)] for v in values])
+    except KeyError as e:
+        raise ValueError(f"unknown label {e.args[0]!r} (expected one of {sorted(map(str, LABELS))})") from None
+
+
+def ingest(model, path, text_column='text', label_column='class', chunk_rows=CHUNK_ROWS, checkpoint=None,
+           n_jobs=1, log=print):
+    # Streams a labelled CSV/Parquet file through partial_fit chunk by chunk,
+    # checkpointing after each one. Work is proportional to the file, not to
+    # everything the model has seen before.
+    pool = normalizer_pool(n_jobs) if n_jobs > 1 else None
+    rows = 0
+    try:
+        for df in read_chunks(path, [text_column, label_column], chunk_rows):
+            df = df.dropna(subset=[text_column, label_column])
+            if df.empty:
+                continue
+            start = time.perf_counter()
+            normalized = transform_texts(df[text_column].astype(str).tolist(), pool=pool)
+            model.partial_fit(normalized, encode_labels(df[label_column].tolist()))
+            if checkpoint:
+                model.save(checkpoint)
+            rows += len(df)
+            log(f"batch {model.batches}: {len(df)} rows in {time.perf_counter() - start:.2f} s "
+                f"({model.n_seen} seen)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return rows
+
+
+def evaluate_file(model, path, text_column='text', label_column='class'):
+    import classifier
+    import pandas as pd
+
+    df = pd.read_csv(path, usecols=[text_column, label_column]).dropna()
+    X = model.transform(transform_texts(df[text_column].astype(str).tolist()))
+    return classifier.evaluate(model, X, encode_labels(df[label_column].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or update the online (hashing + partial_fit) classifier.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help="ingest labelled batches (creates the model if missing)")
+    update_parser.add_argument('files', nargs='+', help="CSV/Parquet with text and label columns")
+    update_parser.add_argument('--model', default=ONLINE_MODEL_PATH)
+    update_parser.add_argument('--text-column', default='text')
+    update_parser.add_argument('--label-column', default='class')
+    update_parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    update_parser.add_argument('--jobs', type=int, default=1)
+    update_parser.add_argument('--n-features', type=int, default=N_FEATURES, help="only used for a new model")
+
+    evaluate_parser = subparsers.add_parser('evaluate')
+    evaluate_parser.add_argument('file')
+    evaluate_parser.add_argument('--model', default=ONLINE_MODEL_PATH)
+    evaluate_parser.add_argument('--text-column', default='text')
+    evaluate_parser.add_argument('--label-column', default='class')
+
+    stats_parser = subparsers.add_parser('stats')
+    stats_parser.add_argument('--model', default=ONLINE_MODEL_PATH)
+    args = parser.parse_args()
+
+    import resources
+    resources.ensure_nltk_data()
+
+    if args.command == 'update':
+        model = load(args.model) if os.path.exists(args.model) else OnlineModel(args.n_features)
+        for path in args.files:
+            ingest(model, path, args.text_column, args.label_column, args.chunk_rows, args.model, args.jobs)
+        print(json.dumps(model.report()))
+    elif args.command == 'evaluate':
+        print(json.dumps(evaluate_file(load(args.model), args.file, args.text_column, args.label_column)))
+    else:
+        print(json.dumps(load(args.model).report()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+
+import numpy as np
+
+import metrics
+from reddit_client import FETCH_TIMEOUT, USER_POST_LIMIT, Post, fetch_user_posts
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(BASE_DIR, '.cache', 'posts.sqlite3')
+
+REFRESH_TTL = 24 * 3600  # after this a user's history is re-fetched in full (catches edits/deletions)
+MAX_AGE = 30 * 24 * 3600  # users and embeddings untouched for this long are dropped
+MAX_EMBEDDING_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    newest_id TEXT,
+    refreshed_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    created_utc REAL NOT NULL,
+    text_hash TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_by_user ON posts (username, created_utc);
+CREATE TABLE IF NOT EXISTS embeddings (
+    text_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (text_hash, model)
+);
+CREATE INDEX IF NOT EXISTS embeddings_by_use ON embeddings (used_at);
+"""
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PostCache:
+    # Submissions keyed by id (with the hash of their text) and embeddings keyed by
+    # (text hash, embedder), so re-assessing a user only fetches posts newer than the
+    # last one seen and only encodes text that has not been encoded before.
+    def __init__(self, path=CACHE_PATH, refresh_ttl=REFRESH_TTL, max_age=MAX_AGE,
+                 max_embedding_bytes=MAX_EMBEDDING_BYTES):
+        self.path = path
+        self.refresh_ttl = refresh_ttl
+        self.max_age = max_age
+        self.max_embedding_bytes = max_embedding_bytes
+        self.stats = dict.fromkeys(('incremental_fetches', 'full_fetches', 'post_hits', 'post_misses',
+                                    'embedding_hits', 'embedding_misses', 'evicted_embeddings'), 0)
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def user_state(self, username):
+        with self._lock:
+            return self._conn.execute('SELECT newest_id, refreshed_at FROM users WHERE username = ?',
+                                      (username,)).fetchone()
+
+    def user_posts(self, username, limit=USER_POST_LIMIT):
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM posts WHERE username = ? ORDER BY created_utc DESC LIMIT ?',
+                                      (username, limit)).fetchall()
+        return [Post(**json.loads(data)) for data, in rows]
+
+    def store_user_posts(self, username, posts, full):
+        # full=True replaces the user's history (a fresh listing); otherwise the posts
+        # are newer submissions added on top of what is cached.
+        now = time.time()
+        with self._lock, self._conn:
+            hashes = [text_hash(post.text) for post in posts]
+            if full:
+                self._conn.execute('DELETE FROM posts WHERE username = ?', (username,))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO posts (id, username, created_utc, text_hash, data) VALUES (?, ?, ?, ?, ?)',
+                [(post.id, username, post.created_utc, h, json.dumps(asdict(post)))
+                 for post, h in zip(posts, hashes)])
+            newest = self._conn.execute('SELECT id FROM posts WHERE username = ? ORDER BY created_utc DESC LIMIT 1',
+                                        (username,)).fetchone()
+            previous = self.user_state(username)
+            refreshed_at = now if full or previous is None else previous[1]
+            self._conn.execute('INSERT OR REPLACE INTO users (username, newest_id, refreshed_at, used_at) '
+                               'VALUES (?, ?, ?, ?)', (username, newest[0] if newest else None, refreshed_at, now))
+
+    def fetch_before(self, username):
+        # newest cached id while the user's history is fresh, else None (full fetch)
+        state = self.user_state(username)
+        if state is not None and state[0] is not None and time.time() - state[1] < self.refresh_ttl:
+            return state[0]
+        return None
+
+    def fetch_user_posts(self, backend, username, limit=USER_POST_LIMIT, timeout=FETCH_TIMEOUT):
+        before = self.fetch_before(username)
+        posts, errors = fetch_user_posts(backend, username, limit, timeout, before=before)
+        return self.merge_fetched(username, posts, errors, before, limit)
+
+    def merge_fetched(self, username, posts, errors, before, limit=USER_POST_LIMIT):
+        # Stores what a fetch made with fetch_before(username) returned and serves the
+        # user's latest `limit` posts from the cache.
+        if errors and not posts:
+            # Reddit unreachable: fall back to whatever is cached for this user
+            return self.user_posts(username, limit), errors
+        incremental = before is not None
+        self._count('incremental_fetches' if incremental else 'full_fetches')
+        self.store_user_posts(username, posts, full=not incremental)
+        served = self.user_posts(username, limit)
+        fetched = {post.id for post in posts}
+        self._count('post_hits', sum(post.id not in fetched for post in served))
+        self._count('post_misses', len(posts))
+        return served, errors
+
+    def encode(self, embedder, model_name, texts, batch_size=32):
+        hashes = [text_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        now = time.time()
+        with self._lock:
+            found = {}
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                found.update(self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN "
+                    f"({','.join('?' * len(batch))})", [model_name, *batch]))
+        missing = [h for h in unique if h not in found]
+        self._count('embedding_hits', sum(h in found for h in hashes))
+        self._count('embedding_misses', len(missing))
+
+        vectors = {h: np.frombuffer(blob, dtype=np.float32) for h, blob in found.items()}
+        if missing:
+            first_text = dict(zip(hashes, texts))
+            with metrics.timer('embed'):
+                encoded = embedder.encode([first_text[h] for h in missing], batch_size=batch_size,
+                                          convert_to_numpy=True)
+            encoded = np.asarray(encoded, dtype=np.float32)
+            vectors.update(zip(missing, encoded))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (text_hash, model, vector, used_at) VALUES (?, ?, ?, ?)',
+                [(h, model_name, vectors[h].tobytes(), now) for h in missing])
+            self._conn.executemany('UPDATE embeddings SET used_at = ? WHERE text_hash = ? AND model = ?',
+                                   [(now, h, model_name) for h in found])
+        if missing:
+            self.evict()
+        return np.stack([vectors[h] for h in hashes]) if hashes else np.empty((0, 0), dtype=np.float32)
+
+    def evict(self, now=None):
+        # Drop anything idle for longer than max_age, then the least recently used
+        # embeddings until the blob store fits in max_embedding_bytes.
+        cutoff = (now or time.time()) - self.max_age
+        with self._lock, self._conn:
+            stale = [u for u, in self._conn.execute('SELECT username FROM users WHERE used_at < ?', (cutoff,))]
+            self._conn.executemany('DELETE FROM posts WHERE username = ?', [(u,) for u in stale])
+            self._conn.execute('DELETE FROM users WHERE used_at < ?', (cutoff,))
+            evicted = self._conn.execute('DELETE FROM embeddings WHERE used_at < ?', (cutoff,)).rowcount
+
+            total, = self._conn.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()
+            if total > self.max_embedding_bytes:
+                rows = self._conn.execute('SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY used_at')
+                drop = []
+                for rowid, size in rows:
+                    if total <= self.max_embedding_bytes:
+                        break
+                    drop.append((rowid,))
+                    total -= size
+                self._conn.executemany('DELETE FROM embeddings WHERE rowid = ?', drop)
+                evicted += len(drop)
+            self._count('evicted_embeddings', evicted)
+
+    def report(self):
+        with self._lock:
+            users, = self._conn.execute('SELECT COUNT(*) FROM users').fetchone()
+            posts, = self._conn.execute('SELECT COUNT(*) FROM posts').fetchone()
+            embeddings, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()
+            return {**self.stats, 'users': users, 'posts': posts, 'embeddings': embeddings, 'embedding_bytes': size}
+
+    def clear(self):
+        with self._lock, self._conn:
+            for table in ('users', 'posts', 'embeddings'):
+                self._conn.execute(f'DELETE FROM {table}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the local post/embedding cache.")
+    parser.add_argument('command', choices=['report', 'evict', 'clear'])
+    parser.add_argument('--path', default=CACHE_PATH)
+    args = parser.parse_args()
+
+    cache = PostCache(args.path)
+    if args.command == 'evict':
+        cache.evict()
+    elif args.command == 'clear':
+        cache.clear()
+    print(json.dumps(cache.report()))
+
+
+if __name__ == '__main__':
+    main()
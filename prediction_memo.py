@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMO_PATH = os.path.join(BASE_DIR, '.cache', 'predictions.sqlite3')
+MAX_ENTRIES = 100_000  # ~150 bytes each in memory
+MAX_ROWS = 1_000_000  # on disk; the least recently used beyond this are evicted as new ones are written
+TOUCH_BATCH = 1000  # memory hits whose used_at is refreshed on disk in one UPDATE
+EVICT_EVERY = 10_000  # rows written between checks of MAX_ROWS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    key TEXT PRIMARY KEY,
+    result INTEGER NOT NULL,
+    probability REAL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_by_use ON predictions (used_at);
+"""
+
+
+def file_fingerprint(*paths):
+    # content hash of the artifacts a prediction depends on
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class PredictionMemo:
+    # (risk_result, risk_probability) per post text, for one classifier version.
+    # Keys hash the version together with the raw text: normalisation is
+    # deterministic, so a hit skips normalize/vectorize/predict entirely. Entries
+    # live in an LRU dict shared by every session of the process and, with a path,
+    # are written through to SQLite so they survive restarts. Hits refresh used_at on
+    # disk too (batched), and the table is trimmed to max_rows as it grows.
+    def __init__(self, version='', max_entries=MAX_ENTRIES, path=None, max_rows=MAX_ROWS):
+        self.version = version
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.stats = dict.fromkeys(('hits', 'disk_hits', 'misses', 'evicted'), 0)
+        self._entries = OrderedDict()
+        self._touched = set()
+        self._written = 0
+        self._lock = threading.RLock()
+        self._conn = None
+        if path:
+            if path != ':memory:':
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+
+    def set_version(self, version):
+        # old entries just stop matching and age out of the LRU
+        self.version = version
+
+    def key(self, text):
+        return hashlib.blake2b(f"{self.version}\0{text}".encode('utf-8'), digest_size=16).hexdigest()
+
+    def get_many(self, keys):
+        # -> {key: (result, probability)} for the keys that are known
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+            self.stats['hits'] += len(found)
+            if self._conn is not None:
+                self._touched.update(found)
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._flush_touched()
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if missing and self._conn is not None:
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    for key, result, probability in self._conn.execute(
+                            f"SELECT key, result, probability FROM predictions "
+                            f"WHERE key IN ({','.join('?' * len(batch))})", batch):
+                        found[key] = (result, probability)
+                        self._remember(key, (result, probability))
+                        self.stats['disk_hits'] += 1
+            self.stats['misses'] += sum(key not in found for key in missing)
+        return found
+
+    def put_many(self, items):
+        # items: {key: (result, probability)}
+        with self._lock:
+            for key, value in items.items():
+                self._remember(key, value)
+            if self._conn is not None and items:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO predictions (key, result, probability, used_at) VALUES (?, ?, ?, ?)',
+                        [(key, result, probability, now) for key, (result, probability) in items.items()])
+                self._touched.difference_update(items)
+                self._flush_touched()
+                self._written += len(items)
+                if self._written >= EVICT_EVERY:
+                    self._written = 0
+                    self.evict(self.max_rows)
+
+    def _flush_touched(self):
+        # memory hits never reach SQLite otherwise, and evict() would drop the hottest keys first
+        if not self._touched:
+            return
+        keys, self._touched = list(self._touched), set()
+        now = time.time()
+        with self._conn:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                self._conn.execute(f"UPDATE predictions SET used_at = ? WHERE key IN ({','.join('?' * len(batch))})",
+                                   [now] + batch)
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def evict(self, max_rows=None):
+        # trims the on-disk table to the max_rows most recently used entries
+        max_rows = max_rows or self.max_rows
+        if self._conn is None:
+            return 0
+        with self._lock:
+            self._flush_touched()
+            with self._conn:
+                cursor = self._conn.execute(
+                    'DELETE FROM predictions WHERE key NOT IN '
+                    '(SELECT key FROM predictions ORDER BY used_at DESC LIMIT ?)', (max_rows,))
+            self.stats['evicted'] += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._touched.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute('DELETE FROM predictions')
+
+    def report(self):
+        with self._lock:
+            stored = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] if self._conn else None
+            return {**self.stats, 'version': self.version, 'entries': len(self._entries), 'stored': stored}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim the on-disk prediction memo.")
+    parser.add_argument('command', choices=('report', 'evict', 'clear'))
+    parser.add_argument('--path', default=MEMO_PATH)
+    parser.add_argument('--max-rows', type=int)
+    args = parser.parse_args()
+
+    memo = PredictionMemo(path=args.path)
+    if args.command == 'evict':
+        print(json.dumps({'evicted': memo.evict(args.max_rows)}))
+    elif args.command == 'clear':
+        memo.clear()
+    print(json.dumps(memo.report()))
+
+
+if __name__ == '__main__':
+    main()
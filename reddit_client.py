@@ -0,0 +1,434 @@
+import argparse
+import contextvars
+import heapq
+import json
+import queue
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FetchTimeout
+from dataclasses import asdict, dataclass
+
+import metrics
+
+FETCH_TIMEOUT = 10.0  # seconds for one group of concurrent calls
+REQUEST_TIMEOUT = 8  # seconds praw waits on a single HTTP request
+MAX_WORKERS = 8
+USER_POST_LIMIT = 25
+HISTORY_LIMIT = 1000  # Reddit stops paging a listing after ~1000 items
+PREFETCH = 256  # history items fetched ahead of the consumer
+
+
+@dataclass
+class Post:
+    id: str
+    subreddit: str
+    author: str
+    title: str
+    content: str
+    url: str
+    created_utc: float = 0.0
+
+    @property
+    def text(self):
+        return self.title + " " + self.content
+
+    @classmethod
+    def from_submission(cls, submission):
+        return cls(
+            id=submission.id,
+            subreddit=str(submission.subreddit),
+            author=str(submission.author),
+            title=submission.title,
+            content=submission.selftext,
+            url=f"https://www.reddit.com{submission.permalink}",
+            created_utc=float(submission.created_utc),
+        )
+
+    @classmethod
+    def from_comment(cls, comment):
+        return cls(
+            id=comment.id,
+            subreddit=str(comment.subreddit),
+            author=str(comment.author),
+            title='',
+            content=comment.body,
+            url=f"https://www.reddit.com{comment.permalink}",
+            created_utc=float(comment.created_utc),
+        )
+
+
+class RedditBackend:
+    # The handful of Reddit reads the app and scan.py make. Every method is a single
+    # blocking round trip, so fetch_all can fan them out over the thread pool.
+    name = 'base'
+
+    def listing(self, subreddit, listing, limit, **params):
+        raise NotImplementedError
+
+    def user_submissions(self, username, limit, before=None):
+        # newest first; with `before` (a submission id) only posts newer than it
+        raise NotImplementedError
+
+    def user_history(self, username, limit=HISTORY_LIMIT, include_comments=False):
+        # Lazily pages through a user's submissions (and comments), newest first.
+        raise NotImplementedError
+
+    def stream_submissions(self, subreddits):
+        # Yields new Posts as they are submitted, and None whenever a poll came back
+        # empty so consumers get a chance to check for shutdown.
+        raise NotImplementedError
+
+    def subreddit_icon(self, subreddit):
+        raise NotImplementedError
+
+    def user_icon(self, username):
+        raise NotImplementedError
+
+
+class PrawBackend(RedditBackend):
+    name = 'praw'
+
+    def __init__(self, reddit):
+        self.reddit = reddit
+
+    def listing(self, subreddit, listing, limit, **params):
+        submissions = getattr(self.reddit.subreddit(subreddit), listing)(limit=limit, **params)
+        return [Post.from_submission(s) for s in submissions]
+
+    def user_submissions(self, username, limit, before=None):
+        params = {'before': f"t3_{before}"} if before else None
+        submissions = self.reddit.redditor(username).submissions.new(limit=limit, params=params)
+        return [Post.from_submission(s) for s in submissions]
+
+    def user_history(self, username, limit=HISTORY_LIMIT, include_comments=False):
+        # praw fetches 100 items per request as the generators are consumed
+        redditor = self.reddit.redditor(username)
+        listings = [map(Post.from_submission, redditor.submissions.new(limit=limit))]
+        if include_comments:
+            listings.append(map(Post.from_comment, redditor.comments.new(limit=limit)))
+        yield from heapq.merge(*listings, key=lambda post: post.created_utc, reverse=True)
+
+    def stream_submissions(self, subreddits):
+        stream = self.reddit.subreddit('+'.join(subreddits)).stream.submissions(skip_existing=True, pause_after=0)
+        for submission in stream:
+            yield None if submission is None else Post.from_submission(submission)
+
+    def subreddit_icon(self, subreddit):
+        return getattr(self.reddit.subreddit(subreddit), 'icon_img', None) or None
+
+    def user_icon(self, username):
+        return getattr(self.reddit.redditor(username), 'icon_img', None) or None
+
+
+class ReplayBackend(RedditBackend):
+    # Serves a fixture written by RecordingBackend.save (or by hand), optionally
+    # sleeping `latency` seconds per call to stand in for the network round trip and
+    # streaming at most `stream_rate` posts per second.
+    name = 'replay'
+
+    def __init__(self, fixture, latency=0.0, stream_rate=0.0):
+        if isinstance(fixture, (str, os.PathLike)):
+            with open(fixture, encoding='utf-8') as f:
+                fixture = json.load(f)
+        self.subreddits = fixture.get('subreddits', {})
+        self.users = fixture.get('users', {})
+        self.latency = latency
+        self.stream_rate = stream_rate
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _subreddit(self, subreddit):
+        try:
+            return self.subreddits[subreddit]
+        except KeyError:
+            raise LookupError(f"r/{subreddit} is not in the fixture") from None
+
+    def _user(self, username):
+        try:
+            return self.users[username]
+        except KeyError:
+            raise LookupError(f"u/{username} is not in the fixture") from None
+
+    def listing(self, subreddit, listing, limit, **params):
+        self._wait()
+        posts = self._subreddit(subreddit).get('listings', {}).get(listing, [])
+        return [Post(**post) for post in posts[:limit]]
+
+    def user_submissions(self, username, limit, before=None):
+        self._wait()
+        posts = self._user(username).get('submissions', [])
+        if before:
+            ids = [post['id'] for post in posts]
+            posts = posts[:ids.index(before)] if before in ids else posts
+        return [Post(**post) for post in posts[:limit]]
+
+    def user_history(self, username, limit=HISTORY_LIMIT, include_comments=False):
+        user = self._user(username)
+        listings = [user.get('submissions', [])[:limit]]
+        if include_comments:
+            listings.append(user.get('comments', [])[:limit])
+        merged = heapq.merge(*listings, key=lambda post: post.get('created_utc', 0.0), reverse=True)
+        for i, post in enumerate(merged):
+            if i % 100 == 0:
+                self._wait()  # one simulated round trip per page
+            yield Post(**post)
+
+    def stream_submissions(self, subreddits):
+        # every fixture post of the requested subreddits once, oldest first
+        posts = {}
+        for subreddit in subreddits:
+            for listing in self.subreddits.get(subreddit, {}).get('listings', {}).values():
+                posts.update((post['id'], post) for post in listing)
+        for post in sorted(posts.values(), key=lambda post: post.get('created_utc', 0.0)):
+            if self.stream_rate:
+                time.sleep(1.0 / self.stream_rate)
+            yield Post(**post)
+
+    def subreddit_icon(self, subreddit):
+        self._wait()
+        return self._subreddit(subreddit).get('icon_img')
+
+    def user_icon(self, username):
+        self._wait()
+        return self._user(username).get('icon_img')
+
+
+class RecordingBackend(RedditBackend):
+    # Wraps a live backend and keeps everything it returns, so a session against
+    # Reddit can be saved once and replayed offline with ReplayBackend.
+    name = 'recording'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.subreddits = {}
+        self.users = {}
+        self._lock = threading.Lock()
+
+    def listing(self, subreddit, listing, limit, **params):
+        posts = self.backend.listing(subreddit, listing, limit, **params)
+        with self._lock:
+            entry = self.subreddits.setdefault(subreddit, {'listings': {}})
+            entry['listings'][listing] = [asdict(post) for post in posts]
+        return posts
+
+    def user_submissions(self, username, limit, before=None):
+        posts = self.backend.user_submissions(username, limit, before)
+        if before:
+            return posts
+        with self._lock:
+            self.users.setdefault(username, {})['submissions'] = [asdict(post) for post in posts]
+        return posts
+
+    def user_history(self, username, limit=HISTORY_LIMIT, include_comments=False):
+        return self.backend.user_history(username, limit, include_comments)
+
+    def stream_submissions(self, subreddits):
+        # streamed posts are saved as each subreddit's 'new' listing, newest first
+        for post in self.backend.stream_submissions(subreddits):
+            if post is not None:
+                with self._lock:
+                    entry = self.subreddits.setdefault(post.subreddit, {'listings': {}})
+                    entry['listings'].setdefault('new', []).insert(0, asdict(post))
+            yield post
+
+    def subreddit_icon(self, subreddit):
+        icon = self.backend.subreddit_icon(subreddit)
+        with self._lock:
+            self.subreddits.setdefault(subreddit, {'listings': {}})['icon_img'] = icon
+        return icon
+
+    def user_icon(self, username):
+        icon = self.backend.user_icon(username)
+        with self._lock:
+            self.users.setdefault(username, {})['icon_img'] = icon
+        return icon
+
+    def fixture(self):
+        with self._lock:
+            return {'subreddits': self.subreddits, 'users': self.users}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.fixture(), f, ensure_ascii=False, indent=1)
+
+
+def as_backend(reddit):
+    # callers may still hand us a praw.Reddit instance
+    return reddit if isinstance(reddit, RedditBackend) else PrawBackend(reddit)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One long-lived pool: a call that overruns its timeout keeps its worker busy in
+    # the background instead of blocking the caller on executor shutdown.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='reddit-fetch')
+        return _pool
+
+
+def _timed_call(fn, *args):
+    # backend method name -> stage, e.g. reddit_listing, reddit_user_submissions
+    with metrics.timer(f"reddit_{getattr(fn, 'func', fn).__name__}"):
+        return fn(*args)
+
+
+@metrics.timed('reddit_fetch')
+def fetch_all(calls, timeout=FETCH_TIMEOUT):
+    # calls: {label: (fn, *args)}. Runs them concurrently and returns whatever finished
+    # within `timeout` seconds, plus {label: error message} for each call that failed
+    # or overran.
+    pool = get_pool()
+    # each call runs in a copy of the caller's context, so reddit_scheduler.priority() carries over
+    futures = {label: pool.submit(contextvars.copy_context().run, _timed_call, fn, *args)
+               for label, (fn, *args) in calls.items()}
+    deadline = time.monotonic() + timeout
+
+    results, errors = {}, {}
+    for label, future in futures.items():
+        try:
+            results[label] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FetchTimeout:
+            future.cancel()
+            errors[label] = f"Timed out fetching {label} after {timeout:g} s"
+        except Exception as e:
+            errors[label] = f"Could not fetch {label}: {e}"
+    return results, errors
+
+
+def prefetch(iterable, size=PREFETCH):
+    # Drains `iterable` on a background thread into a bounded queue, so the next page
+    # of a listing is already downloading while the caller encodes the previous one.
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        # gives up once the consumer has gone, so an abandoned listing never pins this
+        # thread (and the generator it holds) on a full queue
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+            return
+        put((done, None))
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), name='reddit-prefetch',
+                     daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def fetch_user_posts(backend, username, limit=USER_POST_LIMIT, timeout=FETCH_TIMEOUT, before=None):
+    results, errors = fetch_all({'posts': (as_backend(backend).user_submissions, username, limit, before)}, timeout)
+    return results.get('posts', []), list(errors.values())
+
+
+def fetch_icons(backend, subreddit=None, username=None, timeout=FETCH_TIMEOUT, images=False):
+    # -> ({'subreddit': url, 'user': url}, errors). With images=True and a backend that
+    # caches icon bytes (reddit_scheduler.ScheduledBackend) the values are the image
+    # bytes instead, falling back to the URL if the download fails.
+    backend = as_backend(backend)
+    calls = {}
+    if subreddit:
+        calls[f"r/{subreddit} icon"] = (backend.subreddit_icon, subreddit)
+    if username:
+        calls[f"u/{username} icon"] = (backend.user_icon, username)
+    results, errors = fetch_all(calls, timeout)
+    icons = {
+        'subreddit': results.get(f"r/{subreddit} icon") if subreddit else None,
+        'user': results.get(f"u/{username} icon") if username else None,
+    }
+    if images and hasattr(backend, 'icon_image'):
+        urls = {kind: url for kind, url in icons.items() if url}
+        downloaded, image_errors = fetch_all({f"{kind} icon image": (backend.icon_image, url)
+                                              for kind, url in urls.items()}, timeout)
+        errors.update(image_errors)
+        for kind in urls:
+            icons[kind] = downloaded.get(f"{kind} icon image", urls[kind])
+    return icons, list(errors.values())
+
+
+def _live_backend():
+    import praw
+    return PrawBackend(praw.Reddit(client_id=os.environ['REDDIT_CLIENT_ID'],
+                                   client_secret=os.environ['REDDIT_CLIENT_SECRET'],
+                                   user_agent=os.environ['REDDIT_USER_AGENT'],
+                                   timeout=REQUEST_TIMEOUT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Reddit fixtures and time fetches against them offline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help="fetch live (REDDIT_* env vars) and save a fixture")
+    record_parser.add_argument('--out', default='reddit_fixture.json')
+    record_parser.add_argument('--subreddit', action='append', default=[])
+    record_parser.add_argument('--user', action='append', default=[])
+
+    bench_parser = subparsers.add_parser('bench', help="sequential vs concurrent fetch against a fixture")
+    bench_parser.add_argument('--fixture', default='reddit_fixture.json')
+    bench_parser.add_argument('--latency', type=float, default=0.2, help="simulated seconds per round trip")
+    bench_parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import scan
+
+    if args.command == 'record':
+        recorder = RecordingBackend(_live_backend())
+        for name in args.subreddit:
+            _, errors = scan.fetch_subreddit_posts(recorder, name)
+            fetch_icons(recorder, subreddit=name)
+            print(json.dumps({'subreddit': name, 'errors': errors}))
+        for name in args.user:
+            _, errors = fetch_user_posts(recorder, name)
+            fetch_icons(recorder, username=name)
+            print(json.dumps({'user': name, 'errors': errors}))
+        recorder.save(args.out)
+        return
+
+    backend = ReplayBackend(args.fixture, latency=args.latency)
+    for name in backend.subreddits:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for listing, params in scan.LISTINGS:
+                backend.listing(name, listing, scan.LISTING_LIMIT, **params)
+        sequential = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            posts, errors = scan.fetch_subreddit_posts(backend, name)
+        concurrent = (time.perf_counter() - start) / args.repeat
+        print(json.dumps({'subreddit': name, 'posts': len(posts), 'errors': errors,
+                          'sequential_seconds': sequential, 'concurrent_seconds': concurrent}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import contextvars
+import html
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from reddit_client import FETCH_TIMEOUT, HISTORY_LIMIT, REQUEST_TIMEOUT, RedditBackend
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Reddit's OAuth budget is 100 requests/minute per client; headers refine it at runtime.
+DEFAULT_RATE = 100 / 60
+BURST = 20
+BULK_RESERVE = 0.25  # share of the bucket bulk work may not touch, kept for interactive calls
+# An interactive call gives up (RateLimited) after waiting this long for a token. It
+# stays well inside fetch_all's FETCH_TIMEOUT, so a starved request is reported as
+# rate limited, with time left for the request itself, never as a network timeout.
+INTERACTIVE_WAIT = FETCH_TIMEOUT / 2
+PAGE_SIZE = 100  # items per listing request
+METADATA_TTL = 3600
+IMAGE_TTL = 24 * 3600
+MAX_IMAGE_BYTES = 32 * 1024 * 1024
+
+_priority = contextvars.ContextVar('reddit_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    # `with priority(BULK):` marks every Reddit call made inside (including the ones
+    # fetch_all runs on pool threads) as background work
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimited(Exception):
+    pass
+
+
+class RateLimiter:
+    # Token bucket shared by every session of the process. update() takes the
+    # X-Ratelimit-Remaining/Reset values Reddit sends back, so the refill rate
+    # spreads the remaining server-side budget over the rest of the window. Bulk
+    # requests leave BULK_RESERVE of the bucket alone and always yield to waiting
+    # interactive ones.
+    def __init__(self, rate=DEFAULT_RATE, burst=BURST, bulk_reserve=BULK_RESERVE):
+        self.default_rate = rate
+        self.rate = rate
+        self.capacity = burst
+        self.reserve = burst * bulk_reserve
+        self.tokens = float(burst)
+        self.reset_at = None
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self.stats = {'acquired': 0, 'waited_seconds': 0.0, 'rejected': 0, 'remaining': None}
+
+    def _refill(self, now):
+        if self.reset_at is not None and now >= self.reset_at:
+            self.rate, self.reset_at = self.default_rate, None
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def update(self, remaining, reset_in):
+        # remaining requests in the current window and seconds until it resets
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            reset_in = max(float(reset_in), 1.0)
+            self.tokens = min(self.tokens, float(remaining))
+            self.rate = max(float(remaining), 0.0) / reset_in
+            self.reset_at = now + reset_in
+            self.stats['remaining'] = remaining
+            self._cond.notify_all()
+
+    def acquire(self, n=1, level=None, timeout=None):
+        level = level or _priority.get()
+        if timeout is None and level == INTERACTIVE:
+            timeout = INTERACTIVE_WAIT
+        n = min(n, self.capacity - self.reserve)
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[level] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    floor = 0 if level == INTERACTIVE else self.reserve
+                    if (level == INTERACTIVE or not self._waiting[INTERACTIVE]) and self.tokens - n >= floor:
+                        self.tokens -= n
+                        self.stats['acquired'] += n
+                        self.stats['waited_seconds'] += now - start
+                        return now - start
+                    if timeout is not None and now - start >= timeout:
+                        self.stats['rejected'] += 1
+                        raise RateLimited(f"rate limited: no Reddit request budget within {timeout:g} s")
+                    needed = (n + floor - self.tokens) / self.rate if self.rate else 1.0
+                    if timeout is not None:
+                        needed = min(needed, timeout - (now - start))
+                    self._cond.wait(min(max(needed, 0.01), 1.0))
+            finally:
+                self._waiting[level] -= 1
+                self._cond.notify_all()
+
+    def report(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {**self.stats, 'tokens': round(self.tokens, 2), 'rate_per_second': round(self.rate, 3),
+                    'waiting': dict(self._waiting)}
+
+
+class TTLCache:
+    # Thread-safe LRU whose entries expire after ttl seconds; bounded by entry count
+    # and, when values are bytes, by their total size.
+    def __init__(self, ttl, max_entries=4096, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.bytes += len(value) if isinstance(value, bytes) else 0
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, value = self._entries.pop(key)
+        self.bytes -= len(value) if isinstance(value, bytes) else 0
+
+    def report(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+_missing = object()
+
+
+class ScheduledBackend(RedditBackend):
+    # Wraps a backend so every Reddit request first takes a token from the shared
+    # RateLimiter (one per listing page), and icons plus their image bytes are served
+    # from TTL caches, so re-rendering the same post or user makes no network calls.
+    name = 'scheduled'
+
+    def __init__(self, backend, limiter=None, metadata_ttl=METADATA_TTL, image_ttl=IMAGE_TTL,
+                 max_image_bytes=MAX_IMAGE_BYTES):
+        self.backend = backend
+        self.limiter = limiter or RateLimiter()
+        self.metadata = TTLCache(metadata_ttl)
+        self.images = TTLCache(image_ttl, max_entries=1024, max_bytes=max_image_bytes)
+
+    def _sync(self):
+        # praw keeps the last response's rate-limit headers in reddit.auth.limits
+        reddit = getattr(self.backend, 'reddit', None)
+        limits = getattr(getattr(reddit, 'auth', None), 'limits', None) or {}
+        if limits.get('remaining') is not None and limits.get('reset_timestamp'):
+            self.limiter.update(limits['remaining'], limits['reset_timestamp'] - time.time())
+
+    def _call(self, pages, fn, *args, **kwargs):
+        self.limiter.acquire(pages)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._sync()
+
+    def _pages(self, limit):
+        return max(1, -(-(limit or PAGE_SIZE) // PAGE_SIZE))
+
+    def listing(self, subreddit, listing, limit, **params):
+        return self._call(self._pages(limit), self.backend.listing, subreddit, listing, limit, **params)
+
+    def user_submissions(self, username, limit, before=None):
+        return self._call(self._pages(limit), self.backend.user_submissions, username, limit, before)
+
+    def user_history(self, username, limit=HISTORY_LIMIT, include_comments=False):
+        # a token before every PAGE_SIZE items, i.e. before praw fetches each page
+        items = iter(self.backend.user_history(username, limit, include_comments))
+        pages = 2 if include_comments else 1
+        count = 0
+        while True:
+            if count % PAGE_SIZE == 0:
+                self.limiter.acquire(pages)
+            try:
+                post = next(items)
+            except StopIteration:
+                return
+            finally:
+                self._sync()
+            count += 1
+            yield post
+
+    def stream_submissions(self, subreddits):
+        # one token per poll: praw polls again after each empty (None) round
+        self.limiter.acquire(1)
+        for post in self.backend.stream_submissions(subreddits):
+            self._sync()
+            if post is None:
+                yield None
+                self.limiter.acquire(1)
+            else:
+                yield post
+
+    def _metadata(self, key, fn, *args):
+        value = self.metadata.get(key, _missing)
+        if value is _missing:
+            value = self._call(1, fn, *args)
+            self.metadata.put(key, value)
+        return value
+
+    def subreddit_icon(self, subreddit):
+        return self._metadata(('subreddit_icon', subreddit.lower()), self.backend.subreddit_icon, subreddit)
+
+    def user_icon(self, username):
+        return self._metadata(('user_icon', username.lower()), self.backend.user_icon, username)
+
+    def icon_image(self, url):
+        # icon bytes from Reddit's CDN (not API quota, so no token); cached by URL
+        data = self.images.get(url)
+        if data is None:
+            request = urllib.request.Request(html.unescape(url), headers={'User-Agent': 'mental-health-forecast icon fetch'})
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                data = response.read()
+            self.images.put(url, data)
+        return data
+
+    def report(self):
+        return {'limiter': self.limiter.report(), 'metadata': self.metadata.report(), 'images': self.images.report()}
@@ -0,0 +1,306 @@
+import os
+import pickle
+import threading
+import time
+
+import nltk
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Point these at the vectorizer.pkl / model.pkl train.py writes to serve a retrained
+# model, or MODEL_PATH at a model_export.py .npz bundle.
+VECTORIZER_PATH = os.environ.get('VECTORIZER_PATH', os.path.join(BASE_DIR, 'vectorizer.pkl'))
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(BASE_DIR, 'model.pkl'))
+# Set to an online.py checkpoint to serve the incrementally trained model instead;
+# it is reloaded whenever the file changes, so `online.py update` swaps it in live.
+ONLINE_MODEL_PATH = os.environ.get('ONLINE_MODEL_PATH')
+# Set to persist the prediction memo (prediction_memo.py) across restarts; unset keeps
+# it in memory only.
+PREDICTION_MEMO_PATH = os.environ.get('PREDICTION_MEMO_PATH')
+# Set to a running scoring_service.py (e.g. http://127.0.0.1:8765) to score there instead
+# of loading the models in every app process.
+SCORING_SERVICE_URL = os.environ.get('SCORING_SERVICE_URL')
+# Set to a model_store.py root to serve its current version: memory-mapped arrays shared
+# by every process on the host, re-read when `current` is switched.
+MODEL_STORE = os.environ.get('MODEL_STORE')
+# Set to a gate written by `python cascade.py calibrate` to run the SVC only on posts the
+# cheap LR/NB stage is unsure about; ignored if it was calibrated for another model.
+CASCADE_GATE = os.environ.get('CASCADE_GATE')
+EMBEDDER_NAME = 'all-MiniLM-L6-v2'
+# 'torch' (SentenceTransformer) or 'onnx' (int8 graph built by `python embedding.py export`)
+EMBEDDER_BACKEND = os.environ.get('EMBEDDER_BACKEND', 'torch')
+EMBEDDER_THREADS = int(os.environ.get('EMBEDDER_THREADS', '0')) or None
+# Set to a reddit_client.py fixture to serve Reddit reads offline, no credentials needed.
+REDDIT_FIXTURE = os.environ.get('REDDIT_FIXTURE')
+
+# nltk package name -> path used by nltk.data.find
+NLTK_RESOURCES = {
+    'stopwords': 'corpora/stopwords',
+    'punkt_tab': 'tokenizers/punkt_tab',
+}
+
+# Everything below lives for the lifetime of the process. Streamlit only re-executes
+# the main script on a rerun, imported modules (and this cache) stay in sys.modules.
+_lock = threading.RLock()
+_cache = {}
+_load_seconds = {}
+_run_seconds = []
+
+
+def _cached(key, loader):
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+    with _lock:
+        if key not in _cache:
+            start = time.perf_counter()
+            _cache[key] = loader()
+            _load_seconds[key] = time.perf_counter() - start
+        return _cache[key]
+
+
+def is_loaded(key):
+    return key in _cache
+
+
+def nltk_data_present(name):
+    try:
+        nltk.data.find(NLTK_RESOURCES[name])
+        return True
+    except LookupError:
+        return False
+
+
+def ensure_nltk_data():
+    def load():
+        missing = [name for name in NLTK_RESOURCES if not nltk_data_present(name)]
+        for name in missing:
+            nltk.download(name, quiet=True)
+        return tuple(missing)
+    return _cached('nltk', load)
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def get_vectorizer(path=VECTORIZER_PATH):
+    return _cached(('vectorizer', path), lambda: _load_pickle(path))
+
+
+def get_model(path=MODEL_PATH):
+    # .npz paths are compact bundles written by model_export.py
+    def load():
+        import metrics
+        import model_export
+        return metrics.instrument_model(model_export.load_model(path))
+    return _cached(('model', path), load)
+
+
+def _cached_latest(key, loader, prefix_len=2):
+    # _cached for values that have versions: the first prefix_len parts of the key name
+    # the slot, the rest the version. Loading a new version drops the previous ones,
+    # so replaced models (and their mmaps) are released rather than kept forever.
+    if key not in _cache:
+        with _lock:
+            for stale in [k for k in _cache if k[:prefix_len] == key[:prefix_len] and k != key]:
+                del _cache[stale]
+                _load_seconds.pop(stale, None)
+    return _cached(key, loader)
+
+
+def get_online_model(path=ONLINE_MODEL_PATH):
+    # keyed by mtime: a newer checkpoint replaces the loaded one on the next call
+    def load():
+        import online
+        return online.load(path)
+    return _cached_latest(('online_model', path, os.stat(path).st_mtime_ns), load)
+
+
+def get_classifier():
+    # (vectorizer, model) for scoring posts; the online model is its own vectorizer
+    if ONLINE_MODEL_PATH:
+        model = get_online_model()
+        return model, model
+    if MODEL_STORE:
+        store = get_model_store()
+        version = store.current_version()
+        vectorizer, model = _cached_latest(('model_store_version', MODEL_STORE, version),
+                                           lambda: store.load(version))
+    else:
+        vectorizer, model = get_vectorizer(), get_model()
+    if cascade_active():
+        def load():
+            import cascade
+            return cascade.CascadeModel(model, get_cascade_gate())
+        model = _cached_latest(('cascade', CASCADE_GATE, classifier_version(cascade=False)), load)
+    return vectorizer, model
+
+
+def get_model_store(root=MODEL_STORE):
+    def load():
+        import model_store
+        return model_store.ModelStore(root)
+    return _cached(('model_store', root), load)
+
+
+def get_cascade_gate(path=CASCADE_GATE):
+    def load():
+        import cascade
+        return cascade.load_gate(path)
+    return _cached(('cascade_gate', path), load)
+
+
+def cascade_active():
+    return bool(CASCADE_GATE) and not ONLINE_MODEL_PATH and \
+        get_cascade_gate()['classifier_version'] == classifier_version(cascade=False)
+
+
+def classifier_version(cascade=True):
+    # changes whenever the artifacts behind get_classifier() do
+    import prediction_memo
+    if ONLINE_MODEL_PATH:
+        return f"online-{os.stat(ONLINE_MODEL_PATH).st_mtime_ns}"
+    if MODEL_STORE:
+        version = f"store-{get_model_store().current_version()}"
+    else:
+        paths = (VECTORIZER_PATH, MODEL_PATH)
+        version = _cached(('classifier_version',) + paths, lambda: prediction_memo.file_fingerprint(*paths))
+    if cascade and cascade_active():
+        gate = _cached(('classifier_version', CASCADE_GATE), lambda: prediction_memo.file_fingerprint(CASCADE_GATE))
+        version = f"{version}-cascade-{gate}"
+    return version
+
+
+def get_prediction_memo():
+    def load():
+        import prediction_memo
+        return prediction_memo.PredictionMemo(path=PREDICTION_MEMO_PATH)
+    memo = _cached('prediction_memo', load)
+    memo.set_version(classifier_version())
+    return memo
+
+
+def get_scoring_client(url=SCORING_SERVICE_URL):
+    def load():
+        import scoring_service
+        return scoring_service.ScoringClient(url)
+    return _cached(('scoring_client', url), load)
+
+
+def embedder_id(name=EMBEDDER_NAME, backend=EMBEDDER_BACKEND):
+    # key for anything derived from embeddings (BDI option bank, post cache), since
+    # the backends' vectors are close but not identical
+    return name if backend == 'torch' else f"{name}-{backend}"
+
+
+def active_embedder_id():
+    # the id of whichever embedder actually produces vectors: with a scoring service
+    # that is the service's (its /healthz, asked once per URL), which may differ from
+    # this process's settings
+    if SCORING_SERVICE_URL:
+        return _cached(('active_embedder_id', SCORING_SERVICE_URL),
+                       lambda: get_scoring_client().info()['embedder_id'])
+    return embedder_id()
+
+
+def get_embedder(name=EMBEDDER_NAME, device='cpu', backend=EMBEDDER_BACKEND, threads=EMBEDDER_THREADS):
+    def load():
+        if backend == 'onnx':
+            import embedding
+            return embedding.OnnxEmbedder(embedding.onnx_dir(name), threads=threads)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        if stored:
+            import model_store
+            return model_store.load_embedder(stored, device=device)
+        return SentenceTransformer(name, device=device)
+
+    # a copy of this embedder in the model store is mapped instead of loaded
+    stored = None
+    if MODEL_STORE and backend == 'torch':
+        store = get_model_store()
+        if store.manifest().get('embedder') == name:
+            stored = store.embedder_path()
+    return _cached_latest(('embedder', name, device, backend, stored), load, prefix_len=4)
+
+
+def get_bdi_option_bank(embedder, name=None):
+    import bdi
+    name = name or embedder_id()
+    return _cached(('bdi_bank', name), lambda: bdi.build_option_bank(embedder, name))
+
+
+def get_reddit(client_id, client_secret, user_agent):
+    def load():
+        import praw
+        import reddit_client
+        return praw.Reddit(client_id=client_id, client_secret=client_secret, user_agent=user_agent,
+                           timeout=reddit_client.REQUEST_TIMEOUT)
+    return _cached(('reddit', client_id, user_agent), load)
+
+
+def get_reddit_backend(client_id=None, client_secret=None, user_agent=None, fixture=REDDIT_FIXTURE):
+    import reddit_client
+    if fixture:
+        return _cached(('reddit_backend', fixture), lambda: reddit_client.ReplayBackend(fixture))
+    def load():
+        # one scheduler (rate limiter + icon caches) per credentials, shared by all sessions
+        import reddit_scheduler
+        return reddit_scheduler.ScheduledBackend(reddit_client.PrawBackend(get_reddit(client_id, client_secret,
+                                                                                      user_agent)))
+    return _cached(('reddit_backend', client_id, user_agent), load)
+
+
+def get_post_cache():
+    def load():
+        import post_cache
+        return post_cache.PostCache()
+    return _cached('post_cache', load)
+
+
+def get_post_index(name=None):
+    name = name or embedder_id()
+
+    def load():
+        import vector_index
+        return vector_index.PostIndex(os.path.join(vector_index.INDEX_DIR, name))
+    return _cached(('post_index', name), load)
+
+
+def warm_up(vectorizer=None, model=None, embedder=None, normalizer=None):
+    # Push one dummy input through each stage so the first real request does not pay
+    # for lazy imports, BLAS thread pools and tokenizer initialisation.
+    def run():
+        text = 'warm up'
+        if normalizer is not None:
+            text = normalizer(text)
+        if vectorizer is not None:
+            vector_input = vectorizer.transform([text])
+            if model is not None:
+                import classifier
+                classifier.predict(model, vector_input)
+        if embedder is not None:
+            embedder.encode(['warm up'])
+        return True
+    return _cached('warm_up', run)
+
+
+def record_run(seconds):
+    with _lock:
+        _run_seconds.append(seconds)
+
+
+def startup_report():
+    with _lock:
+        runs = list(_run_seconds)
+        loads = dict(_load_seconds)
+    return {
+        'cold_start_seconds': runs[0] if runs else None,
+        'last_rerun_seconds': runs[-1] if len(runs) > 1 else None,
+        'reruns': max(len(runs) - 1, 0),
+        'load_seconds': {str(k if isinstance(k, str) else k[0]): v for k, v in loads.items()},
+    }
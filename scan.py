@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from functools import partial
+
+import classifier
+import metrics
+from reddit_client import FETCH_TIMEOUT, Post, as_backend, fetch_all
+from text_processing import transform_texts
+
+LISTINGS = (
+    ('hot', {}),
+    ('new', {}),
+    ('top', {'time_filter': 'all'}),
+)
+LISTING_LIMIT = 20
+
+# the mental-health group of app.py's subreddit list, also what monitor.py watches by default
+MENTAL_HEALTH_SUBREDDITS = (
+    "depression", "Anxiety", "socialanxiety", "SuicideWatch", "depression_help", "OCD", "bipolar", "BPD",
+    "mentalhealth", "psychotherapy", "KindVoice", "lonely", "offmychest", "Vent", "ptsd", "CPTSD",
+    "GriefSupport", "grief",
+)
+
+
+@dataclass
+class ScoredPost:
+    post: Post
+    risk_result: int
+    risk_probability: float = None
+
+    def as_post_data(self):
+        # the dict shape app.py keeps in st.session_state.posts_data['current_post']
+        data = asdict(self.post)
+        data.pop('id')
+        data['risk_result'] = self.risk_result
+        return data
+
+    def as_row(self):
+        return {
+            'id': self.post.id,
+            'title': self.post.title,
+            'author': self.post.author,
+            'risk_result': self.risk_result,
+            'risk_probability': self.risk_probability,
+            'url': self.post.url,
+        }
+
+
+@dataclass
+class ScanResult:
+    subreddit: str
+    scored: list
+    summary: dict
+    errors: list = field(default_factory=list)
+
+
+def dedupe_posts(posts):
+    seen = set()
+    unique = []
+    for post in posts:
+        if post.id not in seen:
+            seen.add(post.id)
+            unique.append(post)
+    return unique
+
+
+def fetch_subreddit_posts(reddit, subreddit_name, limit=LISTING_LIMIT, timeout=FETCH_TIMEOUT):
+    # hot/new/top are independent round trips, so they run concurrently; a listing
+    # that fails or overruns only costs its own posts.
+    backend = as_backend(reddit)
+    calls = {f"{listing} posts": (partial(backend.listing, **params), subreddit_name, listing, limit)
+             for listing, params in LISTINGS}
+    results, errors = fetch_all(calls, timeout)
+    posts = [post for listing, _ in LISTINGS for post in results.get(f"{listing} posts", [])]
+    return dedupe_posts(posts), list(errors.values())
+
+
+def predict_texts(texts, vectorizer, model, n_jobs=1):
+    # One normalize -> transform -> predict pass -> [(result, probability)]
+    with metrics.timer('normalize'):
+        normalized = transform_texts(texts, n_jobs=n_jobs)
+    with metrics.timer('vectorize'):
+        vector_input = vectorizer.transform(normalized)
+    with metrics.timer('predict'):
+        results, probabilities = classifier.predict_with_proba(model, vector_input)
+    probabilities = [None] * len(texts) if probabilities is None else probabilities[:, 1].tolist()
+    return [(int(result), probability) for result, probability in zip(results, probabilities)]
+
+
+def memoized(texts, predict, memo):
+    # predict(texts) -> [(result, probability)], called only for the distinct texts
+    # the PredictionMemo has not seen under the current model
+    keys = [memo.key(text) for text in texts]
+    known = memo.get_many(keys)
+    missing = {key: text for key, text in zip(keys, texts) if key not in known}
+    if missing:
+        fresh = dict(zip(missing, predict(list(missing.values()))))
+        memo.put_many(fresh)
+        known.update(fresh)
+    return [known[key] for key in keys]
+
+
+def score_posts(posts, vectorizer, model, n_jobs=1, memo=None, client=None):
+    # Scores the whole batch in one pass, ranked by risk. With a scoring_service
+    # client the pipeline runs in the service instead of this process.
+    if not posts:
+        return []
+    texts = [post.text for post in posts]
+    if client is not None:
+        predict = client.predict_texts
+    else:
+        predict = partial(predict_texts, vectorizer=vectorizer, model=model, n_jobs=n_jobs)
+    predictions = predict(texts) if memo is None else memoized(texts, predict, memo)
+
+    scored = [ScoredPost(post, result, probability) for post, (result, probability) in zip(posts, predictions)]
+    scored.sort(key=lambda s: (s.risk_result, s.risk_probability or 0.0), reverse=True)
+    return scored
+
+
+def summarize(scored):
+    flagged = sum(s.risk_result == 1 for s in scored)
+    probabilities = [s.risk_probability for s in scored if s.risk_probability is not None]
+    return {
+        'posts': len(scored),
+        'flagged': flagged,
+        'flagged_fraction': flagged / len(scored) if scored else 0.0,
+        'mean_risk_probability': sum(probabilities) / len(probabilities) if probabilities else None,
+        'max_risk_probability': max(probabilities) if probabilities else None,
+    }
+
+
+def scan_subreddit(reddit, subreddit_name, vectorizer, model, limit=LISTING_LIMIT, memo=None):
+    posts, errors = fetch_subreddit_posts(reddit, subreddit_name, limit=limit)
+    scored = score_posts(posts, vectorizer, model, memo=memo)
+    return ScanResult(subreddit=subreddit_name, scored=scored, summary=summarize(scored), errors=errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every hot/new/top post of one or more subreddits.")
+    parser.add_argument('subreddits', nargs='+')
+    parser.add_argument('--limit', type=int, default=LISTING_LIMIT)
+    parser.add_argument('--top', type=int, default=10, help="number of highest-risk posts to print")
+    args = parser.parse_args()
+
+    import resources
+
+    if resources.REDDIT_FIXTURE:
+        reddit = resources.get_reddit_backend()
+    else:
+        reddit = resources.get_reddit_backend(os.environ['REDDIT_CLIENT_ID'], os.environ['REDDIT_CLIENT_SECRET'],
+                                              os.environ['REDDIT_USER_AGENT'])
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_classifier()
+    memo = resources.get_prediction_memo()
+
+    for name in args.subreddits:
+        result = scan_subreddit(reddit, name, vectorizer, model, limit=args.limit, memo=memo)
+        print(json.dumps({
+            'subreddit': result.subreddit,
+            'summary': result.summary,
+            'errors': result.errors,
+            'top': [s.as_row() for s in result.scored[:args.top]],
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import bdi
+import metrics
+import scan
+
+HOST = '127.0.0.1'
+PORT = 8765
+BATCH_SIZE = 64  # texts per model call
+MAX_WAIT = 0.01  # seconds the first request of a batch waits for others to join it
+WORKERS = 2
+QUEUE_SIZE = 256  # requests waiting per batcher before new ones get 503
+MAX_TEXTS = 1000  # per request
+REQUEST_TIMEOUT = 30.0
+CLIENT_TIMEOUT = 60.0
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    # Requests from many handler threads are queued; each worker takes the oldest,
+    # keeps collecting more until batch_size texts or max_wait seconds, runs fn once
+    # on all of them and hands every request its slice of the output. A full queue
+    # rejects new work instead of letting latency grow without bound.
+    def __init__(self, fn, name, batch_size=BATCH_SIZE, max_wait=MAX_WAIT, workers=WORKERS,
+                 queue_size=QUEUE_SIZE):
+        self.fn = fn
+        self.name = name
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.stats = dict.fromkeys(('requests', 'batches', 'items', 'rejected'), 0)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, items):
+        future = Future()
+        try:
+            self._queue.put_nowait((list(items), future))
+        except queue.Full:
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise Overloaded(f"{self.name} queue is full ({self._queue.maxsize} requests)") from None
+        return future
+
+    def _collect(self, first):
+        batch, size = [first], len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            batch.append(job)
+            size += len(job[0])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            items = [item for job, _ in batch for item in job]
+            try:
+                with metrics.timer(f'service_{self.name}'):
+                    outputs = self.fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for job, future in batch:
+                future.set_result(outputs[start:start + len(job)])
+                start += len(job)
+            with self._lock:
+                self.stats['requests'] += len(batch)
+                self.stats['batches'] += 1
+                self.stats['items'] += len(items)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+
+class ScoringService:
+    # Risk classifier and sentence embedder behind one MicroBatcher each; BDI-II
+    # scoring itself is cheap and runs on the request thread from batched embeddings.
+    def __init__(self, vectorizer, model, embedder, option_bank, memo=None, batch_size=BATCH_SIZE,
+                 max_wait=MAX_WAIT, workers=WORKERS, queue_size=QUEUE_SIZE, info=None):
+        self.option_bank = option_bank
+        self.cascade = model if hasattr(model, 'gate') else None  # cascade.CascadeModel, for its SVC traffic
+        predict = partial(scan.predict_texts, vectorizer=vectorizer, model=model)
+        risk_fn = predict if memo is None else partial(scan.memoized, predict=predict, memo=memo)
+        self.risk = MicroBatcher(risk_fn, 'risk', batch_size, max_wait, workers, queue_size)
+        self.encode = MicroBatcher(lambda texts: embedder.encode(texts, batch_size=batch_size,
+                                                                 convert_to_numpy=True),
+                                   'encode', batch_size, max_wait, workers, queue_size)
+        self.info = info or {}
+
+    def predict_texts(self, texts, timeout=REQUEST_TIMEOUT):
+        return self.risk.submit(texts).result(timeout)
+
+    def embed(self, texts, timeout=REQUEST_TIMEOUT):
+        return np.asarray(self.encode.submit(texts).result(timeout), dtype=np.float32)
+
+    def assess(self, texts, timeout=REQUEST_TIMEOUT):
+        scorer = bdi.BDIScorer(self.option_bank)
+        scorer.add(self.embed(texts, timeout), texts)
+        return scorer.result()
+
+    def report(self):
+        report = {**self.info,
+                  'risk': {**self.risk.stats, 'queue_depth': self.risk.depth()},
+                  'encode': {**self.encode.stats, 'queue_depth': self.encode.depth()}}
+        if self.cascade is not None:
+            report['cascade'] = self.cascade.report()
+        return report
+
+    def close(self):
+        self.risk.close()
+        self.encode.close()
+
+
+def assessment_json(assessment):
+    return {
+        'total': assessment.total,
+        'severity': bdi.severity(assessment.total)[0],
+        'posts': assessment.posts,
+        'breakdown': [[question, score] for question, score in assessment.breakdown],
+        'unmatched': assessment.unmatched,
+        'top_items': [[question, score, items] for question, score, items in assessment.top_items],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None  # set by serve()
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, content_type='application/json', headers=()):
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            self._send(200, self.service.report())
+        elif self.path == '/metrics':
+            self._send(200, metrics.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        routes = {
+            '/v1/risk': lambda texts: {'predictions': [[result, probability] for result, probability
+                                                       in self.service.predict_texts(texts)]},
+            '/v1/encode': lambda texts: {'embeddings': self.service.embed(texts).tolist()},
+            '/v1/bdi': lambda texts: assessment_json(self.service.assess(texts)),
+        }
+        if self.path not in routes:
+            self._send(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            texts = json.loads(self.rfile.read(length))['texts']
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("'texts' must be a list of strings")
+            if not texts or len(texts) > MAX_TEXTS:
+                raise ValueError(f"'texts' must hold 1-{MAX_TEXTS} items")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        try:
+            with metrics.request(self.path.rsplit('/', 1)[-1]):
+                body = routes[self.path](texts)
+        except Overloaded as e:
+            self._send(503, {'error': str(e)}, headers=[('Retry-After', '1')])
+        except FutureTimeout:
+            self._send(504, {'error': f"not scored within {REQUEST_TIMEOUT:g} s"})
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+        else:
+            self._send(200, body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScoringClient:
+    # What app.py talks to instead of loading the models itself. predict_texts
+    # matches scan.predict_texts' output and encode() matches
+    # SentenceTransformer.encode, so it slots into scan.score_posts(client=...) and
+    # anywhere an embedder is expected. Longer inputs than the server's MAX_TEXTS are
+    # sent as several requests.
+    def __init__(self, url, timeout=CLIENT_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._option_bank = None
+
+    def _call(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e)['error']
+            except Exception:
+                message = e.reason
+            raise RuntimeError(f"scoring service returned {e.code}: {message}") from None
+
+    def info(self):
+        return self._call('/healthz')
+
+    def _chunks(self, texts, batch_size=None):
+        size = min(batch_size or MAX_TEXTS, MAX_TEXTS)
+        return [texts[start:start + size] for start in range(0, len(texts), size)]
+
+    def predict_texts(self, texts):
+        predictions = [prediction for chunk in self._chunks(list(texts))
+                       for prediction in self._call('/v1/risk', {'texts': chunk})['predictions']]
+        return [(int(result), probability) for result, probability in predictions]
+
+    def encode(self, sentences, batch_size=None, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = [np.asarray(self._call('/v1/encode', {'texts': chunk})['embeddings'], dtype=np.float32)
+                      for chunk in self._chunks(texts, batch_size)]
+        embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+    def assess(self, texts):
+        texts = list(texts)
+        if len(texts) <= MAX_TEXTS:
+            return self._call('/v1/bdi', {'texts': texts})
+        # too many for one request: embeddings come from the service chunk by chunk and
+        # are scored here against the service's own option bank, as /v1/bdi would
+        if self._option_bank is None:
+            self._option_bank = bdi.l2_normalize(self.encode(bdi.option_texts()))
+        scorer = bdi.BDIScorer(self._option_bank)
+        for chunk in self._chunks(texts):
+            scorer.add(self.encode(chunk), chunk)
+        return assessment_json(scorer.result())
+
+
+def build_service(batch_size=BATCH_SIZE, max_wait=MAX_WAIT, workers=WORKERS, queue_size=QUEUE_SIZE):
+    import resources
+
+    resources.ensure_nltk_data()
+    vectorizer, model = resources.get_classifier()
+    embedder = resources.get_embedder()
+    info = {'classifier_version': resources.classifier_version(), 'embedder_id': resources.embedder_id()}
+    return ScoringService(vectorizer, model, embedder, resources.get_bdi_option_bank(embedder),
+                          resources.get_prediction_memo(), batch_size, max_wait, workers, queue_size, info)
+
+
+def serve(service, host=HOST, port=PORT):
+    Handler.service = service
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON service batching risk and BDI-II scoring "
+                                                 "across concurrent requests.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT * 1000)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    args = parser.parse_args()
+
+    service = build_service(args.batch_size, args.max_wait_ms / 1000, args.workers, args.queue_size)
+    server = serve(service, args.host, args.port)
+    print(f"scoring service on http://{args.host}:{server.server_port} "
+          f"(batch {args.batch_size}, wait {args.max_wait_ms:g} ms, {args.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import bdi
+
+DIM = 32
+
+
+@pytest.fixture(scope='module')
+def embeddings():
+    # every post leans towards one option per question, so most questions clear the
+    # threshold with a non-zero score and the total is not trivially 0
+    rng = np.random.default_rng(0)
+    option_bank = bdi.l2_normalize(rng.standard_normal((len(bdi.option_texts()), DIM)))
+    chosen = np.arange(bdi.NUM_QUESTIONS) * bdi.NUM_OPTIONS + rng.integers(0, bdi.NUM_OPTIONS, bdi.NUM_QUESTIONS)
+    profile = bdi.l2_normalize(option_bank[chosen].sum(axis=0, keepdims=True))
+    posts = profile + 0.5 * rng.standard_normal((500, DIM)).astype(np.float32)
+    return posts, option_bank
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 64, 499])
+def test_streaming_matches_one_shot(embeddings, batch_size):
+    posts, option_bank = embeddings
+    one_shot = bdi.score_embeddings(posts, option_bank)
+
+    scorer = bdi.BDIScorer(option_bank)
+    for start in range(0, len(posts), batch_size):
+        scorer.add(posts[start:start + batch_size])
+    streamed = scorer.result()
+
+    assert one_shot.total > 0
+    assert streamed.posts == one_shot.posts == len(posts)
+    assert streamed.total == one_shot.total
+    assert streamed.breakdown == one_shot.breakdown
+    assert streamed.unmatched == one_shot.unmatched
+    assert streamed.top_posts == one_shot.top_posts
+    np.testing.assert_allclose(streamed.option_means, one_shot.option_means, rtol=0, atol=1e-5)
+
+
+def test_score_stream_keeps_items(embeddings):
+    posts, option_bank = embeddings
+    texts = [f"post {i}" for i in range(len(posts))]
+    streamed = bdi.score_stream(bdi.encode_batches(texts, lambda batch: posts[[int(t.split()[1]) for t in batch]]),
+                                option_bank)
+    one_shot = bdi.score_embeddings(posts, option_bank)
+    assert streamed.total == one_shot.total
+    assert [(q, s, [texts[i] for i in idx]) for q, s, idx in one_shot.top_posts] == streamed.top_items
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+import classifier
+import model_export
+
+
+@pytest.fixture(scope='module')
+def toy_stack():
+    # non-negative sparse rows like TF-IDF output, with a signal the stack can learn
+    rng = np.random.default_rng(0)
+    X = sp.random(300, 40, density=0.2, format='csr', random_state=1, dtype=np.float64)
+    y = (X[:, :5].sum(axis=1).A1 + 0.1 * rng.standard_normal(300) > X[:, 5:10].sum(axis=1).A1).astype(int)
+    model = classifier.build_stacking_model()
+    model.fit(X[:200], y[:200])
+    return model, X[200:]
+
+
+def test_pairwise_coupling_matches_libsvm(toy_stack):
+    model, X = toy_stack
+    svc = model_export._members(model)['svc']
+    compact = model_export.CompactStackingModel(model_export.export_arrays(model))
+    np.testing.assert_allclose(compact.svc_proba(X), svc.predict_proba(X)[:, 1], rtol=0, atol=1e-9)
+
+
+def test_compact_model_matches_sklearn(toy_stack):
+    model, X = toy_stack
+    compact = model_export.CompactStackingModel(model_export.export_arrays(model))
+    np.testing.assert_allclose(compact.predict_proba(X), model.predict_proba(X), rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(compact.predict(X), model.predict(X))
+
+
+def test_exported_bundle_round_trips(toy_stack, tmp_path):
+    model, X = toy_stack
+    path = str(tmp_path / 'model.npz')
+    model_export.export_model(model, path)
+    compact = model_export.load_model(path)
+    np.testing.assert_allclose(compact.predict_proba(X), model.predict_proba(X), rtol=0, atol=1e-9)
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+import classifier
+import model_store
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+sentence_transformers = pytest.importorskip('sentence_transformers')
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'i', 'feel', 'sad', 'happy', 'tired', 'today', 'very',
+         'alone', 'fine', 'not', 'so']
+SENTENCES = ['i feel sad today', 'very happy', 'i am not fine', 'so tired and alone', 'today']
+
+
+def tiny_embedder(directory):
+    # a randomly initialised two-layer BERT over a hand-written vocabulary, so nothing
+    # is downloaded; BertModel keeps position_ids as a non-persistent buffer, which is
+    # the case load_embedder has to patch in by hand
+    vocab_path = os.path.join(directory, 'vocab.txt')
+    with open(vocab_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(VOCAB) + '\n')
+    config = transformers.BertConfig(vocab_size=len(VOCAB), hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64, max_position_embeddings=64)
+    torch.manual_seed(0)
+    transformers.BertModel(config).save_pretrained(directory)
+    transformers.BertTokenizer(vocab_path).save_pretrained(directory)
+    word = sentence_transformers.models.Transformer(directory, max_seq_length=32)
+    pooling = sentence_transformers.models.Pooling(word.get_word_embedding_dimension())
+    return sentence_transformers.SentenceTransformer(modules=[word, pooling], device='cpu')
+
+
+def toy_classifier():
+    texts = [f"i feel {word} today" for word in ('sad', 'alone', 'tired', 'not fine')] * 5 + \
+            [f"i feel {word} today" for word in ('happy', 'fine', 'so happy', 'very fine')] * 5
+    labels = np.array([1] * 20 + [0] * 20)
+    vectorizer = classifier.build_vectorizer()
+    model = classifier.build_stacking_model()
+    model.fit(vectorizer.fit_transform(texts), labels)
+    return vectorizer, model
+
+
+def test_published_embedder_encodes_like_the_original(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    embedder = tiny_embedder(str(source))
+    vectorizer, model = toy_classifier()
+
+    store = model_store.ModelStore(str(tmp_path / 'store'))
+    version = store.publish(vectorizer, model, embedder, 'tiny-bert')
+    loaded = model_store.load_embedder(store.embedder_path(version))
+
+    assert not any(t.is_meta for t in list(loaded.parameters()) + list(loaded.buffers()))
+    np.testing.assert_allclose(loaded.encode(SENTENCES, convert_to_numpy=True),
+                               embedder.encode(SENTENCES, convert_to_numpy=True), rtol=0, atol=1e-6)
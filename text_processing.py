@@ -0,0 +1,72 @@
+import string
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem.porter import PorterStemmer
+
+STEM_CACHE_SIZE = 200_000
+
+
+class TextNormalizer:
+    # Same steps as the notebook's transform_text (lower, tokenize, keep alnum, drop
+    # stopwords/punctuation, Porter stem) so vectorizer.pkl stays valid, but with the
+    # stopword list turned into a set once and stems memoised.
+    def __init__(self, stem_cache_size=STEM_CACHE_SIZE):
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.punctuation = string.punctuation
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def normalize(self, text):
+        stop_words = self.stop_words
+        punctuation = self.punctuation
+        stem = self.stem
+        tokens = nltk.word_tokenize(text.lower())
+        return " ".join(stem(i) for i in tokens
+                        if i.isalnum() and i not in stop_words and i not in punctuation)
+
+    def normalize_batch(self, texts, n_jobs=1, chunksize=256, pool=None):
+        # pass a long-lived pool from normalizer_pool() when calling this repeatedly
+        if pool is not None:
+            return list(pool.map(_normalize_in_worker, texts, chunksize=chunksize))
+        if n_jobs == 1:
+            return [self.normalize(text) for text in texts]
+        with normalizer_pool(n_jobs) as pool:
+            return list(pool.map(_normalize_in_worker, texts, chunksize=chunksize))
+
+    def cache_info(self):
+        return self.stem.cache_info()
+
+
+_default = None
+_worker = None
+
+
+def get_normalizer():
+    global _default
+    if _default is None:
+        _default = TextNormalizer()
+    return _default
+
+
+def normalizer_pool(n_jobs):
+    return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker)
+
+
+def _init_worker():
+    global _worker
+    _worker = TextNormalizer()
+
+
+def _normalize_in_worker(text):
+    return _worker.normalize(text)
+
+
+def transform_text(text):
+    return get_normalizer().normalize(text)
+
+
+def transform_texts(texts, n_jobs=1, chunksize=256, pool=None):
+    return get_normalizer().normalize_batch(texts, n_jobs=n_jobs, chunksize=chunksize, pool=pool)
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.ensemble import (BaggingClassifier, ExtraTreesClassifier, GradientBoostingClassifier,
+                              RandomForestClassifier)
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+
+import classifier
+from fileio import atomic_write
+from text_processing import normalizer_pool, transform_texts
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, '.cache', 'training')
+NORMALIZER_VERSION = 1  # bump when TextNormalizer's output changes so cached text is rebuilt
+
+
+def candidate_models():
+    # The notebook's comparison set; xgboost is only included when it is installed.
+    candidates = {
+        'SVC': lambda: SVC(kernel='sigmoid', gamma=1.0),
+        'KNN': lambda: KNeighborsClassifier(),
+        'NB': lambda: MultinomialNB(),
+        'DT': lambda: DecisionTreeClassifier(max_depth=5),
+        'LR': lambda: LogisticRegression(solver='liblinear', penalty='l1'),
+        'RF': lambda: RandomForestClassifier(n_estimators=50, random_state=2),
+        'BgC': lambda: BaggingClassifier(n_estimators=50, random_state=2),
+        'ETC': lambda: ExtraTreesClassifier(n_estimators=50, random_state=2),
+        'GBDT': lambda: GradientBoostingClassifier(n_estimators=50, random_state=2),
+    }
+    try:
+        from xgboost import XGBClassifier
+        candidates['xgb'] = lambda: XGBClassifier(n_estimators=50, random_state=2)
+    except ImportError:
+        pass
+    return candidates
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _dump(obj, path):
+    with atomic_write(path) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def normalized_dataset(data_path, n_jobs=1, cache_dir=CACHE_DIR, log=print):
+    # Cleaned + normalised texts and labels, cached under the CSV's content hash.
+    key = cache_key(file_hash(data_path), NORMALIZER_VERSION)
+    path = os.path.join(cache_dir, f'normalized-{key}.pkl')
+    if os.path.exists(path):
+        log(f"normalized text: cache hit ({path})")
+        return key, _load(path)
+
+    texts, labels = classifier.load_dataset(data_path)
+    start = time.perf_counter()
+    if n_jobs == 1:
+        normalized = transform_texts(texts)
+    else:
+        with normalizer_pool(n_jobs) as pool:
+            normalized = transform_texts(texts, pool=pool, chunksize=1024)
+    log(f"normalized {len(texts)} posts in {time.perf_counter() - start:.1f} s")
+    os.makedirs(cache_dir, exist_ok=True)
+    _dump((normalized, labels), path)
+    return key, (normalized, labels)
+
+
+def tfidf_features(data_key, normalized, labels, max_features=classifier.MAX_FEATURES,
+                   test_size=classifier.TEST_SIZE, random_state=classifier.RANDOM_STATE, cache_dir=CACHE_DIR,
+                   log=print):
+    # Train/test split and sparse float32 TF-IDF fitted on the training split only,
+    # cached as .npz matrices next to the fitted vectorizer.
+    key = cache_key(data_key, max_features, test_size, random_state)
+    prefix = os.path.join(cache_dir, f'tfidf-{key}')
+    if os.path.exists(prefix + '.pkl'):
+        log(f"tfidf: cache hit ({prefix}.pkl)")
+        vectorizer, y_train, y_test = _load(prefix + '.pkl')
+        X_train, X_test = sp.load_npz(prefix + '-train.npz'), sp.load_npz(prefix + '-test.npz')
+        # joblib hands workers read-only memmaps, so mark the matrices canonical here
+        # rather than letting each estimator try to sort them in place
+        X_train.sum_duplicates()
+        X_test.sum_duplicates()
+        return vectorizer, X_train, X_test, y_train, y_test
+
+    train_texts, test_texts, y_train, y_test = train_test_split(
+        normalized, labels, test_size=test_size, random_state=random_state)
+    vectorizer = classifier.build_vectorizer(max_features)
+    X_train = vectorizer.fit_transform(train_texts)
+    X_test = vectorizer.transform(test_texts)
+    for suffix, X in (('-train.npz', X_train), ('-test.npz', X_test)):
+        with atomic_write(prefix + suffix) as f:
+            sp.save_npz(f, X)
+    _dump((vectorizer, y_train, y_test), prefix + '.pkl')
+    return vectorizer, X_train, X_test, y_train, y_test
+
+
+def _fit_and_score(name, model, X_train, y_train, X_test, y_test):
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    scores = classifier.evaluate(model, X_test, y_test)
+    scores['confusion_matrix'] = confusion_matrix(y_test, classifier.predict(model, X_test)).tolist()
+    return name, model, {**scores, 'fit_seconds': fit_seconds}
+
+
+def compare_candidates(names, X_train, y_train, X_test, y_test, n_jobs=-1):
+    # One process per candidate; results sorted by F1 like the notebook's performance_df.
+    factories = candidate_models()
+    unknown = set(names) - set(factories)
+    if unknown:
+        raise ValueError(f"unknown candidates: {', '.join(sorted(unknown))} (known: {', '.join(factories)})")
+    fitted = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score)(name, factories[name](), X_train, y_train, X_test, y_test) for name in names)
+    return sorted(({'algorithm': name, **scores} for name, _, scores in fitted), key=lambda row: -row['f1'])
+
+
+def train(data_path, out_dir, candidates=(), n_jobs=-1, max_features=classifier.MAX_FEATURES,
+          cache_dir=CACHE_DIR, log=print, check_dense=False):
+    # Writes vectorizer.pkl, model.pkl (same objects the app loads) and report.json.
+    stages = {}
+    start = time.perf_counter()
+    data_key, (normalized, labels) = normalized_dataset(data_path, os.cpu_count() if n_jobs == -1 else n_jobs,
+                                                        cache_dir, log)
+    stages['normalize_seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorizer, X_train, X_test, y_train, y_test = tfidf_features(data_key, normalized, labels, max_features,
+                                                                  cache_dir=cache_dir, log=log)
+    stages['tfidf_seconds'] = time.perf_counter() - start
+
+    comparison = []
+    if candidates:
+        start = time.perf_counter()
+        comparison = compare_candidates(candidates, X_train, y_train, X_test, y_test, n_jobs)
+        stages['candidates_seconds'] = time.perf_counter() - start
+        for row in comparison:
+            log(f"{row['algorithm']:<6} accuracy {row['accuracy']:.4f}  precision {row['precision']:.4f}  "
+                f"f1 {row['f1']:.4f}  ({row['fit_seconds']:.1f} s)")
+
+    start = time.perf_counter()
+    # StackingClassifier fits its base models' cross-validation in parallel
+    _, model, stacking = _fit_and_score('stacking', classifier.build_stacking_model(n_jobs=n_jobs),
+                                        X_train, y_train, X_test, y_test)
+    stages['stacking_seconds'] = time.perf_counter() - start
+    log(f"stacking accuracy {stacking['accuracy']:.4f}  precision {stacking['precision']:.4f}  "
+        f"f1 {stacking['f1']:.4f}  ({stacking['fit_seconds']:.1f} s)")
+    if check_dense:
+        stacking['sparse_dense_agreement'] = classifier.dense_agreement(model, X_test)
+        log(f"sparse/dense agreement: {stacking['sparse_dense_agreement']:.6f}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    _dump(vectorizer, os.path.join(out_dir, 'vectorizer.pkl'))
+    _dump(model, os.path.join(out_dir, 'model.pkl'))
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'data': {'path': data_path, 'key': data_key, 'posts': len(labels), 'train': X_train.shape[0],
+                 'test': X_test.shape[0], 'positive_rate': float(np.mean(labels))},
+        'max_features': max_features,
+        'n_jobs': n_jobs,
+        'stacking': stacking,
+        'candidates': comparison,
+        'stages': stages,
+    }
+    with open(os.path.join(out_dir, 'report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train vectorizer.pkl/model.pkl with cached features and "
+                                                 "parallel model fitting.")
+    parser.add_argument('--data', default='Suicide_Detection.csv')
+    parser.add_argument('--out-dir', default='build')
+    parser.add_argument('--max-features', type=int, default=classifier.MAX_FEATURES)
+    parser.add_argument('--jobs', type=int, default=-1)
+    parser.add_argument('--candidates', nargs='*', default=[],
+                        help="also compare these notebook models ('all' for every one)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--check-dense', action='store_true',
+                        help="also check the model labels the test set the same from sparse and dense input")
+    args = parser.parse_args()
+
+    import resources
+    resources.ensure_nltk_data()
+
+    candidates = list(candidate_models()) if args.candidates == ['all'] else args.candidates
+    train(args.data, args.out_dir, candidates, args.jobs, args.max_features, args.cache_dir,
+          check_dense=args.check_dense)
+    print(f"wrote {args.out_dir}/vectorizer.pkl, model.pkl and report.json "
+          f"(use VECTORIZER_PATH/MODEL_PATH to serve them)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # no fcntl on Windows: writers are then only serialised within a process
+    fcntl = None
+
+import bdi
+from fileio import atomic_write
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(BASE_DIR, '.cache', 'post_index')
+
+FORMAT_VERSION = 1
+NPROBE = 8
+TOP_K = 10
+MIN_TRAIN_ROWS = 4096  # below this everything is searched flat
+TAIL_LIMIT = 20_000  # unclustered rows tolerated before compact() folds them into the lists
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 32
+CHUNK_ROWS = 65_536
+QUANT_CLIP = 0.5  # int8 codes cover [-QUANT_CLIP, QUANT_CLIP] of a unit-norm vector's components
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    username TEXT,
+    text TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+"""
+
+
+def default_nlist(rows):
+    return int(min(1024, max(16, 4 * np.sqrt(rows))))
+
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    # spherical Lloyd's on a sample: centroids stay unit-norm so assignment is argmax dot
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = bdi.l2_normalize(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = bdi.l2_normalize(sums)
+    return centroids
+
+
+class PostIndex:
+    # On-disk IVF index over unit-norm post embeddings, stored as int8 codes (or float32
+    # with quantize=False). The clustered part lives in main_vectors.npy sorted by list,
+    # with offsets per list, and is memory-mapped for search. New rows are appended to
+    # a flat tail that is scanned exhaustively until compact() re-clusters everything.
+    # Metadata (text hash key, username, text) is kept in SQLite.
+    # Any number of processes may add(), compact() and search() the same directory.
+    # Writers take an flock on write.lock and re-read index.json under it, so each one
+    # starts from what the last one committed. index.json is the commit point: add()
+    # first drops whatever a crashed add() wrote past it, and compact() writes the next
+    # generation of main/tail files beside the current one, so a crash before the
+    # commit leaves the current files untouched. Readers re-read index.json whenever
+    # it changes.
+    def __init__(self, path=INDEX_DIR, quantize=True):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, 'meta.sqlite3'), check_same_thread=False)
+        with self._file_lock():  # switching a new database to WAL does not wait for other openers
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+        self._stamp = self._info_stamp()
+        self.info = self._read_info() or {'version': FORMAT_VERSION, 'dim': None, 'quantize': quantize,
+                                          'nlist': 0, 'main_rows': 0, 'tail_rows': 0, 'last_row': 0,
+                                          'generation': 0}
+        self._open_main()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _data_file(self, name, info=None):
+        # main/tail files carry the generation compact() wrote them in; generation 0
+        # keeps the plain names indexes had before generations existed
+        generation = (info or self.info).get('generation', 0)
+        if not generation:
+            return self._file(name)
+        stem, ext = os.path.splitext(name)
+        return self._file(f"{stem}-{generation}{ext}")
+
+    def _info_stamp(self):
+        # index.json is only ever replaced, never rewritten in place, so a new commit
+        # always shows up as a new inode
+        try:
+            st = os.stat(self._file('index.json'))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _refresh(self, force=False):
+        # picks up what other processes committed since this one last looked
+        stamp = self._info_stamp()
+        if stamp == self._stamp and not force:
+            return
+        info = self._read_info()
+        if info is not None:
+            if (info.get('generation', 0), info['main_rows']) != (self.info.get('generation', 0),
+                                                                  self.info['main_rows']):
+                self._open_main(info)
+            self.info = info
+        self._stamp = stamp
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with open(self._file('write.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file closes
+            yield
+
+    @contextlib.contextmanager
+    def _writing(self):
+        # one writer at a time across threads (self._lock) and processes (write.lock)
+        with self._lock, self._file_lock():
+            self._refresh(force=True)
+            yield
+
+    def _read_info(self):
+        try:
+            with open(self._file('index.json'), encoding='utf-8') as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            return None
+        if info['version'] != FORMAT_VERSION:
+            raise ValueError(f"index format {info['version']} is not supported (expected {FORMAT_VERSION})")
+        return info
+
+    def _write_info(self, info=None):
+        with atomic_write(self._file('index.json'), 'w') as f:
+            json.dump(info or self.info, f)
+
+    @property
+    def dtype(self):
+        return np.int8 if self.info['quantize'] else np.float32
+
+    def _open_main(self, info=None):
+        info = info or self.info
+        if info['main_rows']:
+            main = (np.load(self._data_file('centroids.npy', info)),
+                    np.load(self._data_file('offsets.npy', info)),
+                    np.load(self._data_file('main_vectors.npy', info), mmap_mode='r'),
+                    np.load(self._data_file('main_rows.npy', info), mmap_mode='r'))
+        else:
+            main = (None,) * 4
+        self.centroids, self.offsets, self.main_vectors, self.main_rows = main
+
+    def _repair(self):
+        # tail bytes and metadata rows beyond what index.json records come from an
+        # add() that died before committing; appending after them would misalign rows
+        dim = self.info['dim'] or 0
+        rows = self.info['tail_rows']
+        for name, size in (('tail_vectors.bin', rows * dim * np.dtype(self.dtype).itemsize),
+                           ('tail_rows.bin', rows * 8)):
+            path = self._data_file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        if 'last_row' in self.info:
+            with self._conn:
+                self._conn.execute('DELETE FROM rows WHERE row > ?', (self.info['last_row'],))
+
+    def _tail(self):
+        rows = self.info['tail_rows']
+        if not rows:
+            return np.empty((0, self.info['dim'] or 0), dtype=self.dtype), np.empty(0, dtype=np.int64)
+        vectors = np.memmap(self._data_file('tail_vectors.bin'), dtype=self.dtype, mode='r',
+                            shape=(rows, self.info['dim']))
+        row_ids = np.memmap(self._data_file('tail_rows.bin'), dtype=np.int64, mode='r', shape=(rows,))
+        return vectors, row_ids
+
+    def _encode(self, vectors):
+        vectors = bdi.l2_normalize(vectors)
+        if not self.info['quantize']:
+            return vectors
+        return np.clip(np.rint(vectors * (127 / QUANT_CLIP)), -127, 127).astype(np.int8)
+
+    def _decode(self, codes):
+        if not self.info['quantize']:
+            return np.asarray(codes, dtype=np.float32)
+        return np.asarray(codes, dtype=np.float32) * (QUANT_CLIP / 127)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self.info['main_rows'] + self.info['tail_rows']
+
+    def add(self, embeddings, texts, keys=None, username=None, auto_compact=True):
+        # Inserts posts not indexed yet (keyed by text hash unless keys are given);
+        # returns how many were new.
+        import post_cache
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        keys = keys or [post_cache.text_hash(text) for text in texts]
+        with self._writing():
+            self._repair()
+            if self.info['dim'] is None:
+                self.info['dim'] = int(embeddings.shape[1])
+            elif embeddings.shape[1] != self.info['dim']:
+                raise ValueError(f"expected {self.info['dim']}-d embeddings, got {embeddings.shape[1]}")
+
+            known = set()
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                known.update(k for k, in self._conn.execute(
+                    f"SELECT key FROM rows WHERE key IN ({','.join('?' * len(batch))})", batch))
+            new = []
+            for i, key in enumerate(keys):
+                if key not in known:
+                    known.add(key)
+                    new.append(i)
+            if not new:
+                return 0
+
+            # vectors, then metadata, then index.json, each on disk before the next: a
+            # crash at any point leaves extra bytes/rows that _repair() removes, never a gap
+            first_row, = self._conn.execute('SELECT COALESCE(MAX(row), 0) + 1 FROM rows').fetchone()
+            row_ids = list(range(first_row, first_row + len(new)))
+            with open(self._data_file('tail_vectors.bin'), 'ab') as f:
+                f.write(self._encode(embeddings[new]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._data_file('tail_rows.bin'), 'ab') as f:
+                f.write(np.asarray(row_ids, dtype=np.int64).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            now = time.time()
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT INTO rows (row, key, username, text, added_at) VALUES (?, ?, ?, ?, ?)',
+                    [(row, keys[i], username, texts[i], now) for row, i in zip(row_ids, new)])
+            self.info['tail_rows'] += len(new)
+            self.info['last_row'] = row_ids[-1]
+            self._write_info()
+
+        if auto_compact and self.info['tail_rows'] > TAIL_LIMIT:
+            self.compact()
+        return len(new)
+
+    def _iter_all(self):
+        # (codes, row ids) chunks over main then tail
+        if self.info['main_rows']:
+            for start in range(0, self.info['main_rows'], CHUNK_ROWS):
+                yield self.main_vectors[start:start + CHUNK_ROWS], self.main_rows[start:start + CHUNK_ROWS]
+        tail_vectors, tail_rows = self._tail()
+        for start in range(0, len(tail_rows), CHUNK_ROWS):
+            yield tail_vectors[start:start + CHUNK_ROWS], tail_rows[start:start + CHUNK_ROWS]
+
+    def compact(self, nlist=None, retrain=None):
+        # Re-clusters when the index has grown well past the size the centroids were
+        # trained on (or was never trained), then writes main + tail sorted by list as
+        # the next generation, which index.json switches to in one commit.
+        with self._writing():
+            total = self.info['main_rows'] + self.info['tail_rows']
+            if total < MIN_TRAIN_ROWS:
+                return False
+            trained_on = self.info.get('trained_rows', 0)
+            if retrain is None:
+                retrain = self.centroids is None or total >= 4 * trained_on
+            if retrain:
+                nlist = nlist or default_nlist(total)
+                rng = np.random.default_rng(0)
+                picks = np.sort(rng.choice(total, min(total, nlist * KMEANS_SAMPLE_PER_LIST), replace=False))
+                centroids = kmeans(self._sample(picks), nlist)
+                assign = np.concatenate([(self._decode(codes) @ centroids.T).argmax(axis=1).astype(np.int32)
+                                         for codes, _ in self._iter_all()])
+            else:
+                # main rows keep their lists, only the tail needs assigning
+                centroids = self.centroids
+                tail_vectors, _ = self._tail()
+                assign = np.concatenate(
+                    [np.repeat(np.arange(len(centroids), dtype=np.int32), np.diff(self.offsets))] +
+                    [(self._decode(tail_vectors[s:s + CHUNK_ROWS]) @ centroids.T).argmax(axis=1).astype(np.int32)
+                     for s in range(0, len(tail_vectors), CHUNK_ROWS)])
+            order = np.argsort(assign, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+
+            # no reader or other writer opens this generation until index.json names it,
+            # and files a crashed compact() left under its name are simply overwritten
+            info = {**self.info, 'generation': self.info.get('generation', 0) + 1, 'nlist': len(centroids),
+                    'main_rows': total, 'tail_rows': 0}
+            if retrain:
+                info['trained_rows'] = total
+            new_vectors = np.lib.format.open_memmap(self._data_file('main_vectors.npy', info), mode='w+',
+                                                    dtype=self.dtype, shape=(total, self.info['dim']))
+            new_rows = np.lib.format.open_memmap(self._data_file('main_rows.npy', info), mode='w+',
+                                                 dtype=np.int64, shape=(total,))
+            position = np.empty(total, dtype=np.int64)
+            position[order] = np.arange(total)
+            start = 0
+            for codes, row_ids in self._iter_all():
+                target = position[start:start + len(row_ids)]
+                new_vectors[target] = codes
+                new_rows[target] = row_ids
+                start += len(row_ids)
+            new_vectors.flush()
+            new_rows.flush()
+            del new_vectors, new_rows
+            for name, array in (('centroids.npy', centroids), ('offsets.npy', offsets)):
+                with atomic_write(self._data_file(name, info)) as f:
+                    np.save(f, array)
+
+            self._write_info(info)
+            old_info = self.info
+            self._open_main(info)
+            self.info = info
+            self._stamp = self._info_stamp()
+            # processes still mapping the old generation keep reading it until they refresh
+            for name in ('centroids.npy', 'offsets.npy', 'main_vectors.npy', 'main_rows.npy',
+                         'tail_vectors.bin', 'tail_rows.bin'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._data_file(name, old_info))
+            return True
+
+    def _sample(self, picks):
+        sample, start, i = [], 0, 0
+        for codes, row_ids in self._iter_all():
+            end = start + len(row_ids)
+            j = np.searchsorted(picks, end)
+            sample.append(self._decode(codes[picks[i:j] - start]))
+            i, start = j, end
+        return np.concatenate(sample)
+
+    def _top(self, scores, row_ids, k):
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k)[:k]
+            scores, row_ids = scores[keep], row_ids[keep]
+        order = np.argsort(-scores, kind='stable')
+        return scores[order], row_ids[order]
+
+    def search_rows(self, queries, k=TOP_K, nprobe=NPROBE, exact=False):
+        # -> list of (scores, row ids) per query, best first
+        queries = bdi.l2_normalize(np.atleast_2d(queries))
+        with self._lock:
+            self._refresh()
+            try:
+                return self._search_rows(queries, k, nprobe, exact)
+            except FileNotFoundError:
+                # another process compacted between our look at index.json and opening
+                # the generation it named
+                self._refresh(force=True)
+                return self._search_rows(queries, k, nprobe, exact)
+
+    def _search_rows(self, queries, k, nprobe, exact):
+        results = []
+        tail_vectors, tail_rows = self._tail()
+        for query in queries:
+            scores, rows = [], []
+            if exact:
+                for codes, row_ids in self._iter_all():
+                    scores.append(self._decode(codes) @ query)
+                    rows.append(np.asarray(row_ids))
+            else:
+                if self.centroids is not None:
+                    probe = np.argsort(-(self.centroids @ query))[:nprobe]
+                    for lst in probe:
+                        lo, hi = self.offsets[lst], self.offsets[lst + 1]
+                        if hi > lo:
+                            scores.append(self._decode(self.main_vectors[lo:hi]) @ query)
+                            rows.append(np.asarray(self.main_rows[lo:hi]))
+                if len(tail_rows):
+                    scores.append(self._decode(tail_vectors) @ query)
+                    rows.append(np.asarray(tail_rows))
+            if scores:
+                results.append(self._top(np.concatenate(scores), np.concatenate(rows), k))
+            else:
+                results.append((np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)))
+        return results
+
+    def search(self, queries, k=TOP_K, nprobe=NPROBE, exact=False):
+        # -> per query, a list of {'score', 'username', 'text', 'key'} best first
+        hits = []
+        for scores, row_ids in self.search_rows(queries, k, nprobe, exact):
+            with self._lock:
+                meta = {row: (key, username, text) for row, key, username, text in self._conn.execute(
+                    f"SELECT row, key, username, text FROM rows WHERE row IN ({','.join('?' * len(row_ids))})",
+                    [int(r) for r in row_ids])} if len(row_ids) else {}
+            hits.append([{'score': float(score), 'key': meta[int(row)][0], 'username': meta[int(row)][1],
+                          'text': meta[int(row)][2]} for score, row in zip(scores, row_ids) if int(row) in meta])
+        return hits
+
+    def report(self):
+        with self._lock:
+            self._refresh()
+            return {**self.info, 'rows': len(self), 'path': self.path}
+
+
+def benchmark(rows=1_000_000, dim=384, queries=100, k=TOP_K, nprobes=(1, 4, 8, 16, 32), quantize=True,
+              clusters=2000, seed=0, path=None):
+    # Synthetic clustered unit vectors; recall@k of the IVF search against an exact scan
+    # of the same (quantised) index, plus per-query latency.
+    rng = np.random.default_rng(seed)
+    centers = bdi.l2_normalize(rng.normal(size=(clusters, dim)))
+
+    def draw(n):
+        return bdi.l2_normalize(centers[rng.integers(clusters, size=n)] + 0.03 * rng.normal(size=(n, dim)))
+
+    with tempfile.TemporaryDirectory(dir=path) as tmp:
+        index = PostIndex(tmp, quantize=quantize)
+        start = time.perf_counter()
+        for offset in range(0, rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, rows - offset)
+            index.add(draw(n), [''] * n, keys=[str(offset + i) for i in range(n)], auto_compact=False)
+        index.compact()
+        build_seconds = time.perf_counter() - start
+
+        query_vectors = draw(queries)
+        exact = [set(r.tolist()) for _, r in index.search_rows(query_vectors, k, exact=True)]
+        report = {'rows': rows, 'dim': dim, 'k': k, 'quantize': quantize, 'nlist': index.info['nlist'],
+                  'build_seconds': build_seconds, 'probes': []}
+        for nprobe in nprobes:
+            seconds, hits = [], 0
+            for query, truth in zip(query_vectors, exact):
+                t = time.perf_counter()
+                (_, found), = index.search_rows(query, k, nprobe)
+                seconds.append(time.perf_counter() - t)
+                hits += len(truth & set(found.tolist()))
+            seconds = np.array(seconds) * 1000
+            report['probes'].append({'nprobe': nprobe, 'recall': hits / (k * queries),
+                                     'p50_ms': float(np.percentile(seconds, 50)),
+                                     'p95_ms': float(np.percentile(seconds, 95))})
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, query and benchmark the historical post index.")
+    parser.add_argument('--embedder-id', help="index to open (default: the configured embedder's, as the app uses)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('stats')
+    subparsers.add_parser('compact')
+
+    query_parser = subparsers.add_parser('query', help="free-text query (needs the embedder)")
+    query_parser.add_argument('text')
+    query_parser.add_argument('-k', type=int, default=TOP_K)
+    query_parser.add_argument('--nprobe', type=int, default=NPROBE)
+
+    option_parser = subparsers.add_parser('option', help="posts closest to one BDI-II option")
+    option_parser.add_argument('question', type=int, help="question number, 1-21")
+    option_parser.add_argument('option', type=int, help="option score, 0-3")
+    option_parser.add_argument('-k', type=int, default=TOP_K)
+
+    bench_parser = subparsers.add_parser('bench')
+    bench_parser.add_argument('--rows', type=int, default=1_000_000)
+    bench_parser.add_argument('--dim', type=int, default=384)
+    bench_parser.add_argument('--queries', type=int, default=100)
+    bench_parser.add_argument('--float32', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(json.dumps(benchmark(args.rows, args.dim, args.queries, quantize=not args.float32), indent=2))
+        return
+
+    import resources
+    index = resources.get_post_index(args.embedder_id)
+    if args.command == 'stats':
+        print(json.dumps(index.report()))
+    elif args.command == 'compact':
+        index.compact(retrain=True)
+        print(json.dumps(index.report()))
+    else:
+        embedder = resources.get_embedder()
+        if args.command == 'query':
+            query = embedder.encode([args.text], convert_to_numpy=True)
+            hits = index.search(query, args.k, args.nprobe)[0]
+        else:
+            bank = resources.get_bdi_option_bank(embedder)
+            hits = index.search(bank[(args.question - 1) * bdi.NUM_OPTIONS + args.option], args.k)[0]
+        for hit in hits:
+            print(json.dumps(hit, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()